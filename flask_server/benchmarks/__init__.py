@@ -0,0 +1 @@
+""" Timings of the core operations against generated projects, run with `python -m flask_server.benchmarks` """
@@ -0,0 +1,49 @@
+import argparse
+import sys
+
+from flask_server.benchmarks.suite import (REGRESSION_THRESHOLD, REPEAT, compare, load_results, run_in_temp_dir,
+                                           save_results)
+from flask_server.benchmarks.synthetic import SCALES
+from flask_server.src.card_storage import STORAGES, FILE_STORAGE
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m flask_server.benchmarks",
+                                     description="Time the core operations against a generated workspace")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--storage", choices=STORAGES, default=FILE_STORAGE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--only", nargs="*", help="names of the benchmarks to run, all of them by default")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown of a median reported as a regression")
+    parser.add_argument("--keep", action="store_true", help="keep the generated workspace")
+    arguments = parser.parse_args()
+
+    # Read the baseline first, a bad path shouldn't cost a full run
+    baseline = load_results(arguments.baseline) if arguments.baseline else None
+    if baseline and (baseline["scale"], baseline["storage"]) != (arguments.scale, arguments.storage):
+        print(f"BENCHMARKS COMPARE - The baseline ran at scale {baseline['scale']} on {baseline['storage']} storage")
+        return 2
+
+    scale = SCALES[arguments.scale]
+    results = run_in_temp_dir(scale, arguments.keep, storage=arguments.storage, seed=arguments.seed,
+                              repeat=arguments.repeat, only=arguments.only)
+    if arguments.output:
+        save_results(arguments.output, results, arguments.scale, scale, arguments.storage)
+    if not baseline:
+        return 0
+
+    regressions = compare(baseline, results, arguments.threshold)
+    for regression in regressions:
+        print(f"BENCHMARKS COMPARE - {regression.name} regressed: {regression.baseline * 1000:.2f}ms -> "
+              f"{regression.median * 1000:.2f}ms ({regression.ratio:.2f}x)")
+    if not regressions:
+        print(f"BENCHMARKS COMPARE - No regression above {arguments.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+from flask_server.benchmarks.synthetic import HISTORY_BRANCH, PROJECT_NAME, Scale, Workspace, build_workspace
+from flask_server.src import Json, Path
+from flask_server.src.card_editor import CardEditor
+from flask_server.src.card_storage import FILE_STORAGE
+from flask_server.src.commit_history import HISTORY_PAGE_SIZE
+from flask_server.src.images import ImageBank, ImageData
+from flask_server.src.registry import Registry
+
+
+RESULTS_VERSION = 1
+REPEAT = 5
+REGRESSION_THRESHOLD = 0.2
+""" Slowdown of a median, relative to the baseline, reported as a regression """
+NOISE_SECONDS = 0.002
+""" Slowdowns smaller than this are timer noise whatever their ratio """
+EDITED_CARDS = 100
+""" Cards edited before each timed save, and left unsaved while changed cards are listed """
+
+
+@dataclass
+class BenchmarkResult:
+    """ Timings of a benchmark in seconds, over `runs` timed runs """
+    name: str
+    runs: int
+    median: float
+    best: float
+    worst: float
+
+
+@dataclass
+class Regression:
+    name: str
+    baseline: float
+    median: float
+    ratio: float
+
+
+def measure(name: str, run: Callable[[], object], setup: Callable[[], object] | None = None,
+            repeat: int = REPEAT) -> BenchmarkResult:
+    """ Time `run` after one untimed warm up run, `setup` prepares every run outside of the timings """
+    timings = []
+    for attempt in range(repeat + 1):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        run()
+        if attempt:
+            timings.append(time.perf_counter() - started)
+    return BenchmarkResult(name, repeat, statistics.median(timings), min(timings), max(timings))
+
+
+def run_suite(path: Path, scale: Scale, storage: str = FILE_STORAGE, seed: int = 0, repeat: int = REPEAT,
+              only: List[str] | None = None, log: Callable[[str], None] = print) -> List[BenchmarkResult]:
+    """ Generate a workspace in an empty folder and time the core operations against it """
+    started = time.perf_counter()
+    workspace = build_workspace(path, scale, storage, seed)
+    log(f"BENCHMARKS SETUP - Workspace generated in {time.perf_counter() - started:.1f}s")
+
+    bank = ImageBank(workspace.images_path)
+    registry = Registry(workspace.registry_path)
+    try:
+        card_set = registry.get_project(PROJECT_NAME)
+        editor = CardEditor()
+        editor.scope_to_set(card_set)
+        benchmarks = _build_benchmarks(workspace, bank, registry, editor)
+
+        results = []
+        for name, (run, setup) in benchmarks.items():
+            if only and name not in only:
+                continue
+            result = measure(name, run, setup, repeat)
+            log(f"BENCHMARKS RUN - {name}: median {result.median * 1000:.2f}ms, best {result.best * 1000:.2f}ms")
+            results.append(result)
+        return results
+    finally:
+        registry.close()
+        bank.catalog.close()
+
+
+def _build_benchmarks(workspace: Workspace, bank: ImageBank, registry: Registry,
+                      editor: CardEditor) -> Dict[str, tuple]:
+    """ Name every benchmark with its timed run and its untimed setup """
+    card_set = editor.card_set
+    sample_path = Path(os.path.join(workspace.path, "sample.jpg"))
+    shutil.copyfile(bank.get_image_path(workspace.image_uuids[0]), sample_path)
+    renamed = iter(range(sys.maxsize))
+    edits = iter(range(sys.maxsize))
+    branches = [HISTORY_BRANCH, workspace.main_branch]
+
+    def edit_cards():
+        edit = next(edits)
+        for card_uuid in workspace.card_uuids[:EDITED_CARDS]:
+            editor.update_card(card_uuid, Json(json.dumps({"name": f"Edited {edit}", "cost": edit})))
+
+    def switch_branch():
+        branches.reverse()
+        card_set.load_branch(branches[0])
+
+    return {
+        "image_bank.compile_image_list": (bank.compile_image_list, None),
+        "image_bank.import_image": (lambda: bank.import_image(sample_path, "benchmark"), None),
+        "image_bank.write_image_metadata": (lambda: bank.write_image_metadata(
+            workspace.image_uuids[-1], ImageData(f"renamed-{next(renamed)}")), None),
+        "card_editor.get_card_list": (editor.get_card_list, None),
+        "card_editor.get_changed_cards": (editor.get_changed_cards, edit_cards),
+        "card_set.save_changes": (lambda: card_set.save_changes("Benchmark edit"), edit_cards),
+        "card_set.load_branch": (switch_branch, None),
+        "card_set.get_commit_list": (lambda: card_set.get_commit_list(HISTORY_BRANCH, HISTORY_PAGE_SIZE), None),
+        "card_set.get_commit_list_full": (lambda: card_set.get_commit_list(HISTORY_BRANCH), None),
+        "registry.get_project_names": (registry.get_project_names, None),
+    }
+
+
+def save_results(path: Path, results: List[BenchmarkResult], scale_name: str, scale: Scale, storage: str):
+    """ Write results as JSON, with what is needed to tell whether two runs can be compared """
+    document = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "scale": scale_name,
+        "sizes": asdict(scale),
+        "storage": storage,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {result.name: asdict(result) for result in results},
+    }
+    with open(path, "w") as file:
+        json.dump(document, file, indent=2)
+
+
+def load_results(path: Path) -> dict:
+    with open(path, "r") as file:
+        document = json.load(file)
+    if document.get("version") != RESULTS_VERSION:
+        raise ValueError(f"BENCHMARKS LOAD - Unsupported results version in {path}")
+    return document
+
+
+def compare(baseline: dict, results: List[BenchmarkResult],
+            threshold: float = REGRESSION_THRESHOLD) -> List[Regression]:
+    """ Return the benchmarks whose median got slower than the baseline's by more than the threshold """
+    regressions = []
+    for result in results:
+        previous = baseline["results"].get(result.name)
+        if not previous:
+            continue
+        ratio = result.median / previous["median"] if previous["median"] else float("inf")
+        if ratio > 1 + threshold and result.median - previous["median"] > NOISE_SECONDS:
+            regressions.append(Regression(result.name, previous["median"], result.median, ratio))
+    return regressions
+
+
+def run_in_temp_dir(scale: Scale, keep=False, **kwargs) -> List[BenchmarkResult]:
+    """ Run the suite in a temporary folder, deleted afterwards unless it is kept for inspection """
+    path = Path(tempfile.mkdtemp(prefix="card-designer-bench-"))
+    try:
+        return run_suite(path, scale, **kwargs)
+    finally:
+        if keep:
+            print(f"BENCHMARKS RUN - Workspace kept in {path}")
+        else:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,164 @@
+import json
+import os
+import random
+import subprocess
+
+from dataclasses import dataclass
+from typing import List
+from uuid import UUID
+
+from PIL import Image
+
+from flask_server.src import Branch, Json, Path, Project, Uuid
+from flask_server.src.card_editor import CardEditor, CardOperation, CREATE_CARD
+from flask_server.src.card_set import CardSet
+from flask_server.src.card_storage import CARD_EXTENSION, FILE_STORAGE
+from flask_server.src.images import ImageBank
+from flask_server.src.registry import Registry
+
+
+HISTORY_BRANCH = Branch("history")
+""" Branch holding the deep history, it forks from the main branch after the cards were committed """
+PROJECT_NAME = Project("benchmark")
+CARD_BATCH_SIZE = 1000
+IMAGE_SIZE = (96, 128)
+COMMIT_EPOCH = 1700000000
+CARD_TYPES = ("Dino", "Bird", "Fish", "Plant", "Spell")
+AUTHOR_NAME = "Benchmark"
+AUTHOR_EMAIL = "benchmark@example.com"
+
+
+@dataclass
+class Scale:
+    """ Size of a synthetic workspace """
+    cards: int
+    images: int
+    commits: int
+    """ Depth of the history branch, each commit edits one card """
+    projects: int
+    """ Projects in the registry, the benchmark project included """
+
+
+SCALES = {
+    "small": Scale(cards=1_000, images=1_000, commits=200, projects=20),
+    "medium": Scale(cards=10_000, images=10_000, commits=1_000, projects=100),
+    "large": Scale(cards=100_000, images=10_000, commits=5_000, projects=500),
+}
+
+
+@dataclass
+class Workspace:
+    """ A generated image bank and registry, the benchmark project holds the cards and the deep history """
+    path: Path
+    images_path: Path
+    registry_path: Path
+    card_uuids: List[Uuid]
+    image_uuids: List[UUID]
+    main_branch: Branch
+
+
+def build_workspace(path: Path, scale: Scale, storage: str = FILE_STORAGE, seed: int = 0) -> Workspace:
+    """
+    Generate every fixture of a scale in an empty folder. The seed fixes the card fields and image pixels, uuids
+    and commit dates are still new every run, so two workspaces of a seed match in shape and size but not in hashes
+    """
+    rng = random.Random(seed)
+    images_path = Path(os.path.join(path, "images"))
+    registry_path = Path(os.path.join(path, "card_sets"))
+    os.mkdir(images_path)
+    os.mkdir(registry_path)
+
+    image_uuids = build_image_bank(images_path, scale.images, rng)
+    registry = Registry(registry_path)
+    for index in range(scale.projects - 1):
+        registry.create_project(Project(f"project-{index:05}"))
+
+    card_set = CardSet(Path(os.path.join(registry_path, PROJECT_NAME)),
+                       registry.create_project(PROJECT_NAME, storage))
+    try:
+        set_identity(card_set)
+        card_uuids = build_cards(card_set, scale.cards, image_uuids, rng)
+        main_branch = card_set.get_active_branch()
+        if storage == FILE_STORAGE:
+            build_history(card_set, HISTORY_BRANCH, card_uuids, scale.commits, rng)
+        else:
+            # Every commit of a pack rewrites the whole pack, the history is built through the card set instead
+            editor = CardEditor()
+            editor.scope_to_set(card_set)
+            card_set.create_branch(HISTORY_BRANCH, "History started")
+            for index in range(scale.commits):
+                editor.update_card(rng.choice(card_uuids), _make_card(rng, index, image_uuids))
+                card_set.save_changes(f"Edit {index}")
+            card_set.load_branch(main_branch)
+    finally:
+        card_set.close()
+        registry.close()
+
+    return Workspace(path, images_path, registry_path, card_uuids, image_uuids, main_branch)
+
+
+def build_image_bank(path: Path, count: int, rng: random.Random) -> List[UUID]:
+    """ Import small pictures of random colors through the bank, as users would """
+    bank = ImageBank(path)
+    sample_path = Path(os.path.join(os.path.dirname(path), "sample.jpg"))
+    image_uuids = []
+    try:
+        for index in range(count):
+            Image.new("RGB", IMAGE_SIZE, tuple(rng.randrange(256) for _ in range(3))).save(sample_path)
+            image_uuid, _ = bank.import_image(sample_path, f"image-{index}")
+            image_uuids.append(image_uuid)
+    finally:
+        bank.catalog.close()
+        if os.path.exists(sample_path):
+            os.remove(sample_path)
+    return image_uuids
+
+
+def build_cards(card_set: CardSet, count: int, image_uuids: List[UUID], rng: random.Random) -> List[Uuid]:
+    """ Create cards in batches and commit them all at once """
+    editor = CardEditor()
+    editor.scope_to_set(card_set)
+    card_uuids = []
+    for start in range(0, count, CARD_BATCH_SIZE):
+        operations = [CardOperation(CREATE_CARD, card_data=_make_card(rng, index, image_uuids))
+                      for index in range(start, min(start + CARD_BATCH_SIZE, count))]
+        card_uuids.extend(editor.apply_batch(operations))
+    card_set.save_changes("Cards generated")
+    return card_uuids
+
+
+def build_history(card_set: CardSet, branch: Branch, card_uuids: List[Uuid], commits: int, rng: random.Random):
+    """
+    Fork a branch off the checked out commit and stack commits on it, each editing one card file.
+    They are written with `git fast-import`, deep histories would take long through the card set
+    """
+    stream = bytearray()
+    parent = card_set.repo.head.commit.hexsha
+    for index in range(commits):
+        message = f"Edit {index}".encode("utf-8")
+        content = _make_card(rng, index, []).encode("utf-8")
+        stream += f"commit refs/heads/{branch}\n".encode("utf-8")
+        stream += f"committer {AUTHOR_NAME} <{AUTHOR_EMAIL}> {COMMIT_EPOCH + index} +0000\n".encode("utf-8")
+        stream += f"data {len(message)}\n".encode("utf-8") + message + b"\n"
+        if index == 0:
+            stream += f"from {parent}\n".encode("utf-8")
+        stream += f"M 100644 inline {rng.choice(card_uuids)}{CARD_EXTENSION}\n".encode("utf-8")
+        stream += f"data {len(content)}\n".encode("utf-8") + content + b"\n\n"
+
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=card_set.path, input=bytes(stream), check=True)
+
+
+def set_identity(card_set: CardSet):
+    """ Commit as a fixed author, so the generated repos don't depend on the machine's git config """
+    with card_set.repo.config_writer() as config:
+        config.set_value("user", "name", AUTHOR_NAME)
+        config.set_value("user", "email", AUTHOR_EMAIL)
+
+
+def _make_card(rng: random.Random, index: int, image_uuids: List[UUID]) -> Json:
+    card = {"name": f"Card {index}", "type": rng.choice(CARD_TYPES), "cost": rng.randint(0, 10),
+            "stats": {"power": rng.randint(0, 12), "health": rng.randint(1, 12)},
+            "text": " ".join(rng.choice(("Draw", "a", "card", "when", "this", "attacks")) for _ in range(12))}
+    if image_uuids:
+        card["art"] = str(rng.choice(image_uuids))
+    return Json(json.dumps(card))
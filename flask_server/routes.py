@@ -1,12 +1,148 @@
-from flask import Flask, request, jsonify
+import cProfile
+import functools
+import io
+import json
+import os
+import time
+from dataclasses import asdict
+from uuid import UUID
+
+from flask import (Flask, Response, g, request, jsonify, send_file, stream_with_context,
+                   copy_current_request_context)
+from PIL import UnidentifiedImageError
 from flask_server.src.manager import Manager
+from flask_server.src.card_editor import CardOperation
+from flask_server.src.card_export import CardExporter
+from flask_server.src.card_render import RENDER_FORMATS
+from flask_server.src.card_sheets import SheetItem, SheetLayout
+from flask_server.src.card_import import CardImporter, IMPORT_FORMATS
+from flask_server.src.card_storage import FILE_STORAGE
+from flask_server.src.commit_history import HISTORY_PAGE_SIZE
+from flask_server.src.executors import PoolBusyError
 from flask_server.src.images import ImageData
-from flask_server.src import Path
+from flask_server.src.metrics import metrics, describe_arguments, KIND_ROUTE
+from flask_server.src.image_import import ImageImporter, ImportResult
+from flask_server.src import Path, Project
 
 manager = Manager()
 manager.initialize()
 app = Flask(__name__)
 
+SERVER_THREADS = 16
+PROJECT_HEADER = "X-Project"
+""" Requests name their project with this header or a `project` argument, else the last opened one is used """
+PROFILE_HEADER = "X-Profile"
+""" Requests sent with this header are profiled while profiling is allowed, the response names the report """
+
+
+def project_route(mutating=False):
+    """
+    Run a view with the session of the project its request names, as `session`.
+    Views share the project's card set unless they are `mutating` git, then they hold it alone and run in the git
+    pool, so a slow commit only ties up a request thread while light reads of other projects keep flowing
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            name = request.headers.get(PROJECT_HEADER) or request.args.get("project") or manager.project_name
+            if not name:
+                return jsonify({"error": "no project named by the request"}), 400
+            try:
+                session = manager.sessions.get_session(Project(name))
+            except (FileNotFoundError, ValueError):
+                return jsonify({"error": f"project {name} not found"}), 404
+
+            if not mutating:
+                with session.reading():
+                    return view(session, *args, **kwargs)
+
+            # A profiled request is profiled in the pool from now on, a profiler only follows a single thread
+            profiler = g.get("profiler")
+            if profiler:
+                profiler.disable()
+
+            # The lock is taken in the pool, a task that times out still finishes under it
+            @copy_current_request_context
+            def mutate():
+                if profiler:
+                    profiler.enable()
+                try:
+                    with session.mutating():
+                        return view(session, *args, **kwargs)
+                finally:
+                    if profiler:
+                        profiler.disable()
+            return manager.executors.git.run(mutate)
+        return wrapper
+    return decorator
+
+
+@app.before_request
+def start_request_metrics():
+    if not metrics.enabled:
+        return
+    g.started = time.perf_counter()
+    if metrics.profiling and request.headers.get(PROFILE_HEADER):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """ Time the request by its route, streamed bodies are only timed until they start """
+    started = g.pop("started", None)
+    if started is None:
+        return response
+
+    name = f"{request.method} {request.url_rule.rule if request.url_rule else 'unmatched'}"
+    profiler = g.pop("profiler", None)
+    if profiler:
+        profiler.disable()
+        response.headers[PROFILE_HEADER] = metrics.save_profile(profiler, f"{name} {request.full_path}")
+    metrics.observe(KIND_ROUTE, name, time.perf_counter() - started, response.status_code >= 500,
+                    lambda: describe_arguments((), {**(request.view_args or {}), **request.args}))
+    return response
+
+
+@app.errorhandler(PoolBusyError)
+def pool_busy(error):
+    return jsonify({"error": str(error)}), 503, {"Retry-After": "1"}
+
+
+@app.errorhandler(TimeoutError)
+def operation_timed_out(error):
+    return jsonify({"error": "operation timed out, it keeps running in the background"}), 504
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/metrics/config', methods=['PUT'])
+def configure_metrics():
+    """ Turn metrics and profiling on or off and set the slow log threshold, null turns the slow log off """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "the configuration must be a JSON object"}), 400
+    for switch in ("enabled", "profiling"):
+        if data.get(switch) is not None and not isinstance(data[switch], bool):
+            return jsonify({"error": f"{switch} must be true, false or null"}), 400
+    slow_seconds = data.get("slow_seconds", metrics.slow_seconds)
+    if slow_seconds is not None and (not isinstance(slow_seconds, (int, float)) or slow_seconds < 0):
+        return jsonify({"error": "slow_seconds must be a positive number or null"}), 400
+    metrics.configure(data.get("enabled"), slow_seconds, data.get("profiling"))
+    return jsonify({"enabled": metrics.enabled, "slow_seconds": metrics.slow_seconds,
+                    "profiling": metrics.profiling}), 200
+
+
+@app.route('/metrics/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    try:
+        return Response(metrics.get_profile(profile_id), mimetype="text/plain")
+    except KeyError:
+        return jsonify({"error": f"profile {profile_id} not found"}), 404
+
 
 @app.route('/')
 def hello_world():  # put application's code here
@@ -24,13 +160,45 @@ def get_image_list():
 @app.route('/images', methods=['POST'])
 def import_image():
     data = request.get_json()
-    image_uuid, image_data = manager.image_bank.import_image(Path(data['image_path']), data['image_name'])
+    try:
+        image_uuid, image_data = manager.image_bank.import_image(Path(data['image_path']), data['image_name'],
+                                                                 data.get('deduplicate', False))
+    except (OSError, UnidentifiedImageError) as e:
+        return jsonify({"error": f"Error importing image: {str(e)}"}), 400
     return jsonify({"uuid": str(image_uuid), "image_data": image_data.__dict__}), 201
 
 
+@app.route('/images/bulk', methods=['POST'])
+def import_images():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("source"), str):
+        return jsonify({"error": "source must name a folder, a zip archive or a glob expression"}), 400
+
+    # More processes than cores only adds switching, a missing count uses every core
+    workers = data.get("workers")
+    importer = manager.image_importer
+    if workers is not None:
+        if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+            return jsonify({"error": "workers must be a positive integer"}), 400
+        workers = min(workers, os.cpu_count() or 1)
+        if workers != importer.workers:
+            importer = ImageImporter(manager.image_bank, workers, manager.executors.images)
+
+    def log_progress(done: int, total: int, result: ImportResult):
+        if result.error:
+            print(f"IMAGE_BANK BULK_IMPORT - {result.source}: {result.error}")
+        if done == total or done % 100 == 0:
+            print(f"IMAGE_BANK BULK_IMPORT - {done}/{total} images processed")
+
+    report = importer.import_images(Path(data['source']), data.get('pattern', ""), log_progress,
+                                    data.get('deduplicate', False))
+    return jsonify(report), 201
+
+
 @app.route('/images/<uuid>', methods=['DELETE'])
 def delete_image(uuid):
     manager.image_bank.delete_image(uuid)
+    manager.thumbnails.invalidate(uuid)
     return jsonify(message=f"image {uuid} deleted"), 204
 
 
@@ -48,6 +216,117 @@ def get_image_data(uuid):
     return jsonify({"data": image_data.__dict__}), 200
 
 
+@app.route('/images/<uuid>/raw', methods=['GET'])
+def get_image_file(uuid):
+    try:
+        path = manager.image_bank.get_image_path(UUID(uuid))
+        stat = os.stat(path)
+    except (ValueError, FileNotFoundError):
+        return jsonify({"error": f"image {uuid} not found"}), 404
+
+    # Werkzeug streams the file through the server's file wrapper and answers Range and revalidation requests
+    return send_file(path, mimetype="image/jpeg", etag=f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+                     last_modified=stat.st_mtime, conditional=True, max_age=0)
+
+
+@app.route('/images/<uuid>/thumbnail', methods=['GET'])
+def get_image_thumbnail(uuid):
+    size = request.args.get("size", 256, type=int)
+    image_format = request.args.get("format", "webp")
+    try:
+        # Answer revalidations before building anything, the tag only depends on the source file
+        etag = manager.thumbnails.get_etag(uuid, size, image_format)
+        if etag in request.if_none_match:
+            return "", 304, {"ETag": f'"{etag}"'}
+
+        path, mimetype = manager.thumbnails.get_thumbnail(uuid, size, image_format)
+    except FileNotFoundError:
+        return jsonify({"error": f"image {uuid} not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=3600)
+
+
+@app.route('/images/sheets', methods=['POST'])
+def build_image_sheets():
+    """ Lay bank images out on print sheets or atlases, images missing from the bank are skipped """
+    data = request.get_json()
+    try:
+        layout = SheetLayout.from_dict(data.get("layout", {}))
+        items, skipped = [], []
+        for image_uuid in data.get("images", []):
+            content_key = manager.image_bank.get_content_key(UUID(image_uuid))
+            if content_key is None:
+                skipped.append(image_uuid)
+                continue
+            items.append(SheetItem(image_uuid, manager.image_bank.get_image_path(UUID(image_uuid)), content_key))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    manifest = manager.sheets.build(items, layout)
+    manifest.skipped.extend(skipped)
+    return jsonify(asdict(manifest)), 200
+
+
+@app.route('/sheets/<key>', methods=['GET'])
+def get_sheet(key):
+    path = manager.sheets.get_sheet_path(key)
+    if not key.isalnum() or not os.path.exists(path):
+        return jsonify({"error": f"sheet {key} not found"}), 404
+    # Sheets are named after their content, they never change
+    return send_file(path, mimetype="image/png", etag=key, max_age=31536000)
+
+
+@app.route('/templates', methods=['LIST'])
+def get_template_list():
+    return jsonify({"templates": manager.renderer.get_template_names()}), 200
+
+
+@app.route('/templates/<name>', methods=['GET'])
+def get_template(name):
+    try:
+        template = manager.renderer.get_template(name)
+    except FileNotFoundError:
+        return jsonify({"error": f"template {name} not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"template": asdict(template)}), 200
+
+
+@app.route('/templates/<name>', methods=['PUT'])
+def save_template(name):
+    try:
+        manager.renderer.save_template(name, request.get_data(as_text=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"message": f"Template {name} saved"}), 200
+
+
+@app.route('/templates/<name>', methods=['DELETE'])
+def delete_template(name):
+    try:
+        manager.renderer.delete_template(name)
+    except FileNotFoundError:
+        return jsonify({"error": f"template {name} not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(message=f"template {name} deleted"), 204
+
+
+@app.route('/renders/<key>', methods=['GET'])
+def get_render(key):
+    image_format = request.args.get("format", "png")
+    try:
+        path = manager.renderer.get_render_path(key, image_format)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not key.isalnum() or not os.path.exists(path):
+        return jsonify({"error": f"render {key} not found"}), 404
+    # Renders are named after their content, they never change
+    return send_file(path, mimetype=RENDER_FORMATS[image_format][1], etag=key, max_age=31536000)
+
+
 @app.route('/registry', methods=['LIST'])
 def get_project_list():
     projects = manager.registry.get_project_names()
@@ -62,7 +341,10 @@ def create_project():
     if not project_name:
         return jsonify({"error": "Project name is required"}), 400
 
-    manager.registry.create_project(project_name)
+    try:
+        manager.registry.create_project(project_name, data.get("storage", FILE_STORAGE))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     manager.load_project(project_name)
     return jsonify({"message": f"Project '{project_name}' created successfully"}), 201
 
@@ -74,54 +356,276 @@ def open_project(project_name):
 
 
 @app.route('/project', methods=['GET'])
-def get_active_branch():
-    active_branch = manager.project.get_active_branch()
+@project_route()
+def get_active_branch(session):
+    active_branch = session.card_set.get_active_branch()
     return jsonify({"active_branch": active_branch}), 200
 
 
 @app.route('/project', methods=['LIST'])
-def get_branch_list():
-    branches = manager.project.get_branches()
+@project_route()
+def get_branch_list(session):
+    branches = session.card_set.get_branches()
     return jsonify({'branch_list': branches}), 200
 
 
 @app.route('/project', methods=['PUT'])
-def create_branch():
+@project_route(mutating=True)
+def create_branch(session):
     data = request.get_json()
-    manager.project.create_branch(data['branch_name'], data['message'])
+    manager.saves.flush(session.name)
+    session.card_set.create_branch(data['branch_name'], data['message'])
     return jsonify(message=f"branch {data['branch_name']} created"), 201
 
 
 @app.route('/project', methods=['SAVE'])
-def save():
+@project_route()
+def save(session):
     data = request.get_json()
-    manager.project.save_changes(data["message"])
-    return jsonify(message=f"file saved"), 201
+    job = manager.saves.enqueue(session.name, data["message"])
+    return jsonify(message="save queued", job=job.job_id), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = manager.saves.get_job(job_id)
+    except KeyError:
+        return jsonify({"error": f"job {job_id} not found"}), 404
+    return jsonify(asdict(job)), 200
 
 
 @app.route('/project', methods=['RESET'])
-def reset():
-    manager.project.rollback()
+@project_route(mutating=True)
+def reset(session):
+    manager.saves.flush(session.name)
+    session.card_set.rollback()
     return jsonify(message=f"all changed discarded"), 205
 
 
+@app.route('/project/cards', methods=['GET'])
+@project_route()
+def get_card_list(session):
+    try:
+        card_uuids = session.editor.get_card_list(request.args.get("rev"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"cards": card_uuids}), 200
+
+
+@app.route('/project/cards/<uuid>', methods=['GET'])
+@project_route()
+def get_card_data(session, uuid):
+    try:
+        card_data = session.editor.get_card_data(UUID(uuid), request.args.get("rev"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({"error": f"card {uuid} not found"}), 404
+    return jsonify({"data": card_data}), 200
+
+
+@app.route('/project/cards/batch', methods=['POST'])
+@project_route()
+def apply_card_batch(session):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "the batch must be a JSON object"}), 400
+    operations = data.get("operations", [])
+    if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+        return jsonify({"error": "operations must be a list of JSON objects"}), 400
+    operations = [CardOperation(operation.get("action"), operation.get("uuid"), operation.get("data"))
+                  for operation in operations]
+    try:
+        card_uuids = session.editor.apply_batch(operations)
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"uuids": card_uuids}), 201
+
+
+@app.route('/project/cards/import', methods=['POST'])
+@project_route(mutating=True)
+def import_cards(session):
+    """ The request body is the CSV or NDJSON file, it is parsed while it is received """
+    source_format = request.args.get("format", "csv")
+    if source_format not in IMPORT_FORMATS:
+        return jsonify({"error": f"unsupported import format '{source_format}'"}), 400
+    try:
+        mapping = json.loads(request.args.get("mapping", "{}"))
+    except ValueError:
+        mapping = None
+    if not isinstance(mapping, dict):
+        return jsonify({"error": "mapping must be a JSON object"}), 400
+
+    source = io.TextIOWrapper(request.stream, encoding="utf-8-sig", newline="")
+    report = CardImporter(session.editor).import_cards(source, source_format, request.args.get("key"), mapping,
+                                                       request.args.get("message", "Cards imported"))
+    return jsonify(asdict(report)), 201
+
+
+@app.route('/project/cards/query', methods=['POST'])
+@project_route()
+def query_cards(session):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "the query must be a JSON object"}), 400
+    try:
+        total, card_uuids = session.editor.query_cards(data.get("filters"), data.get("sort"),
+                                                       bool(data.get("descending", False)), data.get("offset", 0),
+                                                       data.get("limit"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"total": total, "cards": card_uuids}), 200
+
+
+@app.route('/project/diff', methods=['GET'])
+@project_route()
+def diff_revisions(session):
+    fields = request.args.get("fields", "false").lower() in ("1", "true")
+    try:
+        diffs = session.card_set.diff(request.args.get("from", "HEAD"), request.args.get("to", "HEAD"), fields)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def stream():
+        # Both sides were resolved to commits, git objects never change so the stream needs no lock
+        for diff in diffs:
+            yield json.dumps(asdict(diff)) + "\n"
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
+
+@app.route('/project/export', methods=['GET'])
+@project_route()
+def export_cards(session):
+    export_format = request.args.get("format", "ndjson")
+    images = request.args.get("images", "true").lower() in ("1", "true")
+    if export_format not in ("ndjson", "zip"):
+        return jsonify({"error": f"unsupported export format '{export_format}'"}), 400
+
+    rev = request.args.get("rev")
+    try:
+        rev = session.card_set.resolve(rev) if rev else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    exporter = CardExporter(session.editor, manager.image_bank)
+    export = exporter.export_zip if export_format == "zip" else exporter.export_ndjson
+
+    def stream():
+        if rev:
+            # Pinned to a commit, the cards are read from git objects that no swap can change
+            yield from export(rev, images)
+            return
+        # The stream outlives the view, it keeps sharing the working tree until it is done
+        with session.reading():
+            yield from export(rev, images)
+
+    mimetype = "application/zip" if export_format == "zip" else "application/x-ndjson"
+    headers = {"Content-Disposition": f"attachment; filename={session.name}.{export_format}"}
+    return Response(stream_with_context(stream()), mimetype=mimetype, headers=headers)
+
+
+@app.route('/project/render', methods=['POST'])
+@project_route()
+def render_cards(session):
+    """ Render the cards listed in the body, or the whole set, and return the render key of every card """
+    data = request.get_json()
+    rev = data.get("rev")
+    try:
+        rev = session.card_set.resolve(rev) if rev else None
+        if data.get("cards") is None:
+            cards = list(session.editor.iter_cards(rev))
+        else:
+            cards = [(card_uuid, session.editor.get_card_data(card_uuid, rev)) for card_uuid in data["cards"]]
+        results = manager.renderer.render_cards(cards, data.get("template", ""), data.get("format", "png"))
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e) or "card or template not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"renders": [asdict(result) for result in results]}), 200
+
+
+@app.route('/project/sheets', methods=['POST'])
+@project_route()
+def build_card_sheets(session):
+    """ Render cards through a template and lay the renders out, cards that fail to render are skipped """
+    data = request.get_json()
+    rev = data.get("rev")
+    try:
+        layout = SheetLayout.from_dict(data.get("layout", {}))
+        rev = session.card_set.resolve(rev) if rev else None
+        if data.get("cards") is None:
+            cards = list(session.editor.iter_cards(rev))
+        else:
+            cards = [(card_uuid, session.editor.get_card_data(card_uuid, rev)) for card_uuid in data["cards"]]
+        results = manager.renderer.render_cards(cards, data.get("template", ""))
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e) or "card or template not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    items = [SheetItem(result.card_uuid, manager.renderer.get_render_path(result.key), result.key)
+             for result in results if result.key]
+    manifest = manager.sheets.build(items, layout)
+    manifest.skipped.extend(result.card_uuid for result in results if not result.key)
+    return jsonify(asdict(manifest)), 200
+
+
+@app.route('/project/commit-graph', methods=['POST'])
+@project_route()
+def write_commit_graph(session):
+    session.card_set.write_commit_graph()
+    return jsonify(message="commit graph written"), 201
+
+
 @app.route('/project/<branch>', methods=['LIST'])
-def get_commit_list(branch):
-    commits = manager.project.get_commit_list(branch)
-    return jsonify({'branches': commits}), 201
+@project_route()
+def get_commit_list(session, branch):
+    limit = request.args.get("limit", str(HISTORY_PAGE_SIZE))
+    if not (limit.isascii() and limit.isdigit()) or int(limit) < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    limit = int(limit)
+    try:
+        commits = session.card_set.get_commit_list(branch, limit, request.args.get("before"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    next_page = commits[-1][0] if len(commits) == limit else None
+    return jsonify({'branches': commits, 'next': next_page}), 201
 
 
 @app.route('/project/<branch>', methods=['LOAD_BRANCH'])
-def load(branch):
-    manager.project.load_branch(branch)
+@project_route(mutating=True)
+def load(session, branch):
+    manager.saves.flush(session.name)
+    session.card_set.load_branch(branch)
     return jsonify(message=f"Branch {branch} loaded"), 200
 
 
 @app.route('/project/<commit>', methods=['LOAD_COMMIT'])
-def load_commit(commit):
-    manager.project.load_commit(commit)
+@project_route(mutating=True)
+def load_commit(session, commit):
+    manager.saves.flush(session.name)
+    session.card_set.load_commit(commit)
     return jsonify(manager=f"Commit {commit} loaded"), 200
 
 
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    asgi_app = WsgiToAsgi(app)
+    """ ASGI entry point, e.g. `uvicorn flask_server.routes:asgi_app`. Views run in the server's thread pool """
+except ImportError:
+    asgi_app = None
+
+
+def serve(host: str = "localhost", port: int = 5000, threads: int = SERVER_THREADS):
+    """ Serve the app with a production WSGI server when waitress is installed, the debug server otherwise """
+    try:
+        import waitress
+    except ImportError:
+        app.run(debug=True, port=port, host=host, threaded=True)
+        return
+    waitress.serve(app, host=host, port=port, threads=threads)
+
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000, host="localhost")
+    serve()
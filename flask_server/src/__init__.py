@@ -1,7 +1,17 @@
-from typing import NewType
+from typing import Any, Dict, NewType
 
 Path = NewType("Path", str)
 Json = NewType("Json", str)
 Uuid = NewType("Uuid", str)
 Project = NewType("Project", str)
 Branch = NewType("Save", str)
+
+
+def get_field(card: Dict[str, Any], name: str) -> Any:
+    """ Read a card field, dots reach nested fields, None when the card lacks it """
+    value = card
+    for part in name.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
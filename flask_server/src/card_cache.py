@@ -0,0 +1,119 @@
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, List, Tuple
+from uuid import UUID
+
+from flask_server.src import Json
+
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+RACY_WINDOW_NS = 2_000_000_000
+""" Files modified this recently may change again without their mtime moving, they are not cached """
+
+Stamp = Tuple[int, int]
+""" The (mtime_ns, size) pair a cached value was read under """
+
+
+class CardCache:
+    """
+    Memory cache of a card set's files and listing, bounded by an LRU byte budget.
+    Entries are validated against the file and folder stat info, so edits made outside the editor are noticed
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes: int = max_bytes
+        self._lock = threading.Lock()
+        self._cards: OrderedDict[str, Tuple[Stamp, Json]] = OrderedDict()
+        self._bytes: int = 0
+        self._listing: Tuple[Stamp, List[UUID]] | None = None
+
+    def get_card(self, name: str, stamp: Stamp) -> Json | None:
+        """ Return the cached content of a card file, or None when it is missing or outdated """
+        with self._lock:
+            entry = self._cards.get(name)
+            if not entry or entry[0] != stamp:
+                return None
+            self._cards.move_to_end(name)
+            return entry[1]
+
+    def put_card(self, name: str, stamp: Stamp, content: Json):
+        """ Cache the content of a card file read under `stamp` """
+        if _is_racy(stamp):
+            self.discard_card(name)
+            return
+
+        with self._lock:
+            self._forget(name)
+            self._cards[name] = (stamp, content)
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes and self._cards:
+                self._forget(next(iter(self._cards)))
+
+    def discard_card(self, name: str):
+        with self._lock:
+            self._forget(name)
+
+    def get_listing(self, stamp: Stamp) -> List[UUID] | None:
+        """ Return the cached card list, or None when the folder changed since it was listed """
+        with self._lock:
+            if not self._listing or self._listing[0] != stamp:
+                return None
+            return list(self._listing[1])
+
+    def put_listing(self, stamp: Stamp, cards: List[UUID]):
+        """ Cache the card list of the folder read under `stamp` """
+        with self._lock:
+            self._listing = None if _is_racy(stamp) else (stamp, list(cards))
+
+    def discard_listing(self):
+        with self._lock:
+            self._listing = None
+
+    def clear(self):
+        """ Forget everything, used when the working tree is swapped """
+        with self._lock:
+            self._cards.clear()
+            self._bytes = 0
+            self._listing = None
+
+    def _forget(self, name: str):
+        """ Drop a card entry, the lock must be held """
+        entry = self._cards.pop(name, None)
+        if entry:
+            self._bytes -= len(entry[1])
+
+
+class BlobCache:
+    """
+    Memory cache of values read from git objects, bounded by an LRU byte budget.
+    Objects never change once written, so entries are keyed by sha and never need validating
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes: int = max_bytes
+        self._lock = threading.Lock()
+        self._values: OrderedDict[str, Tuple[int, Any]] = OrderedDict()
+        self._bytes: int = 0
+
+    def get(self, sha: str) -> Any | None:
+        with self._lock:
+            entry = self._values.get(sha)
+            if entry is None:
+                return None
+            self._values.move_to_end(sha)
+            return entry[1]
+
+    def put(self, sha: str, value: Any, size: int):
+        """ Cache a value derived from an object, `size` is what it counts against the budget """
+        with self._lock:
+            if sha in self._values:
+                return
+            self._values[sha] = (size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._values:
+                self._bytes -= self._values.popitem(last=False)[1][0]
+
+
+def _is_racy(stamp: Stamp) -> bool:
+    mtime_ns, _ = stamp
+    return time.time_ns() - mtime_ns < RACY_WINDOW_NS
@@ -0,0 +1,57 @@
+import json
+
+from dataclasses import dataclass
+from typing import Any, Iterator, List
+
+from flask_server.src import Json, Uuid
+
+
+CARD_ADDED = "added"
+CARD_REMOVED = "removed"
+CARD_MODIFIED = "modified"
+
+
+@dataclass
+class FieldChange:
+    """ One field that differs between two versions of a card, fields missing on a side are None """
+    field: str
+    old: Any = None
+    new: Any = None
+
+
+@dataclass
+class CardDiff:
+    """ A card that differs between two revisions, field changes are only listed when they were asked for """
+    card_uuid: Uuid
+    change: str
+    fields: List[FieldChange] | None = None
+
+
+def diff_fields(old_data: Json | None, new_data: Json | None) -> List[FieldChange]:
+    """ Compare two versions of a card field by field, nested fields are addressed with dots as in queries """
+    old_document = _parse(old_data)
+    new_document = _parse(new_data)
+    if not isinstance(old_document, dict) or not isinstance(new_document, dict):
+        return [] if old_document == new_document else [FieldChange("", old_document, new_document)]
+    return list(_walk(old_document, new_document, ""))
+
+
+def _walk(old: dict, new: dict, prefix: str) -> Iterator[FieldChange]:
+    for key in sorted(old.keys() | new.keys()):
+        name = f"{prefix}{key}"
+        old_value = old.get(key)
+        new_value = new.get(key)
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            yield from _walk(old_value, new_value, f"{name}.")
+        elif key not in old or key not in new or old_value != new_value:
+            yield FieldChange(name, old_value, new_value)
+
+
+def _parse(card_data: Json | None) -> Any:
+    """ Decode a card, cards that aren't valid JSON are compared as raw text """
+    if card_data is None:
+        return {}
+    try:
+        return json.loads(card_data)
+    except (TypeError, ValueError):
+        return card_data
@@ -1,11 +1,24 @@
-import os
+from dataclasses import dataclass
 from uuid import uuid4 as generate_uuid
 from uuid import UUID
 
-from typing import List
+from typing import Any, Dict, Iterator, List, Set, Tuple
 
 from flask_server.src import Uuid, Json
-from flask_server.src.card_set import CardSet, SETTINGS_FILE_NAME
+from flask_server.src.card_set import CardSet
+
+
+CREATE_CARD = "create"
+UPDATE_CARD = "update"
+DELETE_CARD = "delete"
+
+
+@dataclass
+class CardOperation:
+    """ One change of a card batch, creations don't have a uuid and deletions don't have data """
+    action: str
+    card_uuid: Uuid | None = None
+    card_data: Json | None = None
 
 
 class CardEditor:
@@ -19,45 +32,93 @@ class CardEditor:
 
     def create_card(self, card_data: Json) -> Uuid:
         """ Create a new card file and stash it """
-        card_uuid = str(generate_uuid())
-        card_path = os.path.join(self.card_set.path, f"{card_uuid}.json")
-        with open(card_path, 'w') as file:
-            file.write(card_data)
-        return Uuid(card_uuid)
+        card_uuid, = self.apply_batch([CardOperation(CREATE_CARD, card_data=card_data)])
+        return card_uuid
 
     def update_card(self, card_uuid: Uuid, card_data: Json) -> None:
         """ Update an existing card """
-        card_path = os.path.join(self.card_set.path, f"{card_uuid}.json")
-        if not os.path.exists(card_path):
-            raise FileNotFoundError("CARD_SET UPDATE_CARD - Missing card file")
-        with open(card_path, 'w') as file:
-            file.write(card_data)
-
-    def get_card_data(self, card_uuid: UUID) -> Json:
-        """ Get cards data """
-        card_path = os.path.join(self.card_set.path, f"{card_uuid}.json")
-        if not os.path.exists(card_path):
-            raise FileNotFoundError("CARD_SET UPDATE_CARD - Missing card file")
-        with open(card_path, 'r') as file:
-            return Json(file.read())
-
-    def get_card_list(self) -> List[UUID]:
-        """ Get a list with all cards in this set """
-        cards = []
-        for file in os.listdir(self.card_set.path):
-            if not os.path.isfile(os.path.join(self.card_set.path, file)) or file == SETTINGS_FILE_NAME:
-                continue
-            name, _ = os.path.splitext(file)
-            cards.append(UUID(name))
-        return cards
+        self.apply_batch([CardOperation(UPDATE_CARD, card_uuid, card_data)])
+
+    def delete_card(self, card_uuid: Uuid) -> None:
+        """ Delete an existing card """
+        self.apply_batch([CardOperation(DELETE_CARD, card_uuid)])
+
+    def apply_batch(self, operations: List[CardOperation], written_paths: Set[str] | None = None) -> List[Uuid]:
+        """
+        Apply many card operations as a group and return the uuid of each operation's card.
+        Every operation is validated before anything is written, then the set's storage writes them all or none.
+        The repo paths the batch wrote are added to `written_paths` when it is given
+        """
+        card_uuids = self._validate_batch(operations)
+        changes = [(card_uuid, None if operation.action == DELETE_CARD else operation.card_data)
+                   for operation, card_uuid in zip(operations, card_uuids)]
+        paths = self.card_set.storage.write(changes)
+        self.card_set.changes.mark(paths)
+        if written_paths is not None:
+            written_paths.update(paths)
+
+        if self.card_set.index.is_built:
+            for operation, card_uuid in zip(operations, card_uuids):
+                if operation.action == DELETE_CARD:
+                    self.card_set.index.remove(card_uuid)
+                else:
+                    self.card_set.index.update(card_uuid, operation.card_data)
+        return card_uuids
+
+    def query_cards(self, filters: Dict[str, Any] | None = None, sort_by: str | None = None, descending=False,
+                    offset: int = 0, limit: int | None = None) -> Tuple[int, List[Uuid]]:
+        """ Find cards by field values, see `CardIndex.query`. The set's index is built on the first query """
+        index = self.card_set.index
+        if not index.is_built:
+            index.build(self.card_set.storage.scan())
+        return index.query(filters, sort_by, descending, offset, limit)
+
+    def _validate_batch(self, operations: List[CardOperation]) -> List[Uuid]:
+        """ Check every operation of a batch and return the uuid of each operation's card """
+        card_uuids = []
+        for index, operation in enumerate(operations):
+            if operation.action == CREATE_CARD:
+                card_uuid = Uuid(str(generate_uuid()))
+
+            elif operation.action in (UPDATE_CARD, DELETE_CARD):
+                card_uuid = Uuid(str(operation.card_uuid))
+                try:
+                    UUID(card_uuid)
+                except ValueError:
+                    raise ValueError(f"CARD_EDITOR BATCH - Operation {index} has an invalid card uuid")
+                if not self.card_set.storage.exists(card_uuid):
+                    raise FileNotFoundError(f"CARD_EDITOR BATCH - Operation {index} targets a missing card")
+
+            else:
+                raise ValueError(f"CARD_EDITOR BATCH - Operation {index} has an unknown action '{operation.action}'")
+
+            if operation.action != DELETE_CARD and not isinstance(operation.card_data, str):
+                raise ValueError(f"CARD_EDITOR BATCH - Operation {index} is missing its card data")
+
+            if card_uuid in card_uuids:
+                raise ValueError(f"CARD_EDITOR BATCH - Operation {index} targets a card already in the batch")
+
+            card_uuids.append(card_uuid)
+        return card_uuids
+
+    def get_card_data(self, card_uuid: UUID, rev: str | None = None) -> Json:
+        """ Get cards data, `rev` reads it at a commit or branch instead of the working tree """
+        if rev is not None:
+            return self.card_set.storage.read_at(Uuid(str(card_uuid)), rev)
+        return self.card_set.storage.read(Uuid(str(card_uuid)))
+
+    def get_card_list(self, rev: str | None = None) -> List[UUID]:
+        """ Get a list with all cards in this set, `rev` lists them at a commit or branch instead """
+        if rev is not None:
+            return self.card_set.storage.list_at(rev)
+        return self.card_set.storage.list()
+
+    def iter_cards(self, rev: str | None = None) -> Iterator[Tuple[Uuid, Json]]:
+        """ Walk every card of the set, one at a time, `rev` walks them at a commit or branch instead """
+        if rev is not None:
+            return self.card_set.storage.scan_at(rev)
+        return self.card_set.storage.scan()
 
     def get_changed_cards(self) -> List[UUID]:
-        """ Get all files that have been changed but not saved """
-        result = []
-        for card in self.card_set.repo.index.diff(None):
-            card = card.b_path
-            if not os.path.isfile(os.path.join(self.card_set.path, card)) or card == SETTINGS_FILE_NAME:
-                continue
-            name, _ = os.path.splitext(card)
-            result.append(UUID(name))
-        return result
+        """ Get all cards that have been changed but not saved """
+        return self.card_set.storage.get_unsaved_cards(self.card_set.changes.get_dirty_paths())
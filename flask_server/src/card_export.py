@@ -0,0 +1,139 @@
+import base64
+import json
+import os
+import zipfile
+
+from typing import Any, Iterator, List, Set
+from uuid import UUID
+
+from flask_server.src import Json
+from flask_server.src.card_editor import CardEditor
+from flask_server.src.images import ImageBank, IMAGE_EXTENSION
+
+
+EXPORT_CHUNK_SIZE = 3 * 256 * 1024
+""" Bytes of image read at once, a multiple of 3 so base64 chunks can be joined """
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class CardExporter:
+    """
+    Streams a card set out of the app, with the images its cards reference.
+    Cards are read one at a time and images in chunks, so memory doesn't grow with the set or its art.
+    Any string field of a card holding the uuid of a bank image is a reference to that image
+    """
+    def __init__(self, editor: CardEditor, image_bank: ImageBank):
+        self.editor: CardEditor = editor
+        self.image_bank: ImageBank = image_bank
+
+    def export_ndjson(self, rev: str | None = None, images=True) -> Iterator[bytes]:
+        """
+        Yield one JSON line per card, `{"type": "card", "uuid", "data"}`, each followed by a line for the
+        images it is the first to reference, `{"type": "image", "uuid", "file_name", "data", "content"}`
+        with the JPEG file in base64
+        """
+        exported: Set[UUID] = set()
+        for card_uuid, card_data in self.editor.iter_cards(rev):
+            yield _json_line({"type": "card", "uuid": card_uuid, "data": card_data})
+            if not images:
+                continue
+
+            for image_uuid in self._take_new_images(card_data, exported):
+                image_data = self.image_bank.read_image_metadata(image_uuid)
+                header = json.dumps({"type": "image", "uuid": str(image_uuid), "file_name": image_data.file_name,
+                                     "data": image_data.data, "content": ""})
+                # The content is streamed in place of the empty string closing the record
+                yield header[:-2].encode("utf-8")
+                for chunk in self._read_image(image_uuid):
+                    yield base64.b64encode(chunk)
+                yield b'"}\n'
+
+    def export_zip(self, rev: str | None = None, images=True) -> Iterator[bytes]:
+        """
+        Yield a zip archive holding `cards/<uuid>.json`, `images/<uuid>.jpg` and a manifest.
+        The archive is written with data descriptors, so it streams without ever seeking back
+        """
+        return (chunk for chunk in self._write_zip(rev, images) if chunk)
+
+    def _write_zip(self, rev: str | None, images: bool) -> Iterator[bytes]:
+        """ Write the archive entry by entry, yielding whatever the archive wrote after each step """
+        output = _StreamBuffer()
+        exported: Set[UUID] = set()
+        cards = 0
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+            for card_uuid, card_data in self.editor.iter_cards(rev):
+                archive.writestr(f"cards/{card_uuid}.json", card_data)
+                cards += 1
+                yield output.drain()
+                if not images:
+                    continue
+
+                for image_uuid in self._take_new_images(card_data, exported):
+                    info = zipfile.ZipInfo(f"images/{image_uuid}{IMAGE_EXTENSION}")
+                    info.file_size = os.path.getsize(self.image_bank.get_image_path(image_uuid))
+                    info.compress_type = zipfile.ZIP_STORED
+                    with archive.open(info, "w") as file:
+                        for chunk in self._read_image(image_uuid):
+                            file.write(chunk)
+                            yield output.drain()
+
+            manifest = {"revision": rev, "cards": cards, "images": len(exported)}
+            archive.writestr(MANIFEST_FILE_NAME, json.dumps(manifest))
+        yield output.drain()
+
+    def _take_new_images(self, card_data: Json, exported: Set[UUID]) -> List[UUID]:
+        """ Return the bank images a card references that weren't exported yet, and mark them exported """
+        try:
+            document = json.loads(card_data)
+        except (TypeError, ValueError):
+            return []
+
+        found = []
+        for value in _iter_strings(document):
+            try:
+                image_uuid = UUID(value)
+            except ValueError:
+                continue
+            if image_uuid not in exported and os.path.exists(self.image_bank.get_image_path(image_uuid)):
+                exported.add(image_uuid)
+                found.append(image_uuid)
+        return found
+
+    def _read_image(self, image_uuid: UUID) -> Iterator[bytes]:
+        with open(self.image_bank.get_image_path(image_uuid), "rb") as file:
+            while chunk := file.read(EXPORT_CHUNK_SIZE):
+                yield chunk
+
+
+class _StreamBuffer:
+    """ Write only file the zip archive is written to, the export drains it after every entry or chunk """
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _iter_strings(document: Any) -> Iterator[str]:
+    """ Walk every string value of a card, at any depth """
+    if isinstance(document, str):
+        yield document
+    elif isinstance(document, dict):
+        for value in document.values():
+            yield from _iter_strings(value)
+    elif isinstance(document, list):
+        for value in document:
+            yield from _iter_strings(value)
+
+
+def _json_line(record: dict) -> bytes:
+    return (json.dumps(record) + "\n").encode("utf-8")
@@ -0,0 +1,206 @@
+import csv
+import json
+import re
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Set, TextIO, Tuple
+
+from flask_server.src import Json, Uuid, get_field
+from flask_server.src.card_editor import CardEditor, CardOperation, CREATE_CARD, UPDATE_CARD
+
+
+CSV_FORMAT = "csv"
+NDJSON_FORMAT = "ndjson"
+IMPORT_FORMATS = (CSV_FORMAT, NDJSON_FORMAT)
+IMPORT_BATCH_SIZE = 500
+""" Rows written to the card set at once, memory holds a single batch whatever the size of the import """
+NUMBER_PATTERN = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+""" Cells coerced to numbers, the canonical JSON number syntax """
+
+
+@dataclass
+class RowError:
+    """ A row that couldn't be imported, rows are numbered from 1 without the CSV header """
+    row: int
+    error: str
+
+
+@dataclass
+class CardImportReport:
+    """ Outcome of a card import, the commit is None when no card changed """
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[RowError] = field(default_factory=list)
+    commit: str | None = None
+    seconds: float = 0.0
+
+
+class CardImporter:
+    """
+    Loads rows of CSV or NDJSON into a card set, such as the balance sheets designers keep in spreadsheets.
+    Rows are parsed as they are read and written in batches, a row whose `key` field matches an existing card
+    updates that card instead of creating a new one. The whole import is committed once, at the end.
+    Only the cards the import wrote are committed, earlier unsaved edits stay unsaved
+    """
+    def __init__(self, editor: CardEditor, batch_size: int = IMPORT_BATCH_SIZE):
+        self.editor: CardEditor = editor
+        self.batch_size: int = batch_size
+
+    def import_cards(self, source: TextIO, source_format: str = CSV_FORMAT, key: str | None = None,
+                     mapping: Dict[str, str] | None = None, message: str = "Cards imported") -> CardImportReport:
+        """
+        Import every row of `source`, a failing row is reported and never stops the import.
+        `mapping` renames columns to card fields, dots nest them as in `stats.cost`, an empty name drops a column
+        """
+        if source_format not in IMPORT_FORMATS:
+            raise ValueError(f"CARD_IMPORT READ - Unsupported format '{source_format}'")
+
+        started = time.perf_counter()
+        report = CardImportReport()
+        index = self.editor.card_set.index
+        if key and not index.is_built:
+            index.build(self.editor.card_set.storage.scan())
+
+        batch: List[CardOperation] = []
+        rows: List[List[int]] = []
+        """ Rows folded into each operation of the batch """
+        pending: Dict[str, int] = {}
+        """ Position in the batch of the card each key was given, later rows with the same key are merged in """
+        written: Set[str] = set()
+
+        for row, record in _read_rows(source, source_format):
+            try:
+                if isinstance(record, str):
+                    raise ValueError(record)
+                card = _map_fields(record, mapping or {})
+                position = self._add_row(card, key, batch, pending)
+            except (ValueError, FileNotFoundError) as e:
+                report.failed += 1
+                report.errors.append(RowError(row, str(e)))
+                continue
+
+            if position < len(rows):
+                rows[position].append(row)
+            else:
+                rows.append([row])
+            if len(batch) >= self.batch_size:
+                self._flush(batch, rows, written, report)
+                pending.clear()
+
+        self._flush(batch, rows, written, report)
+        if written:
+            report.commit = self.editor.card_set.save_changes(message, written)
+        report.seconds = time.perf_counter() - started
+        return report
+
+    def _add_row(self, card: Dict[str, Any], key: str | None, batch: List[CardOperation],
+                 pending: Dict[str, int]) -> int:
+        """ Turn a row into an operation of the batch or merge it into the one of its key, return its position """
+        if not key:
+            batch.append(CardOperation(CREATE_CARD, card_data=Json(json.dumps(card))))
+            return len(batch) - 1
+
+        value = get_field(card, key)
+        if value is None:
+            raise ValueError(f"CARD_IMPORT ROW - Missing key field '{key}'")
+
+        encoded = json.dumps(value, sort_keys=True)
+        if encoded in pending:
+            operation = batch[pending[encoded]]
+            operation.card_data = Json(json.dumps(_merge(json.loads(operation.card_data), card)))
+            return pending[encoded]
+
+        matches = self.editor.card_set.index.lookup(key, value)
+        if len(matches) > 1:
+            raise ValueError(f"CARD_IMPORT ROW - {len(matches)} cards share the key {encoded}")
+
+        pending[encoded] = len(batch)
+        if not matches:
+            batch.append(CardOperation(CREATE_CARD, card_data=Json(json.dumps(card))))
+            return pending[encoded]
+
+        card_uuid = next(iter(matches))
+        try:
+            existing = json.loads(self.editor.get_card_data(card_uuid))
+        except ValueError:
+            existing = {}
+        existing = existing if isinstance(existing, dict) else {}
+        batch.append(CardOperation(UPDATE_CARD, Uuid(card_uuid), Json(json.dumps(_merge(existing, card)))))
+        return pending[encoded]
+
+    def _flush(self, batch: List[CardOperation], rows: List[List[int]], written: Set[str], report: CardImportReport):
+        """ Write a batch and collect the paths it wrote, when it is refused every row in it is reported as failed """
+        if not batch:
+            return
+        try:
+            self.editor.apply_batch(batch, written)
+            report.created += sum(operation.action == CREATE_CARD for operation in batch)
+            report.updated += sum(operation.action == UPDATE_CARD for operation in batch)
+        except (ValueError, FileNotFoundError) as e:
+            failed = sorted(row for merged in rows for row in merged)
+            report.failed += len(failed)
+            report.errors.extend(RowError(row, str(e)) for row in failed)
+        batch.clear()
+        rows.clear()
+
+
+def _read_rows(source: TextIO, source_format: str) -> Iterator[Tuple[int, Dict[str, Any] | str]]:
+    """ Walk the rows of a source as they are read, a row that can't be parsed is yielded as its error """
+    if source_format == CSV_FORMAT:
+        for row, record in enumerate(csv.DictReader(source), 1):
+            yield row, {column: _coerce(value) for column, value in record.items()
+                        if column is not None and value not in (None, "")}
+        return
+
+    for row, line in enumerate(source, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield row, "CARD_IMPORT ROW - Invalid JSON"
+            continue
+        yield row, record if isinstance(record, dict) else "CARD_IMPORT ROW - A row must be a JSON object"
+
+
+def _map_fields(record: Dict[str, Any], mapping: Dict[str, str]) -> Dict[str, Any]:
+    """ Build a card from a row, renaming its columns and nesting the dotted ones """
+    card: Dict[str, Any] = {}
+    for column, value in record.items():
+        name = mapping.get(column, column)
+        if not name:
+            continue
+        *parents, leaf = name.split(".")
+        target = card
+        for parent in parents:
+            target = target.setdefault(parent, {})
+            if not isinstance(target, dict):
+                raise ValueError(f"CARD_IMPORT ROW - Field '{name}' clashes with another column")
+        target[leaf] = value
+    return card
+
+
+def _merge(card: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    """ Write imported fields over a card, nested objects are merged so fields the import lacks are kept """
+    for name, value in fields.items():
+        if isinstance(value, dict) and isinstance(card.get(name), dict):
+            _merge(card[name], value)
+        else:
+            card[name] = value
+    return card
+
+
+def _coerce(text: str) -> Any:
+    """
+    Read numbers out of spreadsheet cells so they can be filtered and sorted as numbers. Only cells written as
+    JSON numbers are read, codes such as `007` or `1_000` stay text so keys keep matching what was typed
+    """
+    match = NUMBER_PATTERN.fullmatch(text)
+    if not match:
+        return text
+    if match.group(2) or match.group(3):
+        number = float(text)
+        return number if number not in (float("inf"), float("-inf")) else text
+    return int(text)
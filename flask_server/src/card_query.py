@@ -0,0 +1,216 @@
+import bisect
+import json
+import threading
+
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+from flask_server.src import Json, Uuid
+
+
+RANGE_MIN = "min"
+RANGE_MAX = "max"
+ANY_OF = "in"
+EQUALS = "eq"
+
+
+class CardIndex:
+    """
+    Field level index of the cards of a card set.
+    An inverted index maps every field value to the cards holding it and numeric fields are also kept sorted,
+    so filters and sorts never have to read the card files. Nested fields are addressed with dots, as in `stats.cost`
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.is_built: bool = False
+        self._cards: Dict[Uuid, Dict[str, List[Any]]] = {}
+        """ Indexed values of every card, by field """
+        self._postings: Dict[str, Dict[str, Set[Uuid]]] = {}
+        """ Cards by field and JSON encoded value, encoding keeps `1`, `"1"` and `true` apart """
+        self._numbers: Dict[str, List[Tuple[float, Uuid]]] = {}
+        """ Sorted (value, card) pairs of every numeric field """
+
+    def build(self, cards: Iterable[Tuple[Uuid, Json]]):
+        """ Index a whole card set from scratch """
+        with self._lock:
+            self._cards.clear()
+            self._postings.clear()
+            self._numbers.clear()
+            for card_uuid, card_data in cards:
+                self._add(card_uuid, card_data, keep_sorted=False)
+            for numbers in self._numbers.values():
+                numbers.sort()
+            self.is_built = True
+
+    def update(self, card_uuid: Uuid, card_data: Json):
+        """ Index the new content of a card """
+        with self._lock:
+            self._remove(card_uuid)
+            self._add(card_uuid, card_data)
+
+    def remove(self, card_uuid: Uuid):
+        with self._lock:
+            self._remove(card_uuid)
+
+    def invalidate(self):
+        """ Drop the index, it is rebuilt by the next query """
+        with self._lock:
+            self.is_built = False
+            self._cards.clear()
+            self._postings.clear()
+            self._numbers.clear()
+
+    def lookup(self, field: str, value: Any) -> Set[Uuid]:
+        """ Return the cards whose field holds a value """
+        with self._lock:
+            return set(self._postings.get(field, {}).get(_encode(value), set()))
+
+    def query(self, filters: Dict[str, Any] | None = None, sort_by: str | None = None, descending=False,
+              offset: int = 0, limit: int | None = None) -> Tuple[int, List[Uuid]]:
+        """
+        Return the number of matching cards and one page of their uuids.
+        A filter is either a value to match, or an object with `eq`, `in`, `min` and `max` conditions.
+        Raise ValueError when the filters or the page are malformed
+        """
+        if filters is not None and not isinstance(filters, dict):
+            raise ValueError("CARD_QUERY QUERY - Filters must be an object")
+        if sort_by is not None and not isinstance(sort_by, str):
+            raise ValueError("CARD_QUERY QUERY - The sorted field must be a string")
+        if not _is_count(offset) or (limit is not None and not _is_count(limit)):
+            raise ValueError("CARD_QUERY QUERY - Offset and limit must be non negative integers")
+        for field, condition in (filters or {}).items():
+            if not isinstance(condition, dict):
+                continue
+            if ANY_OF in condition and not isinstance(condition[ANY_OF], list):
+                raise ValueError(f"CARD_QUERY QUERY - '{ANY_OF}' of '{field}' must be a list")
+            for bound in (RANGE_MIN, RANGE_MAX):
+                if condition.get(bound) is not None and not _is_number(condition[bound]):
+                    raise ValueError(f"CARD_QUERY QUERY - '{bound}' of '{field}' must be a number")
+
+        with self._lock:
+            matches = None
+            for field, condition in (filters or {}).items():
+                candidates = self._match(field, condition)
+                matches = candidates if matches is None else matches & candidates
+                if not matches:
+                    break
+
+            if matches is None:
+                matches = set(self._cards)
+
+            ordered = self._sort(matches, sort_by, descending)
+            end = None if limit is None else offset + limit
+            return len(matches), ordered[offset:end]
+
+    def _match(self, field: str, condition: Any) -> Set[Uuid]:
+        """ Return the cards that satisfy one filter """
+        if not isinstance(condition, dict):
+            return set(self._postings.get(field, {}).get(_encode(condition), set()))
+
+        matches = None
+        if EQUALS in condition:
+            matches = set(self._postings.get(field, {}).get(_encode(condition[EQUALS]), set()))
+
+        if ANY_OF in condition:
+            postings = self._postings.get(field, {})
+            candidates = set().union(*(postings.get(_encode(value), set()) for value in condition[ANY_OF]))
+            matches = candidates if matches is None else matches & candidates
+
+        if RANGE_MIN in condition or RANGE_MAX in condition:
+            numbers = self._numbers.get(field, [])
+            start = 0
+            end = len(numbers)
+            if condition.get(RANGE_MIN) is not None:
+                start = bisect.bisect_left(numbers, (condition[RANGE_MIN], ""))
+            if condition.get(RANGE_MAX) is not None:
+                end = bisect.bisect_left(numbers, (condition[RANGE_MAX], "\uffff"))
+            candidates = {card_uuid for _, card_uuid in numbers[start:end]}
+            matches = candidates if matches is None else matches & candidates
+
+        return matches if matches is not None else set()
+
+    def _sort(self, matches: Set[Uuid], sort_by: str | None, descending: bool) -> List[Uuid]:
+        """ Order a result set, cards missing the sorted field always come last """
+        if not sort_by:
+            return sorted(matches, reverse=descending)
+
+        if sort_by in self._numbers:
+            numbers = self._numbers[sort_by]
+            walk = reversed(numbers) if descending else iter(numbers)
+            ordered = []
+            seen = set()
+            for _, card_uuid in walk:
+                if card_uuid in matches and card_uuid not in seen:
+                    ordered.append(card_uuid)
+                    seen.add(card_uuid)
+            return ordered + sorted(matches - seen)
+
+        present = [card_uuid for card_uuid in matches if self._cards[card_uuid].get(sort_by) is not None]
+        missing = sorted(matches.difference(present))
+        present.sort(key=lambda card_uuid: (str(self._cards[card_uuid][sort_by][0]), card_uuid), reverse=descending)
+        return present + missing
+
+    def _add(self, card_uuid: Uuid, card_data: Json, keep_sorted=True):
+        """ Index a card, the lock must be held. Bulk builds sort the numeric fields once at the end instead """
+        fields: Dict[str, List[Any]] = {}
+        try:
+            document = json.loads(card_data)
+        except (TypeError, ValueError):
+            document = None
+
+        if isinstance(document, dict):
+            for field, value in _flatten(document):
+                fields.setdefault(field, []).append(value)
+                self._postings.setdefault(field, {}).setdefault(_encode(value), set()).add(card_uuid)
+                if _is_number(value) and keep_sorted:
+                    bisect.insort(self._numbers.setdefault(field, []), (value, card_uuid))
+                elif _is_number(value):
+                    self._numbers.setdefault(field, []).append((value, card_uuid))
+
+        self._cards[card_uuid] = fields
+
+    def _remove(self, card_uuid: Uuid):
+        """ Drop a card from the index, the lock must be held """
+        fields = self._cards.pop(card_uuid, None)
+        if not fields:
+            return
+
+        for field, values in fields.items():
+            postings = self._postings[field]
+            for value in values:
+                key = _encode(value)
+                if key in postings:
+                    postings[key].discard(card_uuid)
+                    if not postings[key]:
+                        del postings[key]
+
+                if _is_number(value):
+                    numbers = self._numbers[field]
+                    position = bisect.bisect_left(numbers, (value, card_uuid))
+                    if position < len(numbers) and numbers[position] == (value, card_uuid):
+                        numbers.pop(position)
+
+
+def _flatten(document: dict, prefix: str = "") -> Iterator[Tuple[str, Any]]:
+    """ Walk the scalar values of a card, list items are indexed under the list's field """
+    for key, value in document.items():
+        field = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{field}.")
+        elif isinstance(value, list):
+            for item in value:
+                if not isinstance(item, (dict, list)):
+                    yield field, item
+        else:
+            yield field, value
+
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, sort_keys=True)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_count(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
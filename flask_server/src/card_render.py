@@ -0,0 +1,321 @@
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, List, Tuple
+from uuid import UUID
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageOps
+
+from flask_server.src import Json, Path, Uuid, get_field
+from flask_server.src.executors import BoundedPool, PoolBusyError
+from flask_server.src.files import FileCache, write_atomically
+from flask_server.src.images import ImageBank
+from flask_server.src.metrics import metrics, KIND_IMAGE
+
+
+RENDER_FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+TEMPLATE_EXTENSION = ".json"
+TEMPLATE_NAME = re.compile(r"^[\w-]+$")
+LAYER_BOX = "box"
+LAYER_IMAGE = "image"
+LAYER_TEXT = "text"
+LAYER_TYPES = (LAYER_BOX, LAYER_IMAGE, LAYER_TEXT)
+FIT_COVER = "cover"
+FIT_CONTAIN = "contain"
+RENDER_CHUNK_SIZE = 8
+""" Cards rendered by a pool task, enough to cover the cost of shipping the template to a worker """
+RENDER_QUALITY = 90
+RENDERER_VERSION = 1
+""" Part of every render key, bump it when drawing changes so renders of the previous code aren't served """
+MAX_CARD_SIDE = 8192
+""" Largest card width or height in pixels, a render holds the whole card in memory """
+DEFAULT_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+
+@dataclass
+class TemplateLayer:
+    """ Something drawn on a card, `box` is `[x, y, width, height]` in pixels """
+    type: str
+    box: List[int]
+    field: str = ""
+    """ Card field drawn by text and image layers, dots reach nested fields. Image layers read an image uuid """
+    color: str = "black"
+    size: int = 32
+    """ Font size of text layers """
+    fit: str = FIT_COVER
+    """ How image layers fill their box, cropped to cover it or scaled to be contained in it """
+
+
+@dataclass
+class CardTemplate:
+    """ Layout cards are rendered through, layers are drawn in order over the background """
+    width: int
+    height: int
+    background: str = "white"
+    layers: List[TemplateLayer] = field(default_factory=list)
+
+    @staticmethod
+    def from_json(template_data: Json) -> "CardTemplate":
+        """ Parse and validate a template, raise ValueError when it can't be rendered """
+        try:
+            document = json.loads(template_data)
+            template = CardTemplate(int(document["width"]), int(document["height"]),
+                                    document.get("background", "white"),
+                                    [TemplateLayer(**layer) for layer in document.get("layers", [])])
+        except (TypeError, KeyError, ValueError, AttributeError) as e:
+            raise ValueError(f"CARD_RENDER TEMPLATE - Invalid template: {e}")
+
+        if not 0 < template.width <= MAX_CARD_SIDE or not 0 < template.height <= MAX_CARD_SIDE:
+            raise ValueError(f"CARD_RENDER TEMPLATE - The card size must be positive and up to {MAX_CARD_SIDE} pixels")
+        try:
+            for color in [template.background] + [layer.color for layer in template.layers]:
+                if not isinstance(color, str):
+                    raise ValueError(f"Colors are names or codes, not {color!r}")
+                ImageColor.getrgb(color)
+        except ValueError as e:
+            raise ValueError(f"CARD_RENDER TEMPLATE - {e}")
+        for layer in template.layers:
+            if layer.type not in LAYER_TYPES:
+                raise ValueError(f"CARD_RENDER TEMPLATE - Unknown layer type '{layer.type}'")
+            if len(layer.box) != 4 or any(not isinstance(value, int) for value in layer.box):
+                raise ValueError("CARD_RENDER TEMPLATE - A layer box is [x, y, width, height] in pixels")
+            if not isinstance(layer.field, str) or layer.type != LAYER_BOX and not layer.field:
+                raise ValueError(f"CARD_RENDER TEMPLATE - A {layer.type} layer needs a field")
+            if not isinstance(layer.size, int) or isinstance(layer.size, bool) or layer.size <= 0:
+                raise ValueError("CARD_RENDER TEMPLATE - The font size must be a positive integer")
+            if layer.fit not in (FIT_COVER, FIT_CONTAIN):
+                raise ValueError(f"CARD_RENDER TEMPLATE - Unknown fit '{layer.fit}'")
+        return template
+
+
+@dataclass
+class RenderResult:
+    """ Outcome of rendering a card, `key` names its file in the render cache """
+    card_uuid: Uuid
+    key: str = ""
+    cached: bool = False
+    error: str = ""
+
+
+class CardRenderer:
+    """
+    Composes card images from card JSON and bank art through layout templates.
+    Renders are named after a hash of everything that shows on them: the card, the template and the content of the
+    images it uses. A batch only renders the cards whose hash isn't cached, across the process pool
+    """
+    def __init__(self, image_bank: ImageBank, templates_path: Path, cache_path: Path,
+                 max_bytes: int = DEFAULT_CACHE_BYTES, pool: BoundedPool | None = None):
+        self.image_bank: ImageBank = image_bank
+        self.templates_path: Path = templates_path
+        self.path: Path = cache_path
+        self.pool: BoundedPool | None = pool
+        """ Process pool cards are rendered in, they are rendered in the calling thread without one """
+
+        if not os.path.exists(templates_path):
+            raise FileNotFoundError("CARD_RENDER SETUP - Missing templates folder")
+        if not os.path.exists(cache_path):
+            raise FileNotFoundError("CARD_RENDER SETUP - Missing renders folder")
+
+        self.cache: FileCache = FileCache(cache_path, max_bytes)
+
+    def get_template_names(self) -> List[str]:
+        with os.scandir(self.templates_path) as folder:
+            return sorted(os.path.splitext(file.name)[0] for file in folder
+                          if file.is_file() and file.name.endswith(TEMPLATE_EXTENSION))
+
+    def get_template(self, name: str) -> CardTemplate:
+        with open(self._get_template_path(name), "r", encoding="utf-8") as file:
+            return CardTemplate.from_json(Json(file.read()))
+
+    def save_template(self, name: str, template_data: Json):
+        """ Store a template under a name, it is validated first """
+        CardTemplate.from_json(template_data)
+        write_atomically(self._get_template_path(name), template_data.encode("utf-8"))
+
+    def delete_template(self, name: str):
+        os.remove(self._get_template_path(name))
+
+    def get_render_path(self, key: str, image_format: str = "png") -> Path:
+        if image_format not in RENDER_FORMATS:
+            raise ValueError(f"CARD_RENDER GET - Unsupported format '{image_format}'")
+        return Path(os.path.join(self.path, f"{key}.{image_format}"))
+
+    @metrics.instrument(KIND_IMAGE)
+    def render_cards(self, cards: Iterable[Tuple[Uuid, Json]], template_name: str,
+                     image_format: str = "png") -> List[RenderResult]:
+        """ Render a batch of cards, a failing card is reported in its result and never stops the batch """
+        if image_format not in RENDER_FORMATS:
+            raise ValueError(f"CARD_RENDER RENDER - Unsupported format '{image_format}'")
+        template = self.get_template(template_name)
+        template_key = json.dumps(asdict(template), sort_keys=True)
+
+        results: List[RenderResult] = []
+        jobs: List[Tuple[Dict[str, Any], Dict[str, Path], Path]] = []
+        queued: Dict[str, List[RenderResult]] = {}
+        """ Results waiting on each render, cards that look the same share it """
+
+        for card_uuid, card_data in cards:
+            result = RenderResult(card_uuid)
+            results.append(result)
+            try:
+                card = json.loads(card_data)
+            except (TypeError, ValueError):
+                result.error = "CARD_RENDER RENDER - The card is not valid JSON"
+                continue
+            if not isinstance(card, dict):
+                result.error = "CARD_RENDER RENDER - The card is not a JSON object"
+                continue
+
+            images, image_keys = self._resolve_images(template, card)
+            result.key = _hash(json.dumps([RENDERER_VERSION, template_key, card, image_keys, image_format],
+                                          sort_keys=True))
+            if result.key in queued:
+                queued[result.key].append(result)
+            elif self.cache.touch(f"{result.key}.{image_format}"):
+                result.cached = True
+            else:
+                queued[result.key] = [result]
+                jobs.append((card, images, self.get_render_path(result.key, image_format)))
+
+        errors = self._render(template, jobs, RENDER_FORMATS[image_format][0])
+        rendered = []
+        for (_, _, destination), error in zip(jobs, errors):
+            name = os.path.basename(destination)
+            if error:
+                for result in queued[os.path.splitext(name)[0]]:
+                    result.error, result.key = error, ""
+            else:
+                rendered.append(name)
+        # Renders the batch found cached are returned too, new ones must not evict them
+        self.cache.add(rendered, {f"{result.key}.{image_format}" for result in results if result.key})
+        return results
+
+    def _resolve_images(self, template: CardTemplate, card: Dict[str, Any]) -> Tuple[Dict[str, Path], Dict[str, str]]:
+        """
+        Find the bank images the image layers of a template use on a card, with the key of their content.
+        Metadata edits keep that key, so renaming an image doesn't re-render its cards
+        """
+        images: Dict[str, Path] = {}
+        image_keys: Dict[str, str] = {}
+        for layer in template.layers:
+            if layer.type != LAYER_IMAGE:
+                continue
+            try:
+                image_uuid = UUID(str(get_field(card, layer.field)))
+            except ValueError:
+                continue
+            content_key = self.image_bank.get_content_key(image_uuid)
+            if content_key is None:
+                # Left blank until the image is imported, the key changes then
+                continue
+            images[layer.field] = self.image_bank.get_image_path(image_uuid)
+            image_keys[layer.field] = content_key
+        return images, image_keys
+
+    def _render(self, template: CardTemplate, jobs: List[Tuple[Dict[str, Any], Dict[str, Path], Path]],
+                pil_format: str) -> List[str]:
+        """ Render jobs in chunks across the pool, when it is full the next chunk waits for one of ours to finish """
+        chunks = [jobs[start:start + RENDER_CHUNK_SIZE] for start in range(0, len(jobs), RENDER_CHUNK_SIZE)]
+        if not self.pool:
+            return [error for chunk in chunks for error in render_card_files(template, chunk, pil_format)]
+
+        futures: List[Future] = []
+        for chunk in chunks:
+            while True:
+                try:
+                    futures.append(self.pool.submit(render_card_files, template, chunk, pil_format))
+                    break
+                except PoolBusyError:
+                    running = [future for future in futures if not future.done()]
+                    if not running:
+                        raise
+                    wait(running, return_when=FIRST_COMPLETED)
+        return [error for future in futures for error in future.result(self.pool.timeout)]
+
+    def _get_template_path(self, name: str) -> Path:
+        if not TEMPLATE_NAME.match(name):
+            raise ValueError(f"CARD_RENDER TEMPLATE - Invalid template name '{name}'")
+        return Path(os.path.join(self.templates_path, f"{name}{TEMPLATE_EXTENSION}"))
+
+
+def render_card_files(template: CardTemplate, jobs: List[Tuple[Dict[str, Any], Dict[str, Path], Path]],
+                      pil_format: str) -> List[str]:
+    """ Render cards to their files, return the error of every card, empty when it was rendered """
+    errors = []
+    for card, images, destination in jobs:
+        try:
+            output = draw_card(template, card, images)
+            if pil_format != "PNG":
+                output = output.convert("RGB")
+            buffer = io.BytesIO()
+            output.save(buffer, pil_format, quality=RENDER_QUALITY)
+            write_atomically(destination, buffer.getvalue())
+            errors.append("")
+        except Exception as e:
+            # Whatever a card does to the drawing only fails that card
+            errors.append(f"CARD_RENDER RENDER - {e}")
+    return errors
+
+
+def draw_card(template: CardTemplate, card: Dict[str, Any], images: Dict[str, Path]) -> Image.Image:
+    """ Draw a card through a template, `images` maps the fields of image layers to bank files """
+    canvas = Image.new("RGBA", (template.width, template.height), template.background)
+    draw = ImageDraw.Draw(canvas)
+    for layer in template.layers:
+        x, y, width, height = layer.box
+        if width <= 0 or height <= 0:
+            continue
+
+        if layer.type == LAYER_BOX:
+            draw.rectangle((x, y, x + width - 1, y + height - 1), fill=layer.color)
+        elif layer.type == LAYER_IMAGE and layer.field in images:
+            with Image.open(images[layer.field]) as source:
+                source.draft("RGB", (width, height))
+                art = source.convert("RGB")
+            if layer.fit == FIT_COVER:
+                art = ImageOps.fit(art, (width, height))
+            else:
+                art = ImageOps.contain(art, (width, height))
+            canvas.paste(art, (x + (width - art.width) // 2, y + (height - art.height) // 2))
+        elif layer.type == LAYER_TEXT:
+            value = get_field(card, layer.field)
+            if value is None:
+                continue
+            font = _load_font(layer.size)
+            lines = _wrap(draw, str(value), font, width)
+            line_height = font.getbbox("Ag")[3]
+            for row, line in enumerate(lines[:max(height // line_height, 1)]):
+                draw.text((x, y + row * line_height), line, fill=layer.color, font=font)
+    return canvas
+
+
+@functools.lru_cache(maxsize=32)
+def _load_font(size: int) -> ImageFont.FreeTypeFont:
+    """ Fonts are loaded once per worker process and size """
+    return ImageFont.load_default(size)
+
+
+def _wrap(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont, width: int) -> List[str]:
+    """ Break text into lines no wider than the box, on spaces, a word longer than the box gets a line of its own """
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if line and draw.textlength(candidate, font=font) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def _hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=20).hexdigest()
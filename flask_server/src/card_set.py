@@ -1,13 +1,22 @@
 import git
+import json
 import os
+import threading
 from uuid import uuid4 as generate_uuid
 from uuid import UUID
 
 from flask_server.src import Json, Path, Uuid, Branch
-from typing import List
+from flask_server.src.card_diff import CardDiff, CARD_ADDED, CARD_REMOVED, diff_fields
+from flask_server.src.card_query import CardIndex
+from flask_server.src.change_tracker import ChangeTracker
+from flask_server.src.commit_history import CommitHistory
+from flask_server.src.locks import ReadWriteLock
+from flask_server.src.metrics import metrics, KIND_GIT
+from flask_server.src.card_storage import CardStorage, STORAGES, FILE_STORAGE, SETTINGS_FILE_NAME
+from typing import Callable, Iterable, Iterator, Set
 
 
-SETTINGS_FILE_NAME = "settings.json"
+STORAGE_SETTING = "storage"
 
 
 class CardSet:
@@ -16,12 +25,37 @@ class CardSet:
         """ Initialize a CardSet object """
         self.path: Path = path
         self.repo: git.Repo = repo
+        self.lock: ReadWriteLock = ReadWriteLock()
+        """ Shared by requests reading and editing cards, held alone by git mutations, see `ProjectSession` """
+        self.objects_lock = threading.RLock()
+        """ The repo's object database talks to a single `git cat-file` process, its users take turns """
+        self.settings: dict = self._read_settings()
+        self.storage: CardStorage = STORAGES[self.settings.get(STORAGE_SETTING, FILE_STORAGE)](path, repo,
+                                                                                              self.objects_lock)
+        """ Layout the cards are kept in, picked by the set's settings """
+        self.storage.recover()
+        self.index: CardIndex = CardIndex()
+        """ Field index of the cards, it is built on the first query and kept current from then on """
+        self.changes: ChangeTracker = ChangeTracker(path, repo)
+        """ Paths changed since the last commit, fed by the editor's writes and by a watcher of the folder """
+        self.history: CommitHistory = CommitHistory(repo, self.objects_lock)
+
+    def close(self):
+        """ Stop watching the set's folder and release the repo's git processes """
+        self.changes.close()
+        self.repo.close()
 
     @staticmethod
-    def create_repo(path):
+    @metrics.instrument(KIND_GIT)
+    def create_repo(path, storage: str = FILE_STORAGE):
         """ Create a repo for this card set, this is designed to be used by the registry"""
+        if storage not in STORAGES:
+            raise ValueError(f"CARD_SET CREATE - Unknown card storage '{storage}'")
+
         repo = git.Repo.init(path)
-        open(os.path.join(path, SETTINGS_FILE_NAME), "wb").close()
+        with open(os.path.join(path, SETTINGS_FILE_NAME), "w") as file:
+            json.dump({STORAGE_SETTING: storage}, file)
+        STORAGES[storage].create(path)
         repo.index.add("*")
         repo.index.commit("Project has started")
         return repo
@@ -29,32 +63,24 @@ class CardSet:
     def get_active_branch(self) -> Branch:
         return Branch(self.repo.active_branch.name)
 
-    def save_changes(self, message: str):
-        """ Commit the changes to this branch """
-        # Get the current branch name
-        branch_name = self.repo.active_branch.name
-
-        # Get the hash of the current commit
-        commit_hash = self.repo.head.commit.hexsha
-
-        # Shelve changes
-        self.repo.git.stash("save", "-u")
-
-        # Switch to the head of the current branch
-        self.repo.heads[branch_name].checkout()
-
-        # Hard reset the branch to the specified commit
-        self.repo.git.reset("--hard", commit_hash)
-
-        # Unshelve changes
-        self.repo.git.stash("pop")
-
-        # Stage changes
-        self.repo.index.add("*")
-
-        # Commit the changes
-        self.repo.git.commit("-m", message)
-
+    @metrics.instrument(KIND_GIT)
+    def save_changes(self, message: str, paths: Iterable[str] | None = None) -> str | None:
+        """
+        Commit the changes to the checked out branch and return the new commit's hash.
+        Only the paths the change tracker holds are staged and the tree and commit are built in process,
+        unchanged files are never read again. Nothing is committed when nothing changed.
+        Given `paths`, only the changes among them are committed and other unsaved edits are left as they are
+        """
+        dirty_paths = self.changes.take(paths)
+        if not dirty_paths:
+            return None
+        try:
+            return self._commit_paths(dirty_paths, message)
+        except BaseException:
+            self.changes.mark(dirty_paths)
+            raise
+
+    @metrics.instrument(KIND_GIT)
     def create_branch(self, name: Branch, message: str):
         """ Create a new save_file or branch and push the current changes to this new save_file """
         if name in [branch.name for branch in self.repo.heads]:
@@ -67,23 +93,128 @@ class CardSet:
         """ Get a list of all saved files """
         return [branch.name for branch in self.repo.heads]
 
+    @metrics.instrument(KIND_GIT)
     def delete_branch(self, name: Branch):
         """ Delete a branch """
         self.repo.git.branch("-D", name)
 
+    @metrics.instrument(KIND_GIT)
     def rollback(self):
         """ Rollback the current changes """
-        self.repo.git.reset("--hard", "HEAD^")
+        self._swap_working_tree(lambda: self.repo.git.reset("--hard", "HEAD^"))
 
+    @metrics.instrument(KIND_GIT)
     def load_branch(self, name: Branch):
         """ Checks out a save branch """
-        self.repo.git.checkout(name, force=True)
+        self._swap_working_tree(lambda: self.repo.git.checkout(name, force=True))
 
+    @metrics.instrument(KIND_GIT)
     def load_commit(self, commit_hash):
         """ Load a targeted commit """
-        self.repo.git.checkout(commit_hash, force=True)
-
-    def get_commit_list(self, branch_name):
-        branch = self.repo.heads[branch_name]
-        commit_list = [(commit.hexsha, commit.message) for commit in branch.commit.iter_parents()]
-        return commit_list
+        self._swap_working_tree(lambda: self.repo.git.checkout(commit_hash, force=True))
+
+    @metrics.instrument(KIND_GIT)
+    def get_commit_list(self, branch_name, limit: int | None = None, before: str | None = None):
+        """
+        Return the (hash, message) pairs of the commits before the branch's head, newest first.
+        Pages of `limit` commits are walked by passing the last hash of a page as `before`
+        """
+        if branch_name not in [branch.name for branch in self.repo.heads]:
+            raise ValueError(f"CARD_SET HISTORY - Branch '{branch_name}' does not exist.")
+        if limit is not None and limit < 1:
+            raise ValueError("CARD_SET HISTORY - A page holds at least one commit")
+        start = self.resolve(before) if before else self.repo.heads[branch_name].commit.hexsha
+        return self.history.get_page(start, limit)
+
+    def diff(self, old_rev: str, new_rev: str, fields=False) -> Iterator[CardDiff]:
+        """
+        Return a stream of the cards that differ between two commits or branches, read straight from git objects
+        so neither side is checked out. `fields` adds the field level changes of every card
+        """
+        return self._walk_diff(self.resolve(old_rev), self.resolve(new_rev), fields)
+
+    def resolve(self, rev: str) -> str:
+        """ Return the hash of the commit a branch, tag or abbreviated hash points at """
+        try:
+            with self.objects_lock:
+                return self.repo.commit(rev).hexsha
+        except (ValueError, git.BadName, git.BadObject):
+            raise ValueError(f"CARD_SET RESOLVE - Unknown revision '{rev}'")
+
+    @metrics.instrument(KIND_GIT)
+    def write_commit_graph(self):
+        """ Let git write its commit-graph file, history walks of long lived projects get faster """
+        self.history.write_commit_graph()
+
+    def _swap_working_tree(self, swap: Callable[[], None]):
+        """ Run a git command that rewrites the working tree, and refresh what was derived from the old cards """
+        old_head = self.repo.head.commit.hexsha
+        changed: Set[str] = set()
+
+        # Tracked edits are discarded by the swap, untracked cards survive it
+        if self.index.is_built:
+            changed.update(self.repo.git.diff("--name-only", old_head).splitlines())
+
+        with metrics.timed(KIND_GIT, "CardSet.swap"):
+            swap()
+        self.storage.invalidate()
+        with metrics.timed(KIND_GIT, "CardSet.reconcile"):
+            self.changes.reconcile()
+
+        if self.index.is_built:
+            changed.update(self.repo.git.diff("--name-only", old_head, "HEAD").splitlines())
+            self._reindex(changed)
+
+    def _commit_paths(self, dirty_paths: Set[str], message: str) -> str | None:
+        """ Stage some paths, removed ones included, and commit them when the tree differs from HEAD """
+        index = self.repo.index
+        changed = []
+        with metrics.timed(KIND_GIT, "CardSet.stage", lambda: f"{len(dirty_paths)} paths"):
+            for path in sorted(dirty_paths):
+                if os.path.isfile(os.path.join(self.path, path)):
+                    changed.append(path)
+                else:
+                    index.entries.pop((path, 0), None)
+            if changed:
+                index.add(changed, write=False)
+            index.write()
+
+        # Paths written back to their committed content leave the tree as it was
+        head = self.repo.head.commit
+        with metrics.timed(KIND_GIT, "CardSet.write_tree"):
+            tree = index.write_tree()
+        if tree.binsha == head.tree.binsha:
+            return None
+        with metrics.timed(KIND_GIT, "CardSet.commit"):
+            return git.Commit.create_from_tree(self.repo, tree, message, parent_commits=[head], head=True).hexsha
+
+    def _walk_diff(self, old_rev: str, new_rev: str, fields: bool) -> Iterator[CardDiff]:
+        for change, card_uuid in self.storage.diff(old_rev, new_rev):
+            field_changes = None
+            if fields:
+                old_data = None if change == CARD_ADDED else self.storage.read_at(card_uuid, old_rev)
+                new_data = None if change == CARD_REMOVED else self.storage.read_at(card_uuid, new_rev)
+                field_changes = diff_fields(old_data, new_data)
+            yield CardDiff(card_uuid, change, field_changes)
+
+    def _reindex(self, names: Set[str]):
+        """ Refresh the index entries of the cards held in some repo files """
+        cards = self.storage.get_cards_in(names)
+        if cards is None:
+            self.index.invalidate()
+            return
+
+        for card_uuid in cards:
+            if self.storage.exists(card_uuid):
+                self.index.update(card_uuid, self.storage.read(card_uuid))
+            else:
+                self.index.remove(card_uuid)
+
+    def _read_settings(self) -> dict:
+        """ Read the set's settings file, sets created before settings existed have an empty one """
+        settings_path = os.path.join(self.path, SETTINGS_FILE_NAME)
+        if not os.path.exists(settings_path):
+            return {}
+        with open(settings_path, "r") as file:
+            content = file.read()
+        return json.loads(content) if content.strip() else {}
@@ -0,0 +1,312 @@
+import hashlib
+import io
+import json
+import os
+
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Tuple
+
+from PIL import Image, ImageColor, ImageOps, UnidentifiedImageError
+
+from flask_server.src import Path
+from flask_server.src.executors import BoundedPool
+from flask_server.src.files import FileCache, write_atomically
+from flask_server.src.metrics import metrics, KIND_IMAGE
+
+
+SHEET_GRID = "grid"
+SHEET_ATLAS = "atlas"
+SHEET_MODES = (SHEET_GRID, SHEET_ATLAS)
+SHEET_EXTENSION = ".png"
+SHEETS_VERSION = 1
+""" Part of every sheet key, bump it when composing changes so sheets of the previous code aren't served """
+MAX_SHEET_SIDE = 16384
+DEFAULT_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+
+@dataclass
+class SheetLayout:
+    """
+    How items are laid out on sheets, in pixels. Grid sheets hold `columns` x `rows` cells for printing,
+    the default is a 3x3 page of poker cards at 300 DPI. Atlas sheets pack items at their own size, scaled,
+    into power of two textures no larger than `size`
+    """
+    mode: str = SHEET_GRID
+    columns: int = 3
+    rows: int = 3
+    cell_width: int = 750
+    cell_height: int = 1050
+    margin: int = 0
+    spacing: int = 0
+    dpi: int = 300
+    size: int = 2048
+    padding: int = 2
+    scale: float = 1.0
+    background: str = ""
+    """ White for grids and transparent for atlases when empty """
+
+    @staticmethod
+    def from_dict(document: Dict[str, Any]) -> "SheetLayout":
+        """ Build and validate a layout, raise ValueError when it can't be composed """
+        try:
+            layout = SheetLayout(**document)
+        except TypeError as e:
+            raise ValueError(f"CARD_SHEETS LAYOUT - Invalid layout: {e}")
+
+        if layout.mode not in SHEET_MODES:
+            raise ValueError(f"CARD_SHEETS LAYOUT - Unknown mode '{layout.mode}'")
+        numbers = (layout.columns, layout.rows, layout.cell_width, layout.cell_height, layout.margin, layout.spacing,
+                   layout.dpi, layout.size, layout.padding)
+        if any(not isinstance(number, int) for number in numbers):
+            raise ValueError("CARD_SHEETS LAYOUT - Sizes and counts are whole numbers")
+        if min(layout.columns, layout.rows, layout.cell_width, layout.cell_height, layout.dpi) <= 0 \
+                or min(layout.margin, layout.spacing, layout.padding) < 0:
+            raise ValueError("CARD_SHEETS LAYOUT - Sizes and counts must be positive")
+        if layout.size <= 0 or layout.size & (layout.size - 1) or layout.size > MAX_SHEET_SIDE:
+            raise ValueError(f"CARD_SHEETS LAYOUT - The atlas size must be a power of two up to {MAX_SHEET_SIDE}")
+        if not isinstance(layout.scale, (int, float)) or layout.scale <= 0:
+            raise ValueError("CARD_SHEETS LAYOUT - The scale must be positive")
+        if max(layout.get_grid_size()) > MAX_SHEET_SIDE:
+            raise ValueError(f"CARD_SHEETS LAYOUT - Sheets can't be larger than {MAX_SHEET_SIDE} pixels")
+        if layout.background:
+            try:
+                ImageColor.getrgb(layout.background)
+            except ValueError as e:
+                raise ValueError(f"CARD_SHEETS LAYOUT - {e}")
+        return layout
+
+    def get_grid_size(self) -> Tuple[int, int]:
+        return (2 * self.margin + self.columns * self.cell_width + (self.columns - 1) * self.spacing,
+                2 * self.margin + self.rows * self.cell_height + (self.rows - 1) * self.spacing)
+
+    def get_background(self) -> str:
+        return self.background or ("white" if self.mode == SHEET_GRID else "#00000000")
+
+
+@dataclass
+class SheetItem:
+    """ A picture to lay out, `key` changes whenever its content does """
+    name: str
+    path: Path
+    key: str
+
+
+@dataclass
+class SheetPlacement:
+    """ Where an item sits on its sheet, in pixels and in UV coordinates with the origin at the top left """
+    name: str
+    x: int
+    y: int
+    width: int
+    height: int
+    u0: float = 0.0
+    v0: float = 0.0
+    u1: float = 0.0
+    v1: float = 0.0
+
+
+@dataclass
+class Sheet:
+    """ A composed sheet, `key` names its file in the sheet cache """
+    key: str
+    width: int
+    height: int
+    cached: bool = False
+    placements: List[SheetPlacement] = field(default_factory=list)
+
+
+@dataclass
+class SheetManifest:
+    """ The sheets a set of items was laid out on, `skipped` lists the items that fit on none """
+    layout: SheetLayout
+    sheets: List[Sheet] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+
+
+class SheetBuilder:
+    """
+    Lays cards or art out on print sheets or texture atlases. Layouts are planned from image headers only,
+    then sheets are composed one at a time, so memory holds a single sheet whatever the number of items.
+    A sheet is named after a hash of its layout and the content keys of its items and is reused while cached
+    """
+    def __init__(self, cache_path: Path, max_bytes: int = DEFAULT_CACHE_BYTES, pool: BoundedPool | None = None):
+        self.path: Path = cache_path
+        self.pool: BoundedPool | None = pool
+        """ Process pool sheets are composed in, they are composed in the calling thread without one """
+
+        if not os.path.exists(cache_path):
+            raise FileNotFoundError("CARD_SHEETS SETUP - Missing sheets folder")
+
+        self.cache: FileCache = FileCache(cache_path, max_bytes)
+
+    def get_sheet_path(self, key: str) -> Path:
+        return Path(os.path.join(self.path, f"{key}{SHEET_EXTENSION}"))
+
+    @metrics.instrument(KIND_IMAGE)
+    def build(self, items: List[SheetItem], layout: SheetLayout) -> SheetManifest:
+        manifest = SheetManifest(layout)
+        if layout.mode == SHEET_GRID:
+            plans = self._plan_grid(items, layout)
+        else:
+            plans = self._plan_atlas(items, layout, manifest.skipped)
+
+        layout_key = json.dumps(asdict(layout), sort_keys=True)
+        for width, height, placed in plans:
+            description = [SHEETS_VERSION, layout_key, width, height,
+                           [(item.key, placement.x, placement.y, placement.width, placement.height)
+                            for item, placement in placed]]
+            key = hashlib.blake2b(json.dumps(description).encode("utf-8"), digest_size=20).hexdigest()
+            sheet = Sheet(key, width, height, self.cache.touch(f"{key}{SHEET_EXTENSION}"),
+                          [placement for _, placement in placed])
+            for placement in sheet.placements:
+                placement.u0, placement.v0 = placement.x / width, placement.y / height
+                placement.u1 = (placement.x + placement.width) / width
+                placement.v1 = (placement.y + placement.height) / height
+
+            if not sheet.cached:
+                arguments = (width, height, layout.get_background(), layout.dpi,
+                             [(item.path, placement.x, placement.y, placement.width, placement.height)
+                              for item, placement in placed], self.get_sheet_path(key))
+                if self.pool:
+                    self.pool.run(compose_sheet, *arguments)
+                else:
+                    compose_sheet(*arguments)
+                self.cache.add([f"{key}{SHEET_EXTENSION}"],
+                               [f"{previous.key}{SHEET_EXTENSION}" for previous in manifest.sheets])
+            manifest.sheets.append(sheet)
+        return manifest
+
+    @staticmethod
+    def _plan_grid(items: List[SheetItem], layout: SheetLayout) -> List[Tuple[int, int, List]]:
+        """ Give every item a cell, in order, pages are filled row by row """
+        width, height = layout.get_grid_size()
+        per_sheet = layout.columns * layout.rows
+        plans = []
+        for start in range(0, len(items), per_sheet):
+            placed = []
+            for cell, item in enumerate(items[start:start + per_sheet]):
+                x = layout.margin + cell % layout.columns * (layout.cell_width + layout.spacing)
+                y = layout.margin + cell // layout.columns * (layout.cell_height + layout.spacing)
+                placed.append((item, SheetPlacement(item.name, x, y, layout.cell_width, layout.cell_height)))
+            plans.append((width, height, placed))
+        return plans
+
+    @staticmethod
+    def _plan_atlas(items: List[SheetItem], layout: SheetLayout, skipped: List[str]) -> List[Tuple[int, int, List]]:
+        """
+        Pack items tallest first with a bottom-left skyline, items left over start the next atlas.
+        Every atlas is then trimmed to the smallest power of two sides holding what it packed
+        """
+        sized = []
+        for item in items:
+            try:
+                with Image.open(item.path) as image:
+                    width, height = image.size
+            except (OSError, UnidentifiedImageError):
+                skipped.append(item.name)
+                continue
+            width, height = max(round(width * layout.scale), 1), max(round(height * layout.scale), 1)
+            if width > layout.size or height > layout.size:
+                skipped.append(item.name)
+                continue
+            sized.append((item, width, height))
+
+        plans = []
+        remaining = sorted(sized, key=lambda entry: (-entry[2], -entry[1]))
+        while remaining:
+            # The padding of items on the far edges may fall outside the atlas
+            skyline = _Skyline(layout.size + layout.padding, layout.size + layout.padding)
+            placed, left = [], []
+            for item, width, height in remaining:
+                position = skyline.insert(width + layout.padding, height + layout.padding)
+                if position is None:
+                    left.append((item, width, height))
+                else:
+                    placed.append((item, SheetPlacement(item.name, position[0], position[1], width, height)))
+
+            used_width = max(placement.x + placement.width for _, placement in placed)
+            used_height = max(placement.y + placement.height for _, placement in placed)
+            plans.append((_next_power_of_two(used_width), _next_power_of_two(used_height), placed))
+            remaining = left
+        return plans
+
+
+class _Skyline:
+    """ Free space of an atlas, tracked as the bottom edge of what is packed, in `[x, y, width]` segments """
+    def __init__(self, width: int, height: int):
+        self.width: int = width
+        self.height: int = height
+        self.segments: List[List[int]] = [[0, 0, width]]
+
+    def insert(self, width: int, height: int) -> Tuple[int, int] | None:
+        """ Place a rectangle where its bottom edge is the highest, then the leftmost, None when it doesn't fit """
+        best = None
+        for index, (x, _, _) in enumerate(self.segments):
+            y = self._fit(index, width, height)
+            if y is not None and (best is None or (y + height, x) < best[:2]):
+                best = (y + height, x, index, y)
+        if best is None:
+            return None
+
+        bottom, x, index, y = best
+        self._place(index, x, bottom, width)
+        return x, y
+
+    def _fit(self, index: int, width: int, height: int) -> int | None:
+        """ Return the top a rectangle starting on a segment would rest at, None when it doesn't fit there """
+        x = self.segments[index][0]
+        if x + width > self.width:
+            return None
+        y, remaining = 0, width
+        while remaining > 0:
+            y = max(y, self.segments[index][1])
+            if y + height > self.height:
+                return None
+            remaining -= self.segments[index][2]
+            index += 1
+        return y
+
+    def _place(self, index: int, x: int, bottom: int, width: int):
+        self.segments.insert(index, [x, bottom, width])
+
+        # Trim the segments the rectangle now covers
+        following = index + 1
+        while following < len(self.segments):
+            previous, segment = self.segments[following - 1], self.segments[following]
+            overlap = previous[0] + previous[2] - segment[0]
+            if overlap <= 0:
+                break
+            segment[0] += overlap
+            segment[2] -= overlap
+            if segment[2] > 0:
+                break
+            del self.segments[following]
+
+        # Join neighbours at the same height
+        index = 0
+        while index < len(self.segments) - 1:
+            if self.segments[index][1] == self.segments[index + 1][1]:
+                self.segments[index][2] += self.segments.pop(index + 1)[2]
+            else:
+                index += 1
+
+
+def compose_sheet(width: int, height: int, background: str, dpi: int,
+                  placements: List[Tuple[Path, int, int, int, int]], destination: Path):
+    """ Paste items into their boxes, opening one at a time, each is scaled to fit its box and centered in it """
+    sheet = Image.new("RGBA", (width, height), background)
+    for path, x, y, box_width, box_height in placements:
+        with Image.open(path) as source:
+            source.draft("RGB", (box_width, box_height))
+            item = source.convert("RGBA")
+        if item.size != (box_width, box_height):
+            item = ImageOps.contain(item, (box_width, box_height))
+        sheet.alpha_composite(item, (x + (box_width - item.width) // 2, y + (box_height - item.height) // 2))
+
+    output = io.BytesIO()
+    sheet.save(output, "PNG", dpi=(dpi, dpi))
+    write_atomically(destination, output.getvalue())
+
+
+def _next_power_of_two(value: int) -> int:
+    return 1 << max(value - 1, 0).bit_length()
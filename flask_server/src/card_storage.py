@@ -0,0 +1,457 @@
+import git
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Set, Tuple
+from uuid import UUID
+
+from flask_server.src import Json, Path, Uuid
+from flask_server.src.card_cache import BlobCache, CardCache
+from flask_server.src.card_diff import CARD_ADDED, CARD_MODIFIED, CARD_REMOVED
+from flask_server.src.files import write_atomically, fsync_folder
+
+
+SETTINGS_FILE_NAME = "settings.json"
+CARD_EXTENSION = ".json"
+FILE_STORAGE = "files"
+PACK_STORAGE = "pack"
+PACK_FILE_NAME = "cards.pack"
+BATCH_FOLDER_NAME = "card_batches"
+""" Folder within the repo's git dir where batches are staged, it is invisible to the working tree """
+JOURNAL_FILE_NAME = "journal.json"
+STALE_BATCH_SECONDS = 60 * 60
+""" Age past which a staging folder without a journal is left over from a crash rather than being written """
+
+CardChanges = List[Tuple[Uuid, Json | None]]
+""" New content of many cards, cards without content are deleted """
+
+
+class CardStorage:
+    """
+    Base class of the layouts a card set can keep its cards in.
+    Storages only move card content around, the card editor is in charge of validating the changes
+    """
+    def __init__(self, path: Path, repo: git.Repo, objects_lock: ContextManager | None = None):
+        self.path: Path = path
+        self.repo: git.Repo = repo
+        self.blobs: BlobCache = BlobCache()
+        """ Trees and cards read from past revisions, by object sha """
+        self._objects_lock = objects_lock or threading.RLock()
+        """ The repo's object database talks to a single `git cat-file` process, shared with the card set """
+
+    @staticmethod
+    def create(path: Path):
+        """ Create the files a new card set needs, before its first commit """
+
+    def exists(self, card_uuid: Uuid) -> bool:
+        raise NotImplementedError
+
+    def read(self, card_uuid: Uuid) -> Json:
+        """ Return the content of a card, raise FileNotFoundError when it doesn't exist """
+        raise NotImplementedError
+
+    def list(self) -> List[UUID]:
+        raise NotImplementedError
+
+    def read_at(self, card_uuid: Uuid, rev: str) -> Json:
+        """ Return the content of a card at a commit or branch, without touching the working tree """
+        raise NotImplementedError
+
+    def list_at(self, rev: str) -> List[UUID]:
+        """ Return every card of the set at a commit or branch, without touching the working tree """
+        raise NotImplementedError
+
+    def scan_at(self, rev: str) -> Iterator[Tuple[Uuid, Json]]:
+        """ Walk every card of the set at a commit or branch """
+        for card_uuid in self.list_at(rev):
+            yield Uuid(str(card_uuid)), self.read_at(Uuid(str(card_uuid)), rev)
+
+    def diff(self, old_rev: str, new_rev: str) -> Iterator[Tuple[str, Uuid]]:
+        """ Walk the (change, card uuid) pairs of the cards that differ between two revisions, by uuid """
+        raise NotImplementedError
+
+    def scan(self) -> Iterator[Tuple[Uuid, Json]]:
+        """ Walk every card of the set """
+        for card_uuid in self.list():
+            yield Uuid(str(card_uuid)), self.read(Uuid(str(card_uuid)))
+
+    def write(self, changes: CardChanges) -> List[str]:
+        """ Apply many card changes as one atomic group and return the repo paths that were written """
+        raise NotImplementedError
+
+    def recover(self):
+        """ Repair what an interrupted write left behind """
+
+    def invalidate(self):
+        """ Forget whatever is held in memory, used when git rewrites the working tree """
+
+    def get_cards_in(self, names: Set[str]) -> Set[Uuid] | None:
+        """ Map repo file names to the cards they hold, None means any card may be in them """
+        raise NotImplementedError
+
+    def get_unsaved_cards(self, dirty_paths: Set[str]) -> List[UUID]:
+        """ Return the cards that exist and differ from the last commit, only `dirty_paths` may hold such cards """
+        raise NotImplementedError
+
+    def _get_tree(self, rev: str) -> git.Tree:
+        with self._objects_lock:
+            try:
+                return self.repo.commit(rev).tree
+            except (ValueError, git.BadName, git.BadObject):
+                raise ValueError(f"CARD_STORAGE REVISION - Unknown revision '{rev}'")
+
+    def _get_files_at(self, rev: str | git.Tree) -> Dict[str, str]:
+        """ Return the sha of every file at the root of a revision's tree, by name """
+        tree = rev if isinstance(rev, git.Tree) else self._get_tree(rev)
+        with self._objects_lock:
+            files = self.blobs.get(tree.hexsha)
+            if files is None:
+                files = {blob.name: blob.hexsha for blob in tree.blobs}
+                self.blobs.put(tree.hexsha, files, sum(len(name) + 40 for name in files))
+        return files
+
+    def _read_blob(self, sha: str, parse: Callable[[bytes], Any]) -> Any:
+        """ Return the parsed content of a blob, read once through the object database and then from the cache """
+        value = self.blobs.get(sha)
+        if value is None:
+            with self._objects_lock:
+                content = self.repo.odb.stream(bytes.fromhex(sha)).read()
+            value = parse(content)
+            self.blobs.put(sha, value, len(content))
+        return value
+
+
+class FileCardStorage(CardStorage):
+    """ Keeps every card in its own `<uuid>.json` file at the root of the card set """
+    def __init__(self, path: Path, repo: git.Repo, objects_lock: ContextManager | None = None):
+        super().__init__(path, repo, objects_lock)
+        self.cache: CardCache = CardCache()
+        """ Cards read from disk, validated against their files stat info """
+
+    def exists(self, card_uuid: Uuid) -> bool:
+        return os.path.isfile(self._get_card_path(card_uuid))
+
+    def read(self, card_uuid: Uuid) -> Json:
+        """ Return the content of a card, it is served from the cache while the file is unchanged """
+        file_name = f"{card_uuid}{CARD_EXTENSION}"
+        card_path = os.path.join(self.path, file_name)
+        try:
+            stat = os.stat(card_path)
+        except FileNotFoundError:
+            raise FileNotFoundError("CARD_STORAGE READ - Missing card file")
+
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        card_data = self.cache.get_card(file_name, stamp)
+        if card_data is None:
+            with open(card_path, 'r') as file:
+                card_data = Json(file.read())
+            self.cache.put_card(file_name, stamp, card_data)
+        return card_data
+
+    def list(self) -> List[UUID]:
+        """ Return every card in the set, it is served from the cache while the folder is unchanged """
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cards = self.cache.get_listing(stamp)
+        if cards is not None:
+            return cards
+
+        cards = []
+        with os.scandir(self.path) as folder:
+            for file in folder:
+                name, extension = os.path.splitext(file.name)
+                if not file.is_file() or file.name == SETTINGS_FILE_NAME or extension != CARD_EXTENSION:
+                    continue
+                cards.append(UUID(name))
+        self.cache.put_listing(stamp, cards)
+        return cards
+
+    def read_at(self, card_uuid: Uuid, rev: str) -> Json:
+        sha = self._get_files_at(rev).get(f"{card_uuid}{CARD_EXTENSION}")
+        if sha is None:
+            raise FileNotFoundError("CARD_STORAGE READ - Missing card file at revision")
+        return self._read_blob(sha, lambda content: Json(content.decode("utf-8")))
+
+    def list_at(self, rev: str) -> List[UUID]:
+        cards = []
+        for name in self._get_files_at(rev):
+            card_uuid, extension = os.path.splitext(name)
+            if name != SETTINGS_FILE_NAME and extension == CARD_EXTENSION:
+                cards.append(UUID(card_uuid))
+        return cards
+
+    def diff(self, old_rev: str, new_rev: str) -> Iterator[Tuple[str, Uuid]]:
+        """ Identical trees are skipped whole, then only the card files whose blob sha differs are reported """
+        old_tree = self._get_tree(old_rev)
+        new_tree = self._get_tree(new_rev)
+        if old_tree.binsha == new_tree.binsha:
+            return
+
+        old_files = self._get_files_at(old_tree)
+        new_files = self._get_files_at(new_tree)
+        for name in sorted(old_files.keys() | new_files.keys()):
+            card_uuid, extension = os.path.splitext(name)
+            if name == SETTINGS_FILE_NAME or extension != CARD_EXTENSION:
+                continue
+            if name not in old_files:
+                yield CARD_ADDED, Uuid(card_uuid)
+            elif name not in new_files:
+                yield CARD_REMOVED, Uuid(card_uuid)
+            elif old_files[name] != new_files[name]:
+                yield CARD_MODIFIED, Uuid(card_uuid)
+
+    def write(self, changes: CardChanges) -> List[str]:
+        """
+        Cards are written to a staging folder first, and a journal makes the group of renames
+        that publishes them redoable after a crash
+        """
+        staging = tempfile.mkdtemp(dir=self._get_batch_folder())
+        renames: List[Tuple[Path, Path]] = []
+        deletions: List[Path] = []
+
+        try:
+            for card_uuid, card_data in changes:
+                card_path = self._get_card_path(card_uuid)
+                if card_data is None:
+                    deletions.append(card_path)
+                    continue
+
+                staged_path = Path(os.path.join(staging, f"{card_uuid}{CARD_EXTENSION}"))
+                with open(staged_path, 'w') as file:
+                    file.write(card_data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                renames.append((staged_path, card_path))
+
+            # Writing the journal is the commit point, a single rename or deletion is atomic on its own
+            if len(changes) > 1:
+                journal = {"renames": renames, "deletions": deletions}
+                write_atomically(Path(os.path.join(staging, JOURNAL_FILE_NAME)), json.dumps(journal).encode())
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        self._publish(renames, deletions)
+        shutil.rmtree(staging, ignore_errors=True)
+
+        for card_uuid, _ in changes:
+            self.cache.discard_card(f"{card_uuid}{CARD_EXTENSION}")
+        self.cache.discard_listing()
+        return [f"{card_uuid}{CARD_EXTENSION}" for card_uuid, _ in changes]
+
+    def recover(self):
+        """
+        Finish the batches a crash interrupted after their commit point and drop the ones that didn't reach it.
+        A folder without a journal may be a batch another writer is still staging, it is only dropped once stale
+        """
+        batch_folder = self._get_batch_folder()
+        for staging in os.listdir(batch_folder):
+            staging = os.path.join(batch_folder, staging)
+            journal_path = os.path.join(staging, JOURNAL_FILE_NAME)
+            try:
+                if os.path.exists(journal_path):
+                    with open(journal_path, 'r') as file:
+                        journal = json.load(file)
+                    self._publish(journal["renames"], journal["deletions"])
+                elif time.time() - os.path.getmtime(staging) < STALE_BATCH_SECONDS:
+                    continue
+            except FileNotFoundError:
+                # Its writer published it and cleaned up in the meantime
+                continue
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def invalidate(self):
+        self.cache.clear()
+
+    def get_cards_in(self, names: Set[str]) -> Set[Uuid] | None:
+        cards = set()
+        for name in names:
+            card_uuid, extension = os.path.splitext(name)
+            if name != SETTINGS_FILE_NAME and extension == CARD_EXTENSION and not os.path.dirname(name):
+                cards.add(Uuid(card_uuid))
+        return cards
+
+    def get_unsaved_cards(self, dirty_paths: Set[str]) -> List[UUID]:
+        """
+        Dirty card files are hashed and compared with the blob of the last commit, clean ones are never read.
+        The listing of the committed tree is cached by its sha, so a call costs as much as the dirty files
+        """
+        cards = self.get_cards_in(dirty_paths)
+        if not cards:
+            return []
+        try:
+            committed = self._get_files_at("HEAD")
+        except ValueError:
+            committed = {}
+
+        result = []
+        for card_uuid in cards:
+            file_name = f"{card_uuid}{CARD_EXTENSION}"
+            try:
+                with open(os.path.join(self.path, file_name), "rb") as file:
+                    content = file.read()
+            except FileNotFoundError:
+                continue
+            if committed.get(file_name) != hash_blob(content).hex():
+                result.append(UUID(card_uuid))
+        return result
+
+    def _publish(self, renames: List[Tuple[Path, Path]], deletions: List[Path]):
+        """ Move staged cards into the set and delete the removed ones, replaying it is harmless """
+        for staged_path, card_path in renames:
+            if os.path.exists(staged_path):
+                os.replace(staged_path, card_path)
+        for card_path in deletions:
+            if os.path.exists(card_path):
+                os.remove(card_path)
+        fsync_folder(self.path)
+
+    def _get_batch_folder(self) -> Path:
+        folder = Path(os.path.join(self.repo.git_dir, BATCH_FOLDER_NAME))
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def _get_card_path(self, card_uuid: Uuid) -> Path:
+        return Path(os.path.join(self.path, f"{card_uuid}{CARD_EXTENSION}"))
+
+
+class PackCardStorage(CardStorage):
+    """
+    Keeps every card in a single `cards.pack` file, one `<uuid>\\t<json string>` line per card sorted by uuid.
+    The format is deterministic and line based so it still diffs card by card in git, while a set of any size
+    costs a single inode and index entry. The pack is held in memory and reloaded when its file changes
+    """
+    def __init__(self, path: Path, repo: git.Repo, objects_lock: ContextManager | None = None):
+        super().__init__(path, repo, objects_lock)
+        self.pack_path: Path = Path(os.path.join(path, PACK_FILE_NAME))
+        self._lock = threading.RLock()
+        self._cards: Dict[Uuid, Json] | None = None
+        self._stamp: Tuple[int, int] | None = None
+
+    @staticmethod
+    def create(path: Path):
+        open(os.path.join(path, PACK_FILE_NAME), "wb").close()
+
+    def exists(self, card_uuid: Uuid) -> bool:
+        return card_uuid in self._load()
+
+    def read(self, card_uuid: Uuid) -> Json:
+        try:
+            return self._load()[card_uuid]
+        except KeyError:
+            raise FileNotFoundError("CARD_STORAGE READ - Missing card")
+
+    def list(self) -> List[UUID]:
+        return [UUID(card_uuid) for card_uuid in self._load()]
+
+    def scan(self) -> Iterator[Tuple[Uuid, Json]]:
+        yield from list(self._load().items())
+
+    def read_at(self, card_uuid: Uuid, rev: str) -> Json:
+        try:
+            return self._load_at(rev)[card_uuid]
+        except KeyError:
+            raise FileNotFoundError("CARD_STORAGE READ - Missing card at revision")
+
+    def list_at(self, rev: str) -> List[UUID]:
+        return [UUID(card_uuid) for card_uuid in self._load_at(rev)]
+
+    def scan_at(self, rev: str) -> Iterator[Tuple[Uuid, Json]]:
+        yield from self._load_at(rev).items()
+
+    def diff(self, old_rev: str, new_rev: str) -> Iterator[Tuple[str, Uuid]]:
+        """ Identical pack blobs are skipped whole, otherwise both versions are compared card by card """
+        old_sha = self._get_files_at(old_rev).get(PACK_FILE_NAME)
+        new_sha = self._get_files_at(new_rev).get(PACK_FILE_NAME)
+        if old_sha == new_sha:
+            return
+
+        old_cards = self._load_at(old_rev)
+        new_cards = self._load_at(new_rev)
+        for card_uuid in sorted(old_cards.keys() | new_cards.keys()):
+            if card_uuid not in old_cards:
+                yield CARD_ADDED, card_uuid
+            elif card_uuid not in new_cards:
+                yield CARD_REMOVED, card_uuid
+            elif old_cards[card_uuid] != new_cards[card_uuid]:
+                yield CARD_MODIFIED, card_uuid
+
+    def write(self, changes: CardChanges) -> List[str]:
+        """ The pack is rewritten through a temporary file and a rename, so the group is atomic as a whole """
+        with self._lock:
+            cards = dict(self._load())
+            for card_uuid, card_data in changes:
+                if card_data is None:
+                    cards.pop(card_uuid, None)
+                else:
+                    cards[card_uuid] = card_data
+
+            write_atomically(self.pack_path, serialize_pack(cards))
+            self._cards = cards
+            self._stamp = self._get_stamp()
+        return [PACK_FILE_NAME]
+
+    def invalidate(self):
+        with self._lock:
+            self._cards = None
+            self._stamp = None
+
+    def get_cards_in(self, names: Set[str]) -> Set[Uuid] | None:
+        return None if PACK_FILE_NAME in names else set()
+
+    def get_unsaved_cards(self, dirty_paths: Set[str]) -> List[UUID]:
+        """ Compare the pack with its committed version card by card, when the pack is dirty at all """
+        if PACK_FILE_NAME not in dirty_paths:
+            return []
+        committed = self._load_at("HEAD")
+        cards = self._load()
+        return [UUID(card_uuid) for card_uuid, card_data in cards.items() if committed.get(card_uuid) != card_data]
+
+    def _load(self) -> Dict[Uuid, Json]:
+        """ Return the cards of the pack, the file is parsed again only when it changed """
+        with self._lock:
+            stamp = self._get_stamp()
+            if self._cards is None or stamp != self._stamp:
+                with open(self.pack_path, "rb") as file:
+                    self._cards = parse_pack(file.read())
+                self._stamp = stamp
+            return self._cards
+
+    def _load_at(self, rev: str) -> Dict[Uuid, Json]:
+        """ Return the cards of the pack at a revision, each version of the pack is parsed once """
+        sha = self._get_files_at(rev).get(PACK_FILE_NAME)
+        return {} if sha is None else self._read_blob(sha, parse_pack)
+
+    def _get_stamp(self) -> Tuple[int, int]:
+        stat = os.stat(self.pack_path)
+        return stat.st_mtime_ns, stat.st_size
+
+
+def hash_blob(content: bytes) -> bytes:
+    """ Return the binary object id git gives to a blob """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).digest()
+
+
+def serialize_pack(cards: Dict[Uuid, Json]) -> bytes:
+    """ Encode cards in the pack format """
+    lines = [f"{card_uuid}\t{json.dumps(cards[card_uuid])}\n" for card_uuid in sorted(cards)]
+    return "".join(lines).encode("utf-8")
+
+
+def parse_pack(payload: bytes) -> Dict[Uuid, Json]:
+    """ Decode cards from the pack format """
+    cards = {}
+    for line in payload.decode("utf-8").splitlines():
+        if not line:
+            continue
+        card_uuid, card_data = line.split("\t", 1)
+        cards[Uuid(card_uuid)] = Json(json.loads(card_data))
+    return cards
+
+
+STORAGES = {FILE_STORAGE: FileCardStorage, PACK_STORAGE: PackCardStorage}
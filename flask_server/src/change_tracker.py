@@ -0,0 +1,136 @@
+import git
+import os
+import threading
+
+from typing import Iterable, Set
+
+from flask_server.src import Path
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+WRITE_EVENTS = {"created", "modified", "deleted", "moved", "closed"}
+""" Watchdog events that may change a file, reads also raise events on some platforms """
+
+
+class ChangeTracker:
+    """
+    Live set of the repo paths that may have changed since the last commit.
+    It is fed by the card editor's own writes and, when watchdog is installed, by a file system observer that
+    catches edits made outside the app. Git is asked for the whole status only when the set is first needed and
+    after a command rewrote the working tree, so answering what is unsaved costs as much as what changed.
+    Without watchdog, edits made outside the app are only seen at those reconciliations
+    """
+    def __init__(self, path: Path, repo: git.Repo):
+        self.path: Path = path
+        self.repo: git.Repo = repo
+        self._lock = threading.Lock()
+        self._dirty: Set[str] | None = None
+        """ Repo relative paths, None until the set was reconciled with git """
+        self._observer = None
+
+    @property
+    def is_watching(self) -> bool:
+        return self._observer is not None
+
+    def mark(self, paths: Iterable[str]):
+        """ Record paths that were written, marks made before the first reconciliation are covered by it """
+        with self._lock:
+            if self._dirty is not None:
+                self._dirty.update(paths)
+
+    def reconcile(self):
+        """ Replace the set with what git reports, the observer is started first so no edit falls in between """
+        with self._lock:
+            self._watch()
+            status = self.repo.git.status("--porcelain", "-z", "--no-renames", "--untracked-files=all")
+            self._dirty = {entry[3:] for entry in status.split("\0") if entry}
+
+    def get_dirty_paths(self) -> Set[str]:
+        if self._dirty is None:
+            self.reconcile()
+        with self._lock:
+            return set(self._dirty)
+
+    def take(self, paths: Iterable[str] | None = None) -> Set[str]:
+        """
+        Return the dirty paths and start a new set, paths written from now on are recorded again.
+        Given `paths`, only those of them that are dirty are taken and the others stay in the set
+        """
+        if self._dirty is None:
+            self.reconcile()
+        with self._lock:
+            if paths is None:
+                dirty = self._dirty
+                self._dirty = set()
+                return dirty
+            dirty = self._dirty.intersection(paths)
+            self._dirty -= dirty
+            return dirty
+
+    def close(self):
+        """ Stop the observer, the set is reconciled again if the tracker is used afterwards """
+        with self._lock:
+            observer = self._observer
+            self._observer = None
+            self._dirty = None
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+    def _watch(self):
+        """
+        Start observing the set's folder when watchdog is available, the lock must be held.
+        The git dir is left out of the watch, commits and checkouts write many files there
+        """
+        if Observer is None or self._observer is not None:
+            return
+        observer = Observer()
+        handler = _WorkingTreeHandler(self)
+        observer.schedule(handler, self.path, recursive=False)
+        with os.scandir(self.path) as folder:
+            for entry in folder:
+                if entry.is_dir(follow_symlinks=False) and entry.name != ".git":
+                    observer.schedule(handler, entry.path, recursive=True)
+        observer.daemon = True
+        observer.start()
+        self._observer = observer
+
+    def _watch_folder(self, folder_path: str):
+        """ Observe a folder created at the root of the set, and record what was written in it before """
+        path = os.path.relpath(folder_path, self.path)
+        with self._lock:
+            if self._observer is None or path == ".git" or os.path.dirname(path):
+                return
+            self._observer.schedule(_WorkingTreeHandler(self), folder_path, recursive=True)
+        for root, _, files in os.walk(folder_path):
+            for name in files:
+                self._mark_event(os.path.join(root, name))
+
+    def _mark_event(self, event_path: str):
+        """ Record a path reported by the observer """
+        path = os.path.relpath(event_path, self.path)
+        if path.startswith("..") or path == ".git":
+            return
+        self.mark([path.replace(os.sep, "/")])
+
+
+class _WorkingTreeHandler(FileSystemEventHandler):
+    """ Forwards the file writes watchdog observes to a tracker """
+    def __init__(self, tracker: ChangeTracker):
+        super().__init__()
+        self.tracker = tracker
+
+    def on_any_event(self, event):
+        if event.is_directory and event.event_type in ("created", "moved"):
+            self.tracker._watch_folder(getattr(event, "dest_path", "") or event.src_path)
+        if event.is_directory or event.event_type not in WRITE_EVENTS:
+            return
+        self.tracker._mark_event(event.src_path)
+        if getattr(event, "dest_path", ""):
+            self.tracker._mark_event(event.dest_path)
@@ -0,0 +1,58 @@
+import git
+import threading
+
+from typing import ContextManager, Dict, List, Tuple
+
+
+HISTORY_PAGE_SIZE = 100
+""" Commits per page when a request doesn't ask for a size """
+FETCH_SIZE = 256
+""" Commits read from git at once when the walk reaches a commit the cache doesn't know """
+
+
+class CommitHistory:
+    """
+    Cache of the commits of a card set, walked along first parents.
+    Commits never change once written so they are kept by sha for the lifetime of the set, a new head only costs
+    the commits made since the cached ones and a page costs its own length whatever the age of the project
+    """
+    def __init__(self, repo: git.Repo, objects_lock: ContextManager | None = None):
+        self.repo: git.Repo = repo
+        self._lock = objects_lock or threading.RLock()
+        """ Walks read commits through the repo's single `git cat-file` process, shared with the card set """
+        self._commits: Dict[str, Tuple[str, str | None]] = {}
+        """ Message and first parent of every known commit, by sha """
+
+    def get_page(self, before: str, limit: int | None = None) -> List[Tuple[str, str]]:
+        """ Return up to `limit` (sha, message) pairs of the commits older than `before`, newest first """
+        page = []
+        with self._lock:
+            sha = self._get_commit(before)[1]
+            while sha is not None and (limit is None or len(page) < limit):
+                message, parent = self._get_commit(sha)
+                page.append((sha, message))
+                sha = parent
+        return page
+
+    def write_commit_graph(self):
+        """ Write git's commit-graph file, it speeds up the walks git does when the cache is extended """
+        self.repo.git.commit_graph("write", "--reachable")
+
+    def _get_commit(self, sha: str) -> Tuple[str, str | None]:
+        """ Return a commit's message and first parent, reading it and its ancestors when unknown """
+        if sha in self._commits:
+            return self._commits[sha]
+
+        try:
+            walk = self.repo.git.rev_list(sha, "--", first_parent=True, max_count=FETCH_SIZE).split()
+        except git.GitCommandError:
+            raise ValueError(f"COMMIT_HISTORY PAGE - Unknown commit '{sha}'")
+
+        for walked in walk:
+            if walked in self._commits:
+                break
+            commit = self.repo.commit(walked)
+            self._commits[walked] = (commit.message, commit.parents[0].hexsha if commit.parents else None)
+
+        # Abbreviated or symbolic revisions are resolved by the walk but never cached under their own name
+        return self._commits[walk[0]]
@@ -0,0 +1,64 @@
+import os
+import threading
+
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+
+GIT_WORKERS = 4
+""" Git mutations of different projects run side by side, the ones of a project queue on its card set's lock """
+MAX_PENDING = 32
+""" Tasks a pool accepts, running ones included, before refusing more """
+GIT_TIMEOUT = 60
+IMAGE_TIMEOUT = 120
+
+
+class PoolBusyError(RuntimeError):
+    """ Raised when a pool already holds as much work as it may queue """
+
+
+class BoundedPool:
+    """
+    Executor that refuses work past a number of pending tasks and waits for results with a timeout.
+    A task that times out is not cancelled, it still runs to completion while its caller moves on
+    """
+    def __init__(self, name: str, executor: Executor, max_pending: int = MAX_PENDING, timeout: float | None = None):
+        self.name: str = name
+        self.executor: Executor = executor
+        self.timeout: float | None = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, function: Callable, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusyError(f"EXECUTORS SUBMIT - The {self.name} pool is busy, try again later")
+        try:
+            future = self.executor.submit(function, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, function: Callable, *args, timeout: float | None = None, **kwargs) -> Any:
+        """ Run a task in the pool and wait for its result, raise TimeoutError when it takes too long """
+        return self.submit(function, *args, **kwargs).result(timeout or self.timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class Executors:
+    """
+    Pools the server offloads blocking work to, so request threads stay free for light reads.
+    Git work runs in threads, since git itself runs in subprocesses, PIL work runs in processes
+    """
+    def __init__(self, git_workers: int = GIT_WORKERS, image_workers: int | None = None,
+                 max_pending: int = MAX_PENDING):
+        self.git: BoundedPool = BoundedPool("git", ThreadPoolExecutor(git_workers, thread_name_prefix="git"),
+                                            max_pending, GIT_TIMEOUT)
+        self.images: BoundedPool = BoundedPool("images", ProcessPoolExecutor(image_workers or os.cpu_count() or 1),
+                                               max_pending, IMAGE_TIMEOUT)
+
+    def shutdown(self):
+        self.git.shutdown()
+        self.images.shutdown()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+from typing import Iterable, List, Set
+
+from flask_server.src import Path
+
+
+def write_atomically(path: Path, payload: bytes):
+    """ Write a file through a temporary sibling and rename it over the target, readers never see half a file """
+    folder, name = os.path.split(path)
+    descriptor, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def fsync_folder(path: Path):
+    """ Flush a folder's entries to disk so renames within it survive a crash, folders can't be synced on Windows """
+    if os.name == "nt":
+        return
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class FileCache:
+    """
+    Keeps a folder of derived files under a byte budget, the least recently used files are deleted first.
+    Hits touch their file, so mtimes carry the usage order over restarts
+    """
+    def __init__(self, path: Path, max_bytes: int):
+        self.path: Path = path
+        self.max_bytes: int = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        """ Size of every cached file by file name, from least to most recently used """
+        self._total_bytes: int = 0
+
+        with os.scandir(path) as folder:
+            stats = [(file.name, file.stat()) for file in folder if file.is_file() and not file.name.startswith(".")]
+        for name, stat in sorted(stats, key=lambda item: item[1].st_mtime_ns):
+            self._entries[name] = stat.st_size
+            self._total_bytes += stat.st_size
+
+    def touch(self, name: str) -> bool:
+        """ Mark a file as used, return whether it is cached """
+        with self._lock:
+            path = os.path.join(self.path, name)
+            if name not in self._entries or not os.path.exists(path):
+                return False
+            self._entries.move_to_end(name)
+            os.utime(path)
+            return True
+
+    def get_names(self, prefix: str = "") -> List[str]:
+        """ Return the cached file names that start with a prefix """
+        with self._lock:
+            return [name for name in self._entries if name.startswith(prefix)]
+
+    def remove(self, names: Iterable[str]):
+        """ Forget cached files and delete them """
+        with self._lock:
+            for name in names:
+                if name in self._entries:
+                    self._remove(name)
+
+    def add(self, names: List[str], keep: Iterable[str] = ()):
+        """
+        Record files just written to the folder, then evict older ones until the budget is met.
+        Neither these files nor the ones in `keep` are evicted, so a caller never loses files it is about to serve
+        """
+        with self._lock:
+            for name in names:
+                self._total_bytes -= self._entries.pop(name, 0)
+                self._entries[name] = os.path.getsize(os.path.join(self.path, name))
+                self._total_bytes += self._entries[name]
+            self._evict(set(names).union(keep))
+
+    def _evict(self, keep: Set[str]):
+        """ Delete the least recently used files, never the ones in `keep`, the lock must be held """
+        for name in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if name in keep:
+                continue
+            self._remove(name)
+
+    def _remove(self, name: str):
+        """ Forget a cached file and delete it, the lock must be held """
+        self._total_bytes -= self._entries.pop(name)
+        path = os.path.join(self.path, name)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+from flask_server.src import Json, Path, Uuid
+
+
+CATALOG_FILE_NAME = "catalog.sqlite3"
+SCHEMA_VERSION = 2
+COLUMNS = "uuid, file_name, data, size, mtime_ns, width, height, digest"
+
+
+@dataclass
+class CatalogEntry:
+    """ One row of the image catalog, it mirrors what is stored in the image file plus its stat info """
+    uuid: Uuid
+    file_name: str = ""
+    data: Json = "{}"
+    size: int = 0
+    mtime_ns: int = 0
+    width: int = 0
+    height: int = 0
+    digest: str = ""
+    """ Content hash of the file the image was imported from, used to detect re-imports """
+
+
+class ImageCatalog:
+    """
+    Persistent SQLite index of the image bank, keyed by image uuid.
+    It allows the bank to be listed without opening every image file, the bank is in charge
+    of keeping it up to date and of reconciling it against the folder contents
+    """
+    def __init__(self, folder: Path):
+        self.path: Path = Path(os.path.join(folder, CATALOG_FILE_NAME))
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._build_schema()
+
+    def _build_schema(self):
+        """ Create or migrate the catalog tables, an unknown catalog is dropped since it can be rebuilt """
+        version, = self._connection.execute("PRAGMA user_version").fetchone()
+        if version == SCHEMA_VERSION:
+            return
+
+        with self._lock:
+            if version == 1:
+                self._connection.execute("ALTER TABLE images ADD COLUMN digest TEXT NOT NULL DEFAULT ''")
+            else:
+                self._connection.execute("DROP TABLE IF EXISTS images")
+                self._connection.execute(
+                    "CREATE TABLE images ("
+                    "uuid TEXT PRIMARY KEY, "
+                    "file_name TEXT NOT NULL, "
+                    "data TEXT NOT NULL, "
+                    "size INTEGER NOT NULL, "
+                    "mtime_ns INTEGER NOT NULL, "
+                    "width INTEGER NOT NULL, "
+                    "height INTEGER NOT NULL, "
+                    "digest TEXT NOT NULL DEFAULT '')")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS images_digest ON images (digest) WHERE digest != ''")
+            self._connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, image_uuid: Uuid) -> CatalogEntry | None:
+        """ Return the catalog entry of an image, or None if it is not cataloged """
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {COLUMNS} FROM images WHERE uuid = ?", (str(image_uuid),)).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def find_digest(self, digest: str) -> CatalogEntry | None:
+        """ Return the entry of an image imported from content with this hash, or None """
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {COLUMNS} FROM images WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def list(self) -> List[CatalogEntry]:
+        """ Return every cataloged image in a single read """
+        with self._lock:
+            rows = self._connection.execute(f"SELECT {COLUMNS} FROM images").fetchall()
+        return [CatalogEntry(*row) for row in rows]
+
+    def get_stats(self) -> Dict[Uuid, Tuple[int, int]]:
+        """ Return the (size, mtime_ns) pair of every cataloged image, used to detect stale entries """
+        with self._lock:
+            rows = self._connection.execute("SELECT uuid, size, mtime_ns FROM images").fetchall()
+        return {Uuid(uuid): (size, mtime_ns) for uuid, size, mtime_ns in rows}
+
+    def upsert(self, entries: Iterable[CatalogEntry]):
+        """ Insert or replace many entries within one transaction """
+        rows = [(str(e.uuid), e.file_name, e.data, e.size, e.mtime_ns, e.width, e.height, e.digest) for e in entries]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO images ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+
+    def delete(self, image_uuids: Iterable[Uuid]):
+        """ Remove many entries within one transaction """
+        rows = [(str(image_uuid),) for image_uuid in image_uuids]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("DELETE FROM images WHERE uuid = ?", rows)
+            self._connection.execute("COMMIT")
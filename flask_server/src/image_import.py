@@ -0,0 +1,257 @@
+import fnmatch
+import glob
+import os
+import time
+import zipfile
+
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field, replace
+from functools import partial
+from typing import BinaryIO, Callable, Dict, Iterator, List, Set, Tuple
+from uuid import uuid4 as generate_uuid
+
+from flask_server.src import Path, Uuid
+from flask_server.src.executors import BoundedPool, PoolBusyError
+from flask_server.src.image_catalog import CatalogEntry
+from flask_server.src.images import ImageBank, ImageData, IMAGE_EXTENSION, hash_image, ingest_image
+
+
+IMPORTABLE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+CHUNK_SIZE = 32
+""" Number of images handled by a worker per task, zip archives are opened once per chunk """
+CATALOG_FLUSH_SIZE = 256
+
+
+@dataclass(frozen=True)
+class ImportSource:
+    """ A single image to import, either a file on disk or a member of a zip archive """
+    path: Path
+    member: str = ""
+    digest: str = ""
+    """ Content hash of the image, when the import already computed it """
+
+    @property
+    def name(self) -> str:
+        """ The image name used when it is imported, its file name without extension """
+        name, _ = os.path.splitext(os.path.basename(self.member or self.path))
+        return name
+
+    def __str__(self):
+        return f"{self.path}:{self.member}" if self.member else self.path
+
+
+@dataclass
+class ImportResult:
+    """ Outcome of importing one image """
+    source: str
+    uuid: Uuid | None = None
+    image_data: ImageData | None = None
+    duplicate: bool = False
+    """ The image content was already in the bank, `uuid` points to the existing image """
+    error: str = ""
+
+
+@dataclass
+class ImportReport:
+    """ Outcome of a bulk import, with per image results and throughput numbers """
+    results: List[ImportResult] = field(default_factory=list)
+    imported: int = 0
+    failed: int = 0
+    duplicates: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    images_per_second: float = 0.0
+    bytes_per_second: float = 0.0
+
+
+ProgressCallback = Callable[[int, int, ImportResult], None]
+
+
+def collect_sources(source: Path, pattern: str = "") -> List[ImportSource]:
+    """
+    List the images found in a directory, a zip archive or a glob expression.
+    `pattern` filters file names, when it is empty only files with an image extension are picked
+    """
+    def accepts(name: str) -> bool:
+        if pattern:
+            return fnmatch.fnmatch(os.path.basename(name), pattern)
+        return os.path.splitext(name)[1].lower() in IMPORTABLE_EXTENSIONS
+
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(glob.escape(source), "**", "*"), recursive=True)
+        return [ImportSource(Path(path)) for path in sorted(paths) if os.path.isfile(path) and accepts(path)]
+
+    if os.path.isfile(source) and zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            members = [info.filename for info in archive.infolist() if not info.is_dir()]
+        return [ImportSource(source, member) for member in sorted(members) if accepts(member)]
+
+    if os.path.isfile(source):
+        return [ImportSource(source)]
+
+    paths = glob.glob(source, recursive=True)
+    return [ImportSource(Path(path)) for path in sorted(paths) if os.path.isfile(path) and accepts(path)]
+
+
+class ImageImporter:
+    """
+    Imports many images into an image bank at once, spreading chunks of images over the server's image pool.
+    A full pool refuses the import with PoolBusyError and a chunk that takes longer than the pool's timeout stops
+    it with TimeoutError, so bulk imports are held to the same limits as the other image work
+    """
+    def __init__(self, image_bank: ImageBank, workers: int | None = None, pool: BoundedPool | None = None):
+        self.image_bank: ImageBank = image_bank
+        self.workers: int = workers or os.cpu_count() or 1
+        """ Chunks handed to the pool at once, so an import leaves room in the pool for other requests """
+        self.pool: BoundedPool | None = pool
+        """ Process pool chunks are imported in, they are imported in the calling thread without one """
+
+    def import_images(self, source: Path, pattern: str = "", on_progress: ProgressCallback | None = None,
+                      deduplicate=False) -> ImportReport:
+        """
+        Import every image found in `source`, failures are reported per image and never stop the import.
+        When deduplicating, images are hashed first and only content that is not in the bank yet is copied
+        """
+        sources = collect_sources(source, pattern)
+        report = ImportReport()
+        pending_entries: List[CatalogEntry] = []
+        started = time.perf_counter()
+
+        def record(result: ImportResult, entry: CatalogEntry | None = None):
+            report.results.append(result)
+            if result.error:
+                report.failed += 1
+            elif result.duplicate:
+                report.duplicates += 1
+            else:
+                report.imported += 1
+                report.bytes += entry.size
+                pending_entries.append(entry)
+
+            if on_progress:
+                on_progress(len(report.results), len(sources), result)
+
+            if len(pending_entries) >= CATALOG_FLUSH_SIZE:
+                self.image_bank.catalog.upsert(pending_entries)
+                pending_entries.clear()
+
+        to_import = sources
+        batch_duplicates: Dict[str, List[ImportSource]] = {}
+        """ Images sharing their content with another image of this import, by content hash """
+
+        try:
+            if deduplicate:
+                to_import = []
+                for chunk_results in self._map_chunks(_hash_chunk, sources):
+                    for image_source, digest, error in chunk_results:
+                        if error:
+                            record(ImportResult(str(image_source), error=error))
+                        elif duplicate := self.image_bank.find_duplicate(digest):
+                            image_uuid, image_data = duplicate
+                            record(ImportResult(str(image_source), Uuid(str(image_uuid)), image_data, True))
+                        elif digest in batch_duplicates:
+                            batch_duplicates[digest].append(image_source)
+                        else:
+                            batch_duplicates[digest] = []
+                            to_import.append(replace(image_source, digest=digest))
+
+            for chunk_results in self._map_chunks(partial(_import_chunk, self.image_bank.path), to_import):
+                for result, entry in chunk_results:
+                    record(result, entry)
+                    for image_source in batch_duplicates.pop(entry.digest if entry else "", []):
+                        record(ImportResult(str(image_source), result.uuid, result.image_data, True))
+
+            # Whatever is left is a copy of an image that failed to import
+            for image_sources in batch_duplicates.values():
+                for image_source in image_sources:
+                    record(ImportResult(str(image_source), error="Duplicate of an image that failed to import"))
+        finally:
+            # Images already copied are cataloged even when the pool stopped the import
+            self.image_bank.catalog.upsert(pending_entries)
+
+        report.seconds = time.perf_counter() - started
+        if report.seconds > 0:
+            report.images_per_second = report.imported / report.seconds
+            report.bytes_per_second = report.bytes / report.seconds
+        return report
+
+    def _map_chunks(self, worker: Callable[[List[ImportSource]], list],
+                    sources: List[ImportSource]) -> Iterator[list]:
+        """
+        Run a worker over chunks of sources, yielding results as they complete. At most `workers` chunks are
+        in the pool at once, when it is full the next chunk waits for one of ours to finish
+        """
+        chunks = [sources[i:i + CHUNK_SIZE] for i in range(0, len(sources), CHUNK_SIZE)]
+        if not self.pool:
+            for chunk in chunks:
+                yield worker(chunk)
+            return
+
+        chunks.reverse()
+        running: Set[Future] = set()
+        while chunks or running:
+            while chunks and len(running) < self.workers:
+                try:
+                    running.add(self.pool.submit(worker, chunks[-1]))
+                except PoolBusyError:
+                    if not running:
+                        raise
+                    break
+                chunks.pop()
+
+            done, running = wait(running, self.pool.timeout, FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"IMAGE_IMPORT CHUNK - No chunk finished within {self.pool.timeout}s")
+            for future in done:
+                yield future.result()
+
+
+def _open_source(source: ImportSource, archives: Dict[Path, zipfile.ZipFile]) -> BinaryIO:
+    """ Open an import source for reading, zip archives are opened once and kept in `archives` """
+    if not source.member:
+        return open(source.path, "rb")
+
+    if source.path not in archives:
+        archives[source.path] = zipfile.ZipFile(source.path)
+    return archives[source.path].open(source.member)
+
+
+def _hash_chunk(chunk: List[ImportSource]) -> List[Tuple[ImportSource, str, str]]:
+    """ Worker entry point, hash a chunk of images returning a (source, digest, error) tuple per image """
+    results = []
+    archives = {}
+    try:
+        for source in chunk:
+            try:
+                with _open_source(source, archives) as file:
+                    results.append((source, hash_image(file), ""))
+            except Exception as e:
+                results.append((source, "", f"{type(e).__name__}: {str(e)}"))
+    finally:
+        for archive in archives.values():
+            archive.close()
+
+    return results
+
+
+def _import_chunk(bank_path: Path, chunk: List[ImportSource]) -> List[Tuple[ImportResult, CatalogEntry | None]]:
+    """ Worker entry point, import a chunk of images into the bank folder without touching the catalog """
+    results = []
+    archives = {}
+    try:
+        for source in chunk:
+            image_uuid = generate_uuid()
+            image_data = ImageData(file_name=source.name)
+            destination = Path(os.path.join(bank_path, f"{image_uuid}{IMAGE_EXTENSION}"))
+            try:
+                with _open_source(source, archives) as file:
+                    entry = ingest_image(file, destination, image_data, source.digest)
+                results.append((ImportResult(str(source), Uuid(str(image_uuid)), image_data), entry))
+
+            except Exception as e:
+                results.append((ImportResult(str(source), error=f"{type(e).__name__}: {str(e)}"), None))
+    finally:
+        for archive in archives.values():
+            archive.close()
+
+    return results
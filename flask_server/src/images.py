@@ -1,10 +1,11 @@
+import hashlib
+import io
 import os
-import shutil
 
-from typing import Dict
+from typing import BinaryIO, Dict, Tuple
 from dataclasses import dataclass
 
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import piexif
 
 from uuid import uuid4 as generate_uuid
@@ -12,6 +13,10 @@ from uuid import UUID
 from . import (Path)
 
 from flask_server.src import Json, Uuid
+from flask_server.src.executors import BoundedPool
+from flask_server.src.image_catalog import ImageCatalog, CatalogEntry
+from flask_server.src.files import write_atomically
+from flask_server.src.metrics import metrics, KIND_IMAGE
 
 
 NAME_IMAGE_TAG = "ImageName"
@@ -19,6 +24,9 @@ EXIF_TAG_ORIGINAL_RAW_FILE_NAME = 0xc68b
 META_0TH = "0th"
 META_EXIF = "Exif"
 META_GPS = "GPS"
+IMAGE_EXTENSION = ".jpg"
+JPEG_MAGIC = b"\xff\xd8"
+HASH_CHUNK_SIZE = 1024 * 1024
 
 
 @dataclass
@@ -34,60 +42,107 @@ class ImageBank:
     Images can be added to the bank and other functionalities of this tool will use
     these images to build the cards panels
     """
-    def __init__(self, image_bank_path: Path):
+    def __init__(self, image_bank_path: Path, pool: BoundedPool | None = None):
         self.path: Path = image_bank_path
+        self.pool: BoundedPool | None = pool
+        """ Process pool imported images are converted and written in, without one they are handled in the caller """
 
         if not os.path.exists(image_bank_path):
             raise FileNotFoundError("IMAGE_BANK SETUP - Missing image bank folder")
 
-    def compile_image_list(self) -> Dict[Uuid, ImageData]:
-        """ Look for all the images stored in `self.path`, and compile the `self.images` dictionary """
-        images = {}
+        self.catalog: ImageCatalog = ImageCatalog(image_bank_path)
+        """ Persistent index of the bank, it is what listings are served from """
 
-        for file_name in os.listdir(self.path):
-            name, extension = os.path.splitext(file_name)
+        self.reconcile()
 
-            if not os.path.isfile(file_name) or extension.lower() != ".jpg":
-                continue
+    @metrics.instrument(KIND_IMAGE)
+    def reconcile(self):
+        """ Repair the catalog from the folder, only images whose size or mtime changed are reopened """
+        cataloged = self.catalog.get_stats()
+        found = set()
+        stale = []
 
-            try:
-                image_uuid: UUID = UUID(name)
-                image = self.read_image_metadata(image_uuid)
-                images[Uuid(str(image_uuid))] = image
+        with os.scandir(self.path) as folder:
+            for file in folder:
+                name, extension = os.path.splitext(file.name)
+
+                if not file.is_file() or extension.lower() != IMAGE_EXTENSION:
+                    continue
+
+                try:
+                    image_uuid = Uuid(str(UUID(name)))
+                except ValueError:
+                    print(f"IMAGE_BANK SETUP - {name}'s file name is not a valid UUID.")
+                    continue
 
-            except ValueError:
-                print(f"IMAGE_BANK SETUP - {name}'s file name is not a valid UUID.")
-                continue
+                found.add(image_uuid)
+                stat = file.stat()
+                if cataloged.get(image_uuid) != (stat.st_size, stat.st_mtime_ns):
+                    stale.append(image_uuid)
 
-        return images
+        entries = []
+        for image_uuid in stale:
+            try:
+                previous = self.catalog.get(image_uuid)
+                image_data = self._read_file_metadata(image_uuid)
+                image_data.data = previous.data if previous else image_data.data
+                # The file changed outside the bank, the digest of what was imported no longer describes it
+                entries.append(self._build_catalog_entry(image_uuid, image_data, keep_digest=False))
+            except (OSError, UnidentifiedImageError) as e:
+                print(f"IMAGE_BANK SETUP - Could not catalog image {image_uuid}: {str(e)}")
+
+        self.catalog.upsert(entries)
+        self.catalog.delete(set(cataloged) - found)
+
+    @metrics.instrument(KIND_IMAGE)
+    def compile_image_list(self) -> Dict[Uuid, ImageData]:
+        """ List all the images stored in `self.path`, straight from the catalog """
+        return {entry.uuid: ImageData(entry.file_name, entry.data) for entry in self.catalog.list()}
 
     def get_image_path(self, image_uuid: UUID) -> Path:
         """ Return the absolute path of an image within the `self.path` folder """
-        return Path(os.path.join(self.path, f"{str(image_uuid)}.jpg"))
-
+        return Path(os.path.join(self.path, f"{str(image_uuid)}{IMAGE_EXTENSION}"))
+
+    def get_content_key(self, image_uuid: UUID) -> str | None:
+        """
+        Return a key that changes whenever the pixels of an image do, None when the image is missing.
+        It is the hash of the imported content, or the file stat for images cataloged without one
+        """
+        entry = self.catalog.get(Uuid(str(image_uuid)))
+        if entry is None or not os.path.exists(self.get_image_path(image_uuid)):
+            return None
+        return entry.digest or f"{entry.size}-{entry.mtime_ns}"
+
+    @metrics.instrument(KIND_IMAGE)
     def write_image_metadata(self, image_uuid: UUID, image_data: ImageData):
-        """ Write ImageData information to an image metadata stubs """
-        exif_dict = {META_0TH: {}, META_EXIF: {}, META_GPS: {}}
-
+        """
+        Write ImageData information to an image metadata stubs.
+        Only the EXIF segment is replaced, the pixel data is never decoded so renames don't degrade the image
+        """
         path = self.get_image_path(image_uuid)
-        image = Image.open(path)
+        with open(path, "rb") as file:
+            image_bytes = file.read()
 
-        exif_dict[META_0TH][EXIF_TAG_ORIGINAL_RAW_FILE_NAME] = image_data.file_name.encode('utf-8')
-
-        exif_bytes = piexif.dump(exif_dict)
+        write_atomically(path, _stamp_image(image_bytes, image_data))
 
-        image.save(path, exif=exif_bytes)
-        image.close()
+        self.catalog.upsert([self._build_catalog_entry(image_uuid, image_data)])
 
     def read_image_metadata(self, image_uuid: UUID) -> ImageData:
+        """ Read the image metadata, from the catalog when possible or else from the image stubs """
+        entry = self.catalog.get(Uuid(str(image_uuid)))
+        if entry:
+            return ImageData(entry.file_name, entry.data)
+        return self._read_file_metadata(image_uuid)
+
+    @metrics.instrument(KIND_IMAGE)
+    def _read_file_metadata(self, image_uuid: UUID) -> ImageData:
         """ Read the image metadata stubs to form an Image data blob """
         image_data = ImageData()
 
         path = self.get_image_path(image_uuid)
-        image = Image.open(path)
-
-        # noinspection PyProtectedMember
-        exif_data = image.getexif()
+        with Image.open(path) as image:
+            # noinspection PyProtectedMember
+            exif_data = image.getexif()
 
         if not exif_data:
             return image_data
@@ -96,41 +151,169 @@ class ImageBank:
             image_data.file_name = exif_data[EXIF_TAG_ORIGINAL_RAW_FILE_NAME]
             image_data.file_name = image_data.file_name.decode("UTF-8")
 
-        image.close()
-
         return image_data
 
+    @metrics.instrument(KIND_IMAGE)
+    def _build_catalog_entry(self, image_uuid: UUID, image_data: ImageData, keep_digest=True) -> CatalogEntry:
+        """
+        Describe an image file as a catalog entry, only the image header is read.
+        The digest describes the imported content and is kept through the bank's own metadata edits,
+        without it the content key falls back to the file stat
+        """
+        path = self.get_image_path(image_uuid)
+        stat = os.stat(path)
+        with Image.open(path) as image:
+            width, height = image.size
+
+        previous = self.catalog.get(Uuid(str(image_uuid))) if keep_digest else None
+        digest = previous.digest if previous else ""
+
+        return CatalogEntry(Uuid(str(image_uuid)), image_data.file_name, image_data.data,
+                            stat.st_size, stat.st_mtime_ns, width, height, digest)
+
+    @metrics.instrument(KIND_IMAGE)
     def delete_image(self, image_uuid: UUID) -> None:
         if not os.path.exists(self.get_image_path(image_uuid)):
             raise FileNotFoundError("Missing Image")
         os.remove(self.get_image_path(image_uuid))
+        self.catalog.delete([Uuid(str(image_uuid))])
+
+    def find_duplicate(self, digest: str) -> Tuple[UUID, ImageData] | None:
+        """ Return the uuid and image data blob of an image imported from content with this hash """
+        entry = self.catalog.find_digest(digest)
+        if not entry:
+            return None
+        return UUID(entry.uuid), ImageData(entry.file_name, entry.data)
+
+    @metrics.instrument(KIND_IMAGE)
+    def import_image(self, image_path: Path, image_name="", deduplicate=False) -> (UUID, ImageData):
+        """
+        Import an image from a remote location into the bank.
+        When deduplicating, an image whose content is already in the bank is not copied again,
+        the existing image's uuid and data blob are returned instead
+        """
+        digest = ""
+        if deduplicate:
+            with open(image_path, "rb") as source:
+                digest = hash_image(source)
+            duplicate = self.find_duplicate(digest)
+            if duplicate:
+                return duplicate
+
+        # Make UUID for image
+        image_uuid = generate_uuid()
+
+        # Extract Image name from image
+        if not image_name:
+            image_name, _ = os.path.splitext(os.path.basename(image_path))
+
+        # Build image data blob
+        image_data = ImageData(file_name=image_name)
+
+        # Copy image file to the bank with its metadata already stamped
+        if self.pool:
+            entry = self.pool.run(ingest_image_file, image_path, self.get_image_path(image_uuid), image_data, digest)
+        else:
+            entry = ingest_image_file(image_path, self.get_image_path(image_uuid), image_data, digest)
+
+        # Append this image to the bank catalog
+        self.catalog.upsert([entry])
+
+        # return the uuid and image data blob of this new image
+        return image_uuid, image_data
+
+
+def ingest_image_file(image_path: Path, destination: Path, image_data: ImageData, digest: str = "") -> CatalogEntry:
+    """ Same as `ingest_image`, from a file path so it can be sent to a process pool """
+    with open(image_path, "rb") as source:
+        return ingest_image(source, destination, image_data, digest)
+
+
+def ingest_image(source: BinaryIO, destination: Path, image_data: ImageData, digest: str = "") -> CatalogEntry:
+    """
+    Validate an image, stamp its metadata and write it into the bank in a single pass.
+    This touches no bank state so it can run in worker processes, the returned entry still has to be cataloged.
+    `digest` is the `hash_image` of the source when the caller already has it, else it is computed here
+    """
+    image_bytes = source.read()
+    digest = digest or hashlib.blake2b(image_bytes).hexdigest()
+
+    # Validate the image while reading its dimensions, images that are not JPEGs are converted once
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        width, height = image.size
+        if not image_bytes.startswith(JPEG_MAGIC):
+            converted = io.BytesIO()
+            image.convert("RGB").save(converted, "JPEG")
+            image_bytes = converted.getvalue()
 
-    def import_image(self, image_path: Path, image_name = "") -> (UUID, ImageData):
-        """ Import an image from a remote location into the bank """
-        try:
-            # Make UUID for image
-            image_uuid = generate_uuid()
+    write_atomically(destination, _stamp_image(image_bytes, image_data))
 
-            # Get image new path
-            new_image_path = self.get_image_path(image_uuid)
+    image_uuid, _ = os.path.splitext(os.path.basename(destination))
+    stat = os.stat(destination)
+    return CatalogEntry(Uuid(image_uuid), image_data.file_name, image_data.data,
+                        stat.st_size, stat.st_mtime_ns, width, height, digest)
 
-            # Extract Image name from image
-            if not image_name:
-                image_name, _ = os.path.splitext(os.path.basename(image_path))
 
-            # Build image data blob
-            image_data = ImageData(file_name=image_name)
+def hash_image(source: BinaryIO) -> str:
+    """ Hash an image file in fixed size chunks, it is the content key used to detect re-imports """
+    digest = hashlib.blake2b()
+    while chunk := source.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
 
-            # Copy image file to the bank
-            shutil.copy(image_path, new_image_path)
 
-            # Write copied image's metadata
-            self.write_image_metadata(image_uuid, image_data)
+def _stamp_image(image_bytes: bytes, image_data: ImageData) -> bytes:
+    """ Splice the ImageData into the EXIF segment of JPEG bytes """
+    exif_bytes = _dump_exif(_load_exif(image_bytes), image_data)
+    output = io.BytesIO()
+    piexif.insert(exif_bytes, image_bytes, output)
+    return output.getvalue()
 
-            # Append this image to the bank index
-            # self.images[image_uuid] = image_data
 
-            # return the uuid and image data blob of this new image
-            return image_uuid, image_data
-        except Exception as e:
-            print(f"IMAGE_BANK IMPORT - Error importing image: {str(e)}")
+def _empty_exif() -> dict:
+    return {META_0TH: {}, META_EXIF: {}, META_GPS: {}}
+
+
+def _load_exif(image_bytes: bytes) -> dict:
+    """
+    Parse the EXIF segment of a JPEG, an empty stub is returned when it is missing or unreadable.
+    The embedded thumbnail and its "1st" IFD are dropped, so stamped images lose them
+    """
+    try:
+        exif_dict = piexif.load(image_bytes)
+    except Exception:
+        return _empty_exif()
+
+    # Embedded thumbnails are not used by the bank and are a common source of dump errors
+    exif_dict.pop("thumbnail", None)
+    exif_dict.pop("1st", None)
+    return exif_dict
+
+
+def _dump_exif(exif_dict: dict, image_data: ImageData) -> bytes:
+    """
+    Stamp the ImageData into an EXIF dictionary. When it can't be re-encoded, every tag is tried on its own
+    and only the tags that fail are dropped, the stamp is kept whatever happens to the others
+    """
+    exif_dict[META_0TH][EXIF_TAG_ORIGINAL_RAW_FILE_NAME] = image_data.file_name.encode('utf-8')
+    try:
+        return piexif.dump(exif_dict)
+    except Exception:
+        pass
+
+    for ifd, tags in exif_dict.items():
+        if not isinstance(tags, dict):
+            continue
+        for tag, value in list(tags.items()):
+            try:
+                # Inside a full stub, the Interop IFD is only written through the Exif one
+                piexif.dump({**_empty_exif(), ifd: {tag: value}})
+            except Exception:
+                print(f"IMAGE_BANK EXIF - Dropped tag {tag} of the {ifd} IFD, it can't be encoded")
+                del tags[tag]
+    try:
+        return piexif.dump(exif_dict)
+    except Exception:
+        exif_dict = _empty_exif()
+        exif_dict[META_0TH][EXIF_TAG_ORIGINAL_RAW_FILE_NAME] = image_data.file_name.encode('utf-8')
+        return piexif.dump(exif_dict)
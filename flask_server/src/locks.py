@@ -0,0 +1,52 @@
+import threading
+
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class ReadWriteLock:
+    """
+    Lock shared by many readers or held by a single writer, it is not reentrant.
+    Waiting writers hold new readers back, so a steady stream of reads can't starve them
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers: int = 0
+        self._writing: bool = False
+        self._waiting_writers: int = 0
+
+    @property
+    def is_held(self) -> bool:
+        with self._condition:
+            return self._readers > 0 or self._writing or self._waiting_writers > 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
@@ -1,9 +1,16 @@
 import os
 import shutil
 
+from flask_server.src.card_render import CardRenderer
 from flask_server.src.card_set import CardSet
+from flask_server.src.card_sheets import SheetBuilder
+from flask_server.src.executors import Executors
 from flask_server.src.images import ImageBank
+from flask_server.src.image_import import ImageImporter
+from flask_server.src.thumbnails import ThumbnailCache
 from flask_server.src.registry import Registry
+from flask_server.src.save_queue import SaveQueue
+from flask_server.src.sessions import SessionPool
 from flask_server.src.card_editor import CardEditor
 from flask_server.src import Path, Project
 
@@ -17,10 +24,21 @@ class Manager:
         self.app_folder: Path = Path(os.path.join(src_folder, "app"))
         self.images_folder: Path = Path(os.path.join(self.app_folder, "images"))
         self.sets_folder: Path = Path(os.path.join(self.app_folder, "card_sets"))
+        self.thumbnails_folder: Path = Path(os.path.join(self.app_folder, "thumbnails"))
+        self.templates_folder: Path = Path(os.path.join(self.app_folder, "templates"))
+        self.renders_folder: Path = Path(os.path.join(self.app_folder, "renders"))
+        self.sheets_folder: Path = Path(os.path.join(self.app_folder, "sheets"))
 
         # Declare Key objects variables
+        self.executors: Executors | None = None
         self.image_bank: ImageBank | None = None
+        self.image_importer: ImageImporter | None = None
+        self.thumbnails: ThumbnailCache | None = None
+        self.renderer: CardRenderer | None = None
+        self.sheets: SheetBuilder | None = None
         self.registry: Registry | None = None
+        self.sessions: SessionPool | None = None
+        self.saves: SaveQueue | None = None
         self.editor: CardEditor | None = None
 
         # Forward useful references
@@ -28,8 +46,14 @@ class Manager:
         self.project: CardSet | None = None
 
     def load_project(self, project: Project):
+        """
+        Make a project the default one, for requests that don't name theirs.
+        The registry keeps the previous one open for a quick switch back
+        """
+        session = self.sessions.get_session(project)
         self.project_name = project
-        self.project = self.registry.get_project(project)
+        self.project = session.card_set
+        self.editor = session.editor
 
     def initialize(self):
         """ Build the app's folders if they don't exist """
@@ -42,8 +66,28 @@ class Manager:
         if not os.path.exists(self.sets_folder):
             os.mkdir(self.sets_folder)
 
-        self.image_bank = ImageBank(self.images_folder)
+        if not os.path.exists(self.thumbnails_folder):
+            os.mkdir(self.thumbnails_folder)
+
+        if not os.path.exists(self.templates_folder):
+            os.mkdir(self.templates_folder)
+
+        if not os.path.exists(self.renders_folder):
+            os.mkdir(self.renders_folder)
+
+        if not os.path.exists(self.sheets_folder):
+            os.mkdir(self.sheets_folder)
+
+        self.executors = Executors()
+        self.image_bank = ImageBank(self.images_folder, self.executors.images)
+        self.image_importer = ImageImporter(self.image_bank, pool=self.executors.images)
+        self.thumbnails = ThumbnailCache(self.image_bank, self.thumbnails_folder, pool=self.executors.images)
+        self.renderer = CardRenderer(self.image_bank, self.templates_folder, self.renders_folder,
+                                     pool=self.executors.images)
+        self.sheets = SheetBuilder(self.sheets_folder, pool=self.executors.images)
         self.registry = Registry(self.sets_folder)
+        self.sessions = SessionPool(self.registry)
+        self.saves = SaveQueue(self.sessions, self.executors.git)
         self.editor = CardEditor()
 
     def uninstall(self):
@@ -0,0 +1,226 @@
+import bisect
+import cProfile
+import functools
+import inspect
+import io
+import pstats
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Tuple
+from uuid import uuid4 as generate_uuid
+
+import git
+
+
+KIND_ROUTE = "route"
+KIND_GIT = "git"
+KIND_IMAGE = "image"
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+""" Upper bounds of the timing histograms, in seconds """
+SLOW_SECONDS = 1.0
+MAX_ARGUMENT_LENGTH = 200
+""" Characters of each argument written to the slow log """
+KEPT_PROFILES = 20
+PROFILE_LINES = 40
+METRIC_PREFIX = "card_designer_operation"
+_UNCHANGED = object()
+
+
+@dataclass
+class _Series:
+    """ Timings of one operation, `buckets` counts the observations under each bound, not cumulated """
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_BUCKETS) + 1))
+    count: int = 0
+    seconds: float = 0.0
+    errors: int = 0
+
+
+class Metrics:
+    """
+    Timing histograms and error counters of the server's hot paths: routes, git calls and image I/O.
+    Operations slower than `slow_seconds` are logged with their arguments. While disabled, instrumented code
+    only checks the flag, so the layer stays in place in production at no cost
+    """
+    def __init__(self, enabled=False, slow_seconds: float | None = SLOW_SECONDS, profiling=False):
+        self.enabled: bool = False
+        self.slow_seconds: float | None = slow_seconds
+        """ Operations at least this slow are logged, None turns the slow log off """
+        self.profiling: bool = profiling
+        """ Whether requests may ask to be profiled, see `routes.PROFILE_HEADER` """
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._profiles: OrderedDict[str, str] = OrderedDict()
+        self.configure(enabled=enabled)
+
+    def configure(self, enabled: bool | None = None, slow_seconds=_UNCHANGED, profiling: bool | None = None):
+        """ Change the settings that are given """
+        if enabled:
+            _install_git_hook()
+        if enabled is not None:
+            self.enabled = enabled
+        if slow_seconds is not _UNCHANGED:
+            self.slow_seconds = slow_seconds
+        if profiling is not None:
+            self.profiling = profiling
+
+    def observe(self, kind: str, name: str, seconds: float, error=False, describe: Callable[[], str] | None = None):
+        """ Record an operation, `describe` gives its arguments and is only called when the slow log needs them """
+        with self._lock:
+            series = self._series.get((kind, name))
+            if series is None:
+                series = self._series[(kind, name)] = _Series()
+            series.buckets[bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+            series.count += 1
+            series.seconds += seconds
+            series.errors += error
+
+        if self.slow_seconds is not None and seconds >= self.slow_seconds:
+            print(f"METRICS SLOW - {kind} {name} took {seconds:.3f}s{' and failed' if error else ''}"
+                  f"{f' ({describe()})' if describe else ''}")
+
+    @contextmanager
+    def timed(self, kind: str, name: str, describe: Callable[[], str] | None = None) -> Iterator[None]:
+        """ Time a block of code as an operation """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(kind, name, time.perf_counter() - started, error, describe)
+
+    def instrument(self, kind: str, name: str | None = None) -> Callable[[Callable], Callable]:
+        """ Decorate a function so every call is timed, it is named after its qualified name by default """
+        def decorator(function: Callable) -> Callable:
+            label = name or function.__qualname__
+            parameters = list(inspect.signature(function).parameters)
+            skip = 1 if parameters[:1] in (["self"], ["cls"]) else 0
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                error = False
+                try:
+                    return function(*args, **kwargs)
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    self.observe(kind, label, time.perf_counter() - started, error,
+                                 lambda: describe_arguments(args[skip:], kwargs))
+            return wrapper
+        return decorator
+
+    def save_profile(self, profiler: cProfile.Profile, title: str) -> str:
+        """ Keep the report of a profiled request and return its id, only the latest reports are kept """
+        output = io.StringIO()
+        output.write(f"{title}\n\n")
+        pstats.Stats(profiler, stream=output).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_LINES)
+        profile_id = generate_uuid().hex
+        with self._lock:
+            self._profiles[profile_id] = output.getvalue()
+            while len(self._profiles) > KEPT_PROFILES:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def get_profile(self, profile_id: str) -> str:
+        with self._lock:
+            if profile_id not in self._profiles:
+                raise KeyError(f"METRICS PROFILE - Unknown profile '{profile_id}'")
+            return self._profiles[profile_id]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._profiles.clear()
+
+    def render_prometheus(self) -> str:
+        """ Write every series in the Prometheus text exposition format """
+        with self._lock:
+            series = sorted((key, _Series(list(value.buckets), value.count, value.seconds, value.errors))
+                            for key, value in self._series.items())
+
+        lines = [f"# HELP {METRIC_PREFIX}_seconds Time spent in instrumented operations",
+                 f"# TYPE {METRIC_PREFIX}_seconds histogram"]
+        for (kind, name), value in series:
+            labels = f'kind="{_escape(kind)}",name="{_escape(name)}"'
+            cumulated = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS + (float("inf"),), value.buckets):
+                cumulated += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{METRIC_PREFIX}_seconds_bucket{{{labels},le="{le}"}} {cumulated}')
+            lines.append(f"{METRIC_PREFIX}_seconds_sum{{{labels}}} {value.seconds!r}")
+            lines.append(f"{METRIC_PREFIX}_seconds_count{{{labels}}} {value.count}")
+
+        lines += [f"# HELP {METRIC_PREFIX}_errors_total Instrumented operations that raised or failed",
+                  f"# TYPE {METRIC_PREFIX}_errors_total counter"]
+        for (kind, name), value in series:
+            lines.append(f'{METRIC_PREFIX}_errors_total{{kind="{_escape(kind)}",name="{_escape(name)}"}} '
+                         f'{value.errors}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+""" The server's metrics, instrumented modules record into it """
+
+
+def describe_arguments(args: tuple, kwargs: dict) -> str:
+    """ Write call arguments for the slow log, long ones are cut """
+    parts = [repr(argument) for argument in args] + [f"{key}={value!r}" for key, value in kwargs.items()]
+    return ", ".join(part if len(part) <= MAX_ARGUMENT_LENGTH else part[:MAX_ARGUMENT_LENGTH] + "..."
+                     for part in parts)
+
+
+_git_hook_lock = threading.Lock()
+_git_hook_installed = False
+
+
+def _install_git_hook():
+    """
+    Time every git subprocess GitPython runs, as `git <subcommand>`, so slow saves and checkouts show which
+    command they wait on. The hook is installed once, the first time metrics are enabled
+    """
+    global _git_hook_installed
+    with _git_hook_lock:
+        if _git_hook_installed:
+            return
+        execute = git.cmd.Git.execute
+
+        @functools.wraps(execute)
+        def timed_execute(self, command, *args, **kwargs):
+            if not metrics.enabled:
+                return execute(self, command, *args, **kwargs)
+            with metrics.timed(KIND_GIT, f"git {_get_subcommand(command)}",
+                               lambda: " ".join(map(str, command))[:MAX_ARGUMENT_LENGTH]):
+                return execute(self, command, *args, **kwargs)
+
+        git.cmd.Git.execute = timed_execute
+        _git_hook_installed = True
+
+
+def _get_subcommand(command) -> str:
+    """ Find the subcommand of a git command line, past the program and its global options """
+    if isinstance(command, str):
+        command = command.split()
+    parts = iter(list(command)[1:])
+    for part in parts:
+        if part == "-c":
+            next(parts, None)
+        elif not str(part).startswith("-"):
+            return str(part)
+    return "?"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
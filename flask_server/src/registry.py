@@ -1,5 +1,8 @@
 import stat
-from typing import List
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Tuple
 import os
 import shutil
 import git
@@ -7,12 +10,31 @@ import subprocess
 
 from flask_server.src import Path, Project
 from flask_server.src.card_set import CardSet
+from flask_server.src.card_storage import FILE_STORAGE, STORAGES
+from flask_server.src.metrics import metrics, KIND_GIT
+
+
+MAX_OPEN_PROJECTS = 16
+IDLE_SECONDS = 10 * 60
+""" Open projects unused for this long are closed, releasing their git processes and folder watcher """
+SWEEP_SECONDS = 60
+""" How often a background thread closes the idle projects, so they are released while no request comes """
+GIT_MARKER = ".git"
 
 
 class Registry:
     """ This class manipulate card set projects """
-    def __init__(self, registry_path: Path):
+    def __init__(self, registry_path: Path, max_open: int = MAX_OPEN_PROJECTS, idle_seconds: float = IDLE_SECONDS,
+                 sweep_seconds: float = SWEEP_SECONDS):
         self.path = registry_path
+        self.max_open: int = max_open
+        self.idle_seconds: float = idle_seconds
+        self.sweep_seconds: float = sweep_seconds
+        self._lock = threading.Lock()
+        self._open: OrderedDict[Project, Tuple[CardSet, float]] = OrderedDict()
+        """ Pool of the open projects with the time they were last handed out, least recently used first """
+        self._sweeper: Tuple[threading.Thread, threading.Event] | None = None
+        """ Thread calling `close_idle_projects` while projects are open, with the event that stops it """
 
     def _get_git_repo(self, name: Project) -> git.Repo | None:
         """ Return the git repo object out of a folder within the registry """
@@ -26,28 +48,31 @@ class Registry:
         except git.InvalidGitRepositoryError:
             return None
 
+    @metrics.instrument(KIND_GIT)
     def get_project_names(self) -> List[Project]:
-        """ Return a list with all valid projects inside the registry """
+        """ Return a list with all valid projects inside the registry, a project is any folder holding a git repo """
         projects = []
-        for folder_name in os.listdir(self.path):
-            if not os.path.isdir(os.path.join(self.path, folder_name)):
-                continue
-
-            if self._get_git_repo(Project(folder_name)):
-                projects.append(Project(folder_name))
-
+        with os.scandir(self.path) as folder:
+            for entry in folder:
+                if entry.is_dir() and os.path.exists(os.path.join(entry.path, GIT_MARKER)):
+                    projects.append(Project(entry.name))
         return projects
 
-    def create_project(self, name: Project) -> git.Repo:
-        """ Create a new project and set up a git repo for it """
+    @metrics.instrument(KIND_GIT)
+    def create_project(self, name: Project, storage: str = FILE_STORAGE) -> git.Repo:
+        """ Create a new project and set up a git repo for it, `storage` picks the layout its cards are kept in """
         folder_path = os.path.join(self.path, name)
 
         if os.path.exists(folder_path):
             raise FileExistsError("REGISTRY NEW_PROJECT - Project folder already exists in registry")
 
+        if storage not in STORAGES:
+            raise ValueError(f"REGISTRY NEW_PROJECT - Unknown card storage '{storage}'")
+
         os.mkdir(folder_path)
-        return CardSet.create_repo(folder_path)
+        return CardSet.create_repo(folder_path, storage)
 
+    @metrics.instrument(KIND_GIT)
     def delete_project(self, name: Project) -> None:
         """ Delete a project in the registry """
         folder_path = os.path.join(self.path, name)
@@ -55,12 +80,95 @@ class Registry:
         if not os.path.exists(folder_path):
             raise FileNotFoundError("REGISTRY DELETE - Project does not exist in registry")
 
+        with self._lock:
+            entry = self._open.pop(name, None)
+        if entry:
+            self._close(entry[0])
         git.rmtree(folder_path)
 
     def get_project(self, name: Project) -> CardSet:
-        """ Return a CardSet project object from the registry """
+        """
+        Return a CardSet project object from the registry.
+        Projects stay open in a pool so their repo, caches and git processes are reused by the next call
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._open.pop(name, None)
+            if entry is None or not os.path.exists(entry[0].path):
+                card_set = self._open_project(name)
+            else:
+                card_set = entry[0]
+            self._open[name] = (card_set, now)
+            closed = self._evict(now)
+            self._start_sweeper()
+
+        for stale in closed:
+            self._close(stale)
+        return card_set
+
+    def close_idle_projects(self):
+        """ Close the pooled projects that have been idle for too long """
+        with self._lock:
+            closed = self._evict(time.monotonic())
+        for card_set in closed:
+            self._close(card_set)
+
+    def close(self):
+        """ Close every pooled project and stop the sweeper, it starts again if a project is opened afterwards """
+        with self._lock:
+            closed = [card_set for card_set, _ in self._open.values()]
+            self._open.clear()
+            sweeper, self._sweeper = self._sweeper, None
+        if sweeper:
+            thread, stop = sweeper
+            stop.set()
+            thread.join()
+        for card_set in closed:
+            self._close(card_set)
+
+    def _start_sweeper(self):
+        """ Start closing idle projects in the background, the lock must be held """
+        if self._sweeper is not None:
+            return
+        stop = threading.Event()
+        thread = threading.Thread(target=self._sweep, args=(stop,), name="registry-sweeper", daemon=True)
+        self._sweeper = (thread, stop)
+        thread.start()
+
+    def _sweep(self, stop: threading.Event):
+        while not stop.wait(self.sweep_seconds):
+            try:
+                self.close_idle_projects()
+            except Exception as e:
+                print(f"REGISTRY SWEEP - Could not close idle projects: {e}")
+
+    @metrics.instrument(KIND_GIT)
+    def _open_project(self, name: Project) -> CardSet:
         project_path = Path(os.path.join(self.path, name))
-        return CardSet(project_path, self._get_git_repo(name))
+        repo = self._get_git_repo(name)
+        if repo is None:
+            raise ValueError(f"REGISTRY GET_PROJECT - Project '{name}' is not a git repo")
+        return CardSet(project_path, repo)
+
+    @staticmethod
+    def _close(card_set: CardSet):
+        """ Close a project once the requests that already hold it are done """
+        with card_set.lock.write():
+            card_set.close()
+
+    def _evict(self, now: float) -> List[CardSet]:
+        """
+        Drop the idle projects and the least recently used ones over the limit, the lock must be held.
+        Projects a request is working with are kept until it is done
+        """
+        evicted = []
+        for name, (card_set, last_used) in list(self._open.items()):
+            if card_set.lock.is_held:
+                continue
+            if len(self._open) > self.max_open or now - last_used > self.idle_seconds:
+                evicted.append(card_set)
+                del self._open[name]
+        return evicted
 
 # repo = self._get_git_repo(name)
 # repo.close()
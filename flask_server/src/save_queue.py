@@ -0,0 +1,159 @@
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict
+from uuid import uuid4 as generate_uuid
+
+from flask_server.src import Project
+from flask_server.src.executors import BoundedPool, PoolBusyError
+from flask_server.src.sessions import SessionPool
+
+
+COALESCE_SECONDS = 5.0
+""" Saves of a project requested this close together become a single commit """
+KEPT_JOBS = 1000
+""" Finished jobs remembered for status requests, older ones are forgotten """
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class SaveJob:
+    """ A commit requested for a project, `saves` counts the requests it coalesced """
+    job_id: str
+    project: Project
+    message: str
+    status: str = JOB_QUEUED
+    saves: int = 1
+    commit: str | None = None
+    """ Hash of the new commit, None when there was nothing to commit """
+    error: str = ""
+    queued_at: float = 0.0
+    finished_at: float | None = None
+
+
+class SaveQueue:
+    """
+    Commits projects in the background. A save waits `window` seconds before it runs and the saves of its project
+    requested meanwhile are folded into it, so frequent autosaves are bounded to a commit per window
+    """
+    def __init__(self, sessions: SessionPool, pool: BoundedPool, window: float = COALESCE_SECONDS):
+        self.sessions: SessionPool = sessions
+        self.pool: BoundedPool = pool
+        self.window: float = window
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, SaveJob] = OrderedDict()
+        self._queued: Dict[Project, SaveJob] = {}
+        """ The job of every project that hasn't started yet, new saves join it """
+        self._finished: Dict[str, threading.Event] = {}
+
+    def enqueue(self, project: Project, message: str) -> SaveJob:
+        """ Request a commit of a project, return the job it joined or started """
+        with self._lock:
+            job = self._queued.get(project)
+            if job is not None:
+                job.message = message
+                job.saves += 1
+                return job
+
+            job = SaveJob(generate_uuid().hex, project, message, queued_at=time.time())
+            self._queued[project] = job
+            self._jobs[job.job_id] = job
+            self._finished[job.job_id] = threading.Event()
+            self._forget_old_jobs()
+
+        self._schedule(job, self.window)
+        return job
+
+    def flush(self, project: Project) -> SaveJob | None:
+        """
+        Commit the project's queued save right away, the caller holds the project's write lock.
+        Run before a swap of the working tree, which would otherwise discard the edits the save was asked to commit
+        """
+        with self._lock:
+            job = self._queued.get(project)
+            if job is None or not self._start(job):
+                return None
+        self._save(job)
+        return job
+
+    def get_job(self, job_id: str) -> SaveJob:
+        with self._lock:
+            if job_id not in self._jobs:
+                raise KeyError(f"SAVE_QUEUE STATUS - Unknown job '{job_id}'")
+            return self._jobs[job_id]
+
+    def wait(self, job_id: str, timeout: float | None = None) -> SaveJob:
+        """ Block until a job is finished, raise TimeoutError when it takes too long """
+        job = self.get_job(job_id)
+        if not self._finished[job_id].wait(timeout):
+            raise TimeoutError(f"SAVE_QUEUE WAIT - Job '{job_id}' is still {job.status}")
+        return job
+
+    def _schedule(self, job: SaveJob, delay: float):
+        timer = threading.Timer(delay, self._submit, (job,))
+        timer.daemon = True
+        timer.start()
+
+    def _submit(self, job: SaveJob):
+        """ Hand a job to the pool once its window is over, a busy pool is tried again a window later """
+        try:
+            self.pool.submit(self._run, job)
+        except PoolBusyError:
+            self._schedule(job, self.window)
+
+    def _run(self, job: SaveJob):
+        with self._lock:
+            if not self._start(job):
+                # A swap of the working tree already flushed it
+                return
+
+        try:
+            session = self.sessions.get_session(job.project)
+            with session.mutating():
+                self._save(job)
+        except Exception as e:
+            self._finish(job, e)
+
+    def _start(self, job: SaveJob) -> bool:
+        """ Mark a queued job as running, False when it already started. The lock must be held """
+        if job.status != JOB_QUEUED:
+            return False
+        # Saves requested from now on need a commit of their own
+        self._queued.pop(job.project, None)
+        job.status = JOB_RUNNING
+        return True
+
+    def _save(self, job: SaveJob):
+        """ Commit a running job, the project's write lock must be held """
+        try:
+            session = self.sessions.get_session(job.project)
+            job.commit = session.card_set.save_changes(job.message)
+        except Exception as e:
+            self._finish(job, e)
+        else:
+            self._finish(job)
+
+    def _finish(self, job: SaveJob, error: Exception | None = None):
+        if error is None:
+            job.status = JOB_DONE
+        else:
+            print(f"SAVE_QUEUE RUN - Saving '{job.project}' failed: {error}")
+            job.error = str(error)
+            job.status = JOB_FAILED
+        job.finished_at = time.time()
+        self._finished[job.job_id].set()
+
+    def _forget_old_jobs(self):
+        """ Drop the oldest finished jobs past the limit, the lock must be held """
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= KEPT_JOBS:
+                break
+            if self._jobs[job_id].status in (JOB_DONE, JOB_FAILED):
+                del self._jobs[job_id]
+                del self._finished[job_id]
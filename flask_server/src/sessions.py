@@ -0,0 +1,51 @@
+import threading
+
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from flask_server.src import Project
+from flask_server.src.card_editor import CardEditor
+from flask_server.src.card_set import CardSet
+from flask_server.src.registry import Registry
+
+
+class ProjectSession:
+    """ The card set and editor that requests naming a project work with """
+    def __init__(self, name: Project, card_set: CardSet):
+        self.name: Project = name
+        self.card_set: CardSet = card_set
+        self.editor: CardEditor = CardEditor()
+        self.editor.scope_to_set(card_set)
+
+    @contextmanager
+    def reading(self) -> Iterator["ProjectSession"]:
+        """
+        Share the card set with other requests. Card reads and edits both take this side, the working tree is
+        updated through atomic renames so they only have to be kept apart from git mutations
+        """
+        with self.card_set.lock.read():
+            yield self
+
+    @contextmanager
+    def mutating(self) -> Iterator["ProjectSession"]:
+        """ Hold the card set alone, for commits and anything else that rewrites the repo or the working tree """
+        with self.card_set.lock.write():
+            yield self
+
+
+class SessionPool:
+    """ Hands out one session per open project, following the card sets the registry keeps open """
+    def __init__(self, registry: Registry):
+        self.registry: Registry = registry
+        self._lock = threading.Lock()
+        self._sessions: Dict[Project, ProjectSession] = {}
+
+    def get_session(self, name: Project) -> ProjectSession:
+        card_set = self.registry.get_project(name)
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is None or session.card_set is not card_set:
+                # The registry reopened the project, the old session's card set was closed
+                session = ProjectSession(name, card_set)
+                self._sessions[name] = session
+            return session
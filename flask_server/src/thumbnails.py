@@ -0,0 +1,104 @@
+import hashlib
+import io
+import os
+
+from typing import Tuple
+from uuid import UUID
+
+from PIL import Image
+
+from flask_server.src import Path
+from flask_server.src.executors import BoundedPool
+from flask_server.src.files import FileCache, write_atomically
+from flask_server.src.images import ImageBank
+from flask_server.src.metrics import metrics, KIND_IMAGE
+
+
+THUMBNAIL_SIZES = (64, 256, 1024)
+""" Size buckets, requested sizes are rounded up to the closest bucket so few derivatives exist per image """
+THUMBNAIL_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+THUMBNAIL_QUALITY = 85
+
+
+class ThumbnailCache:
+    """
+    Builds scaled down derivatives of the image bank pictures on demand and keeps them in a folder.
+    Derivatives are named after the content key of their source, so new pixels invalidate them while metadata
+    edits don't, and the folder is kept under a byte budget by evicting the least recently used files
+    """
+    def __init__(self, image_bank: ImageBank, cache_path: Path, max_bytes: int = DEFAULT_CACHE_BYTES,
+                 pool: BoundedPool | None = None):
+        self.image_bank: ImageBank = image_bank
+        self.path: Path = cache_path
+        self.pool: BoundedPool | None = pool
+        """ Process pool derivatives are rendered in, they are rendered in the calling thread without one """
+
+        if not os.path.exists(cache_path):
+            raise FileNotFoundError("THUMBNAILS SETUP - Missing thumbnails folder")
+
+        self.cache: FileCache = FileCache(cache_path, max_bytes)
+
+    @staticmethod
+    def get_bucket(size: int) -> int:
+        """ Round a requested size up to its size bucket """
+        for bucket in THUMBNAIL_SIZES:
+            if size <= bucket:
+                return bucket
+        return THUMBNAIL_SIZES[-1]
+
+    def get_etag(self, image_uuid: UUID, size: int, image_format: str = "webp") -> str:
+        """ Return the tag of a derivative without building it, it changes whenever the source image does """
+        name, _ = self._describe(image_uuid, size, image_format)
+        return name
+
+    def get_thumbnail(self, image_uuid: UUID, size: int, image_format: str = "webp") -> Tuple[Path, str]:
+        """ Return the path and mimetype of a derivative no larger than the size bucket, building it if needed """
+        name, mimetype = self._describe(image_uuid, size, image_format)
+        path = Path(os.path.join(self.path, name))
+        if self.cache.touch(name):
+            return path, mimetype
+
+        write_atomically(path, self._render(image_uuid, self.get_bucket(size), THUMBNAIL_FORMATS[image_format][0]))
+
+        # Derivatives of older versions of the source are dead weight now
+        prefix = f"{image_uuid}_{self.get_bucket(size)}_"
+        self.cache.remove(other for other in self.cache.get_names(prefix) if other != name)
+        self.cache.add([name])
+        return path, mimetype
+
+    def invalidate(self, image_uuid: UUID):
+        """ Drop every derivative of an image """
+        self.cache.remove(self.cache.get_names(f"{image_uuid}_"))
+
+    def _describe(self, image_uuid: UUID, size: int, image_format: str) -> Tuple[str, str]:
+        """ Return the cache file name and mimetype of a derivative """
+        if image_format not in THUMBNAIL_FORMATS:
+            raise ValueError(f"THUMBNAILS GET - Unsupported format '{image_format}'")
+
+        content_key = self.image_bank.get_content_key(image_uuid)
+        if content_key is None:
+            raise FileNotFoundError("THUMBNAILS GET - Missing Image")
+
+        version = hashlib.blake2b(content_key.encode("utf-8"), digest_size=8).hexdigest()
+        name = f"{image_uuid}_{self.get_bucket(size)}_{version}.{image_format}"
+        return name, THUMBNAIL_FORMATS[image_format][1]
+
+    @metrics.instrument(KIND_IMAGE)
+    def _render(self, image_uuid: UUID, bucket: int, pil_format: str) -> bytes:
+        source = self.image_bank.get_image_path(image_uuid)
+        if self.pool:
+            return self.pool.run(render_thumbnail, source, bucket, pil_format)
+        return render_thumbnail(source, bucket, pil_format)
+
+
+def render_thumbnail(source: Path, bucket: int, pil_format: str) -> bytes:
+    """ Scale an image down to fit the bucket, JPEG sources are decoded at a reduced scale """
+    with Image.open(source) as image:
+        image.draft("RGB", (bucket, bucket))
+        thumbnail = image.convert("RGB")
+        thumbnail.thumbnail((bucket, bucket), reducing_gap=2.0)
+
+    output = io.BytesIO()
+    thumbnail.save(output, pil_format, quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask_server.benchmarks.suite import BenchmarkResult, compare, load_results, run_suite, save_results
+from flask_server.benchmarks.synthetic import Scale
+from flask_server.src import Path
+
+
+class TestBenchmarks(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_suite_runs_against_a_tiny_workspace(self):
+        scale = Scale(cards=30, images=5, commits=12, projects=3)
+        workspace = Path(os.path.join(self.temp_dir, "workspace"))
+        os.mkdir(workspace)
+
+        results = run_suite(workspace, scale, repeat=1, log=lambda message: None)
+
+        self.assertIn("card_set.save_changes", [result.name for result in results])
+        self.assertTrue(all(result.runs == 1 and result.best <= result.median for result in results))
+        results_path = Path(os.path.join(self.temp_dir, "results.json"))
+        save_results(results_path, results, "tiny", scale, "files")
+        self.assertEqual(compare(load_results(results_path), results), [])
+
+    def test_only_slowdowns_past_the_threshold_and_the_noise_floor_regress(self):
+        baseline = {"results": {"slow": {"median": 0.1}, "tiny": {"median": 0.0001}, "same": {"median": 0.1}}}
+        results = [BenchmarkResult("slow", 5, 0.13, 0.12, 0.14), BenchmarkResult("tiny", 5, 0.001, 0.001, 0.001),
+                   BenchmarkResult("same", 5, 0.11, 0.1, 0.12), BenchmarkResult("new", 5, 1.0, 1.0, 1.0)]
+
+        regressions = compare(baseline, results, threshold=0.2)
+
+        self.assertEqual([regression.name for regression in regressions], ["slow"])
+        self.assertAlmostEqual(regressions[0].ratio, 1.3)
@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from uuid import UUID
+
+from flask_server.src import Json, Path
+from flask_server.src.card_editor import CardEditor, CardOperation, CREATE_CARD, UPDATE_CARD, DELETE_CARD
+from flask_server.src.card_storage import (BATCH_FOLDER_NAME, JOURNAL_FILE_NAME, PACK_FILE_NAME, PACK_STORAGE,
+                                           STALE_BATCH_SECONDS)
+from flask_server.src.card_set import CardSet
+
+
+def backdate(path: str, seconds: int = 10):
+    """ Move a file's mtime to the past, so the cache doesn't consider it racy """
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+class TestCardEditor(TestCase):
+    def setUp(self):
+        # Create a card set repo scoped to a fresh editor
+        self.temp_dir = tempfile.mkdtemp()
+        self.set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(self.set_path)
+        self.card_set = CardSet(self.set_path, CardSet.create_repo(self.set_path))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+
+    def tearDown(self):
+        self.card_set.close()
+        shutil.rmtree(self.temp_dir)
+
+    def card_path(self, card_uuid) -> str:
+        return os.path.join(self.set_path, f"{card_uuid}.json")
+
+    def test_card_data_is_cached_until_file_changes(self):
+        card_uuid = self.editor.create_card(Json('{"name": "Sun Dino"}'))
+        backdate(self.card_path(card_uuid))
+
+        self.assertEqual(self.editor.get_card_data(card_uuid), '{"name": "Sun Dino"}')
+        self.assertIsNotNone(self.card_set.storage.cache.get_card(f"{card_uuid}.json", self._stamp(card_uuid)))
+
+        # Edit the file behind the editor's back
+        with open(self.card_path(card_uuid), "w") as file:
+            file.write('{"name": "Moon Dino!"}')
+        self.assertEqual(self.editor.get_card_data(card_uuid), '{"name": "Moon Dino!"}')
+
+    def test_card_list_follows_folder_changes(self):
+        first = self.editor.create_card(Json('{}'))
+        os.utime(self.set_path, (time.time() - 10, time.time() - 10))
+        self.assertEqual(self.editor.get_card_list(), [UUID(first)])
+
+        second = self.editor.create_card(Json('{}'))
+        self.assertCountEqual(self.editor.get_card_list(), [UUID(first), UUID(second)])
+
+        os.remove(self.card_path(first))
+        self.assertEqual(self.editor.get_card_list(), [UUID(second)])
+
+    def test_cache_is_cleared_when_branch_is_loaded(self):
+        card_uuid = self.editor.create_card(Json('{"name": "Sun Dino"}'))
+        self.card_set.create_branch("SaveFile", "First Card Was Created")
+        backdate(self.card_path(card_uuid))
+        self.editor.get_card_data(card_uuid)
+        stamp = self._stamp(card_uuid)
+
+        self.card_set.load_branch("master")
+
+        self.assertIsNone(self.card_set.storage.cache.get_card(f"{card_uuid}.json", stamp))
+        with self.assertRaises(FileNotFoundError):
+            self.editor.get_card_data(card_uuid)
+
+    def _stamp(self, card_uuid):
+        stat = os.stat(self.card_path(card_uuid))
+        return stat.st_mtime_ns, stat.st_size
+
+    def test_batch_applies_every_operation(self):
+        kept, removed = self.editor.create_card(Json('{"name": "Kept"}')), self.editor.create_card(Json('{}'))
+
+        card_uuids = self.editor.apply_batch([
+            CardOperation(CREATE_CARD, card_data=Json('{"name": "New"}')),
+            CardOperation(UPDATE_CARD, kept, Json('{"name": "Updated"}')),
+            CardOperation(DELETE_CARD, removed),
+        ])
+
+        self.assertEqual(card_uuids[1:], [kept, removed])
+        self.assertEqual(self.editor.get_card_data(card_uuids[0]), '{"name": "New"}')
+        self.assertEqual(self.editor.get_card_data(kept), '{"name": "Updated"}')
+        self.assertCountEqual(self.editor.get_card_list(), [UUID(card_uuids[0]), UUID(kept)])
+        self.assertEqual(os.listdir(os.path.join(self.card_set.repo.git_dir, BATCH_FOLDER_NAME)), [])
+
+    def test_invalid_batch_writes_nothing(self):
+        with self.assertRaises(FileNotFoundError):
+            self.editor.apply_batch([
+                CardOperation(CREATE_CARD, card_data=Json('{}')),
+                CardOperation(UPDATE_CARD, "00000000-0000-0000-0000-000000000000", Json('{}')),
+            ])
+        with self.assertRaises(ValueError):
+            self.editor.apply_batch([CardOperation(CREATE_CARD)])
+
+        self.assertEqual(self.editor.get_card_list(), [])
+
+    def test_interrupted_batch_is_replayed_from_journal(self):
+        card_uuid = self.editor.create_card(Json('{"name": "Old"}'))
+        staging = os.path.join(self.card_set.repo.git_dir, BATCH_FOLDER_NAME, "interrupted")
+        os.mkdir(staging)
+        staged_path = os.path.join(staging, f"{card_uuid}.json")
+        with open(staged_path, "w") as file:
+            file.write('{"name": "New"}')
+        with open(os.path.join(staging, JOURNAL_FILE_NAME), "w") as file:
+            json.dump({"renames": [[staged_path, self.card_path(card_uuid)]], "deletions": []}, file)
+
+        CardSet(self.card_set.path, self.card_set.repo).changes.close()
+
+        self.assertEqual(self.editor.get_card_data(card_uuid), '{"name": "New"}')
+        self.assertFalse(os.path.exists(staging))
+
+    def test_only_stale_batches_without_journal_are_dropped(self):
+        batch_folder = os.path.join(self.card_set.repo.git_dir, BATCH_FOLDER_NAME)
+        staging, stale = os.path.join(batch_folder, "staging"), os.path.join(batch_folder, "stale")
+        for folder in (staging, stale):
+            os.mkdir(folder)
+            with open(os.path.join(folder, "00000000-0000-0000-0000-000000000000.json"), "w") as file:
+                file.write("{}")
+        old = time.time() - STALE_BATCH_SECONDS - 60
+        os.utime(stale, (old, old))
+
+        self.card_set.storage.recover()
+
+        self.assertTrue(os.path.exists(staging))
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(self.editor.get_card_list(), [])
+
+    def test_cards_are_read_at_revisions_without_checkout(self):
+        card_uuid = self.editor.create_card(Json('{"name": "Sun Dino"}'))
+        first = self.card_set.save_changes("Sun")
+        self.editor.update_card(card_uuid, Json('{"name": "Moon Dino"}'))
+        second = self.card_set.save_changes("Moon")
+        self.editor.delete_card(card_uuid)
+
+        self.assertEqual(self.editor.get_card_data(card_uuid, rev=first), '{"name": "Sun Dino"}')
+        self.assertEqual(self.editor.get_card_data(card_uuid, rev="master"), '{"name": "Moon Dino"}')
+        self.assertEqual(self.editor.get_card_list(rev=second[:8]), [UUID(card_uuid)])
+        self.assertEqual(self.editor.get_card_list(rev="HEAD^^"), [])
+        self.assertEqual(self.editor.get_card_list(), [])
+        self.assertEqual(self.editor.get_changed_cards(), [])
+
+        # Blobs are served from the cache once read
+        sha = self.card_set.repo.commit(first).tree[f"{card_uuid}.json"].hexsha
+        self.assertEqual(self.card_set.storage.blobs.get(sha), '{"name": "Sun Dino"}')
+
+    def test_unknown_revisions_and_cards_raise(self):
+        with self.assertRaises(ValueError):
+            self.editor.get_card_list(rev="missing")
+        with self.assertRaises(FileNotFoundError):
+            self.editor.get_card_data("00000000-0000-0000-0000-000000000000", rev="HEAD")
+
+
+class TestPackCardEditor(TestCase):
+    def setUp(self):
+        # Create a card set repo that keeps its cards in a pack file
+        self.temp_dir = tempfile.mkdtemp()
+        self.set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(self.set_path)
+        self.card_set = CardSet(self.set_path, CardSet.create_repo(self.set_path, PACK_STORAGE))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+
+    def tearDown(self):
+        self.card_set.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_cards_are_kept_in_one_sorted_pack(self):
+        card_uuids = self.editor.apply_batch([CardOperation(CREATE_CARD, card_data=Json(f'{{"cost": {index}}}'))
+                                              for index in range(3)])
+
+        self.assertEqual(os.listdir(self.set_path).count(PACK_FILE_NAME), 1)
+        self.assertCountEqual(self.editor.get_card_list(), [UUID(card_uuid) for card_uuid in card_uuids])
+        with open(os.path.join(self.set_path, PACK_FILE_NAME)) as file:
+            lines = file.read().splitlines()
+        self.assertEqual([line.split("\t")[0] for line in lines], sorted(card_uuids))
+        self.assertEqual(lines[0].split("\t")[1], json.dumps(self.editor.get_card_data(sorted(card_uuids)[0])))
+
+    def test_changes_and_branches_follow_the_pack(self):
+        sun = self.editor.create_card(Json('{"Type": "Dino"}'))
+        self.card_set.create_branch("SaveFile", "First Card Was Created")
+        self.assertEqual(self.editor.get_changed_cards(), [])
+
+        moon = self.editor.create_card(Json('{"Type": "Dino"}'))
+        self.editor.update_card(sun, Json('{"Type": "Bird"}'))
+        self.assertCountEqual(self.editor.get_changed_cards(), [UUID(sun), UUID(moon)])
+        self.assertEqual(self.editor.query_cards({"Type": "Dino"}), (1, [moon]))
+
+        self.card_set.load_branch("SaveFile")
+        self.assertEqual(self.editor.get_card_list(), [UUID(sun)])
+        self.assertEqual(self.editor.query_cards({"Type": "Dino"}), (1, [sun]))
+
+    def test_pack_is_read_at_revisions_without_checkout(self):
+        sun = self.editor.create_card(Json('{"Type": "Dino"}'))
+        first = self.card_set.save_changes("Sun")
+        moon = self.editor.create_card(Json('{"Type": "Bird"}'))
+        self.editor.update_card(sun, Json('{"Type": "Fish"}'))
+
+        self.assertEqual(self.editor.get_card_list(rev=first), [UUID(sun)])
+        self.assertEqual(self.editor.get_card_data(sun, rev=first), '{"Type": "Dino"}')
+        self.assertCountEqual(self.editor.get_card_list(), [UUID(sun), UUID(moon)])
+        with self.assertRaises(FileNotFoundError):
+            self.editor.get_card_data(moon, rev=first)
+
+    def test_missing_cards_raise(self):
+        with self.assertRaises(FileNotFoundError):
+            self.editor.get_card_data("00000000-0000-0000-0000-000000000000")
+        with self.assertRaises(FileNotFoundError):
+            self.editor.delete_card("00000000-0000-0000-0000-000000000000")
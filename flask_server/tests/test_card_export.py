@@ -0,0 +1,76 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import TestCase
+
+from PIL import Image
+
+from flask_server.src import Json, Path
+from flask_server.src.card_editor import CardEditor
+from flask_server.src.card_export import CardExporter, MANIFEST_FILE_NAME
+from flask_server.src.card_set import CardSet
+from flask_server.src.images import ImageBank
+
+
+class TestCardExporter(TestCase):
+    def setUp(self):
+        # Create an image bank with one picture and a card set referencing it
+        self.temp_dir = tempfile.mkdtemp()
+        bank_path = os.path.join(self.temp_dir, "images")
+        os.mkdir(bank_path)
+        sample_path = os.path.join(self.temp_dir, "sample.jpg")
+        Image.new('RGB', (120, 80), (200, 30, 30)).save(sample_path)
+        self.bank = ImageBank(Path(bank_path))
+        self.image_uuid, _ = self.bank.import_image(Path(sample_path), "sample_image")
+
+        set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(set_path)
+        self.card_set = CardSet(set_path, CardSet.create_repo(set_path))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+        self.exporter = CardExporter(self.editor, self.bank)
+
+        art = Json(json.dumps({"name": "Sun Dino", "art": {"front": str(self.image_uuid)}}))
+        self.sun = self.editor.create_card(art)
+        self.moon = self.editor.create_card(Json(json.dumps({"name": "Moon Dino", "art": [str(self.image_uuid)]})))
+
+    def tearDown(self):
+        self.card_set.close()
+        self.bank.catalog.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_ndjson_export_holds_cards_and_their_images_once(self):
+        records = [json.loads(line) for line in b"".join(self.exporter.export_ndjson()).splitlines()]
+
+        self.assertCountEqual([record["uuid"] for record in records if record["type"] == "card"],
+                              [self.sun, self.moon])
+        image, = [record for record in records if record["type"] == "image"]
+        self.assertEqual((image["uuid"], image["file_name"]), (str(self.image_uuid), "sample_image"))
+        with open(self.bank.get_image_path(self.image_uuid), "rb") as file:
+            self.assertEqual(base64.b64decode(image["content"]), file.read())
+
+    def test_zip_export_at_a_revision(self):
+        first = self.card_set.save_changes("Two cards")
+        self.editor.delete_card(self.moon)
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(self.exporter.export_zip(first)))) as archive:
+            names = archive.namelist()
+            manifest = json.loads(archive.read(MANIFEST_FILE_NAME))
+            sun = json.loads(archive.read(f"cards/{self.sun}.json"))
+
+        self.assertIn(f"cards/{self.moon}.json", names)
+        self.assertIn(f"images/{self.image_uuid}.jpg", names)
+        self.assertEqual(manifest, {"revision": first, "cards": 2, "images": 1})
+        self.assertEqual(sun["name"], "Sun Dino")
+
+    def test_export_without_images(self):
+        with zipfile.ZipFile(io.BytesIO(b"".join(self.exporter.export_zip(images=False)))) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+            self.assertEqual(json.loads(archive.read(MANIFEST_FILE_NAME))["images"], 0)
@@ -0,0 +1,129 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask_server.src import Json, Path
+from flask_server.src.card_editor import CardEditor
+from flask_server.src.card_import import CardImporter, NDJSON_FORMAT, RowError
+from flask_server.src.card_set import CardSet
+
+
+class TestCardImporter(TestCase):
+    def setUp(self):
+        # Create a card set repo scoped to a fresh editor
+        self.temp_dir = tempfile.mkdtemp()
+        set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(set_path)
+        self.card_set = CardSet(set_path, CardSet.create_repo(set_path))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+        self.importer = CardImporter(self.editor, batch_size=2)
+
+    def tearDown(self):
+        self.card_set.close()
+        shutil.rmtree(self.temp_dir)
+
+    def cards_by_name(self):
+        cards = [json.loads(card_data) for _, card_data in self.editor.iter_cards()]
+        return {card["name"]: card for card in cards}
+
+    def test_csv_rows_are_mapped_and_committed_once(self):
+        head = self.card_set.repo.head.commit
+        sheet = io.StringIO("Name,Cost,Power,Notes\nSun Dino,3,5,\nMoon Dino,1,2.5,night\nStar Bird,2,1,\n")
+
+        report = self.importer.import_cards(sheet, key="name",
+                                            mapping={"Name": "name", "Cost": "cost", "Power": "stats.power",
+                                                     "Notes": ""})
+
+        self.assertEqual((report.created, report.updated, report.failed), (3, 0, 0))
+        self.assertEqual(self.card_set.repo.head.commit.parents, (head,))
+        self.assertEqual(self.card_set.repo.head.commit.hexsha, report.commit)
+        self.assertEqual(self.cards_by_name()["Moon Dino"], {"name": "Moon Dino", "cost": 1, "stats": {"power": 2.5}})
+        self.assertEqual(self.editor.get_changed_cards(), [])
+
+    def test_only_json_numbers_are_read_as_numbers(self):
+        sheet = io.StringIO("name,code,count,ratio,big\nSun Dino,001,1_000,-0.5,2e3\n")
+
+        self.importer.import_cards(sheet)
+
+        card = self.cards_by_name()["Sun Dino"]
+        self.assertEqual((card["code"], card["count"]), ("001", "1_000"))
+        self.assertEqual((card["ratio"], card["big"]), (-0.5, 2000.0))
+
+    def test_zero_padded_keys_match_on_reimport(self):
+        sheet = "sku,name\n007,Sun Dino\n0070,Moon Dino\n"
+        self.importer.import_cards(io.StringIO(sheet), key="sku")
+
+        report = self.importer.import_cards(io.StringIO(sheet.replace("Dino", "Bird")), key="sku")
+
+        self.assertEqual((report.created, report.updated), (0, 2))
+        cards = self.cards_by_name()
+        self.assertEqual((cards["Sun Bird"]["sku"], cards["Moon Bird"]["sku"]), ("007", "0070"))
+        self.assertEqual(len(cards), 2)
+
+    def test_rows_upsert_by_key(self):
+        sun = self.editor.create_card(Json('{"name": "Sun Dino", "cost": 9, "art": "sun.jpg", "stats": {"speed": 1}}'))
+        rows = ['{"name": "Sun Dino", "cost": 3, "stats": {"power": 5}}', '{"name": "Moon Dino", "cost": 1}',
+                '{"name": "Moon Dino", "tags": ["night"]}']
+
+        report = CardImporter(self.editor).import_cards(io.StringIO("\n".join(rows)), NDJSON_FORMAT, key="name")
+
+        self.assertEqual((report.created, report.updated), (1, 1))
+        self.assertEqual(json.loads(self.editor.get_card_data(sun)),
+                         {"name": "Sun Dino", "cost": 3, "art": "sun.jpg", "stats": {"speed": 1, "power": 5}})
+        self.assertEqual(self.cards_by_name()["Moon Dino"], {"name": "Moon Dino", "cost": 1, "tags": ["night"]})
+        self.assertEqual(len(self.editor.get_card_list()), 2)
+
+    def test_rows_of_a_key_spread_over_batches_update_the_card(self):
+        rows = ['{"name": "Sun Dino", "cost": 3}', '{"name": "Moon Dino"}', '{"name": "Sun Dino", "cost": 4}']
+
+        report = self.importer.import_cards(io.StringIO("\n".join(rows)), NDJSON_FORMAT, key="name")
+
+        self.assertEqual((report.created, report.updated), (2, 1))
+        self.assertEqual(self.cards_by_name()["Sun Dino"]["cost"], 4)
+        self.assertEqual(len(self.editor.get_card_list()), 2)
+
+    def test_bad_rows_are_reported_without_stopping_the_import(self):
+        rows = ['{"name": "Sun Dino"}', '{name: broken}', '[1, 2]', '{"cost": 3}', '{"name": "Moon Dino"}']
+
+        report = self.importer.import_cards(io.StringIO("\n".join(rows)), NDJSON_FORMAT, key="name")
+
+        self.assertEqual((report.created, report.failed), (2, 3))
+        self.assertEqual([error.row for error in report.errors], [2, 3, 4])
+        self.assertIn(RowError(4, "CARD_IMPORT ROW - Missing key field 'name'"), report.errors)
+
+    def test_unsaved_edits_stay_out_of_the_import_commit(self):
+        card_uuid = self.editor.create_card(Json('{"name": "Draft Dino"}'))
+
+        report = self.importer.import_cards(io.StringIO("name\nSun Dino\n"))
+
+        head = self.card_set.repo.head.commit
+        self.assertEqual(len(head.diff(head.parents[0])), 1)
+        self.assertEqual([str(changed) for changed in self.editor.get_changed_cards()], [card_uuid])
+        self.assertIsNotNone(report.commit)
+
+    def test_refused_batch_reports_every_merged_row(self):
+        class RefusingEditor(CardEditor):
+            def apply_batch(self, operations, written_paths=None):
+                raise ValueError("refused")
+
+        editor = RefusingEditor()
+        editor.scope_to_set(self.card_set)
+        rows = ['{"name": "Sun Dino"}', '{"name": "Moon Dino"}', '{"name": "Sun Dino", "cost": 3}']
+
+        report = CardImporter(editor).import_cards(io.StringIO("\n".join(rows)), NDJSON_FORMAT, key="name")
+
+        self.assertEqual(report.failed, 3)
+        self.assertEqual([error.row for error in report.errors], [1, 2, 3])
+        self.assertIsNone(report.commit)
+
+    def test_import_without_rows_commits_nothing(self):
+        report = self.importer.import_cards(io.StringIO("name,cost\n"))
+
+        self.assertEqual((report.created, report.commit), (0, None))
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask_server.src import Json, Path
+from flask_server.src.card_editor import CardEditor
+from flask_server.src.card_query import CardIndex
+from flask_server.src.card_set import CardSet
+
+
+class TestCardIndex(TestCase):
+    def setUp(self):
+        self.index = CardIndex()
+        self.index.build([
+            ("a", Json('{"name": "Sun Dino", "Type": "Dino", "cost": 3, "tags": ["fire", "day"]}')),
+            ("b", Json('{"name": "Moon Dino", "Type": "Dino", "cost": 1, "stats": {"power": 5}}')),
+            ("c", Json('{"name": "Star Bird", "Type": "Bird", "cost": 2, "stats": {"power": 2}}')),
+            ("d", Json('{name:Not Json}')),
+        ])
+
+    def test_equality_and_list_filters(self):
+        self.assertEqual(self.index.query({"Type": "Dino"}), (2, ["a", "b"]))
+        self.assertEqual(self.index.query({"tags": "fire"}), (1, ["a"]))
+        self.assertEqual(self.index.query({"Type": {"in": ["Bird", "Fish"]}}), (1, ["c"]))
+        self.assertEqual(self.index.query({"cost": "3"}), (0, []))
+
+    def test_range_filters_and_sorting(self):
+        self.assertEqual(self.index.query({"cost": {"min": 2}}, sort_by="cost"), (2, ["c", "a"]))
+        self.assertEqual(self.index.query({"stats.power": {"max": 5}}, "stats.power", True), (2, ["b", "c"]))
+        self.assertEqual(self.index.query(sort_by="cost", offset=1, limit=2), (4, ["c", "a"]))
+        self.assertEqual(self.index.query(sort_by="name"), (4, ["b", "c", "a", "d"]))
+
+    def test_falsy_values_sort_with_the_others(self):
+        index = CardIndex()
+        index.build([("a", Json('{"name": "b"}')), ("b", Json('{"name": ""}')), ("c", Json('{"flag": true}')),
+                     ("d", Json('{"flag": false}')), ("e", Json('{}'))])
+
+        self.assertEqual(index.query(sort_by="name"), (5, ["b", "a", "c", "d", "e"]))
+        self.assertEqual(index.query(sort_by="flag"), (5, ["d", "c", "a", "b", "e"]))
+        self.assertEqual(self.index.query({"Type": "Dino"}, sort_by="cost", descending=True), (2, ["a", "b"]))
+
+    def test_malformed_queries_are_refused(self):
+        for filters in ([], {"cost": {"min": "2"}}, {"cost": {"max": True}}, {"Type": {"in": "Dino"}}):
+            with self.assertRaises(ValueError):
+                self.index.query(filters)
+        for offset, limit in ((-1, None), (0, -1), ("1", None), (0, 1.5), (True, None)):
+            with self.assertRaises(ValueError):
+                self.index.query(offset=offset, limit=limit)
+        with self.assertRaises(ValueError):
+            self.index.query(sort_by=["cost"])
+
+    def test_incremental_updates(self):
+        self.index.update("b", Json('{"Type": "Bird", "cost": 9}'))
+        self.index.remove("c")
+
+        self.assertEqual(self.index.query({"Type": "Bird"}), (1, ["b"]))
+        self.assertEqual(self.index.query({"cost": {"min": 4}}), (1, ["b"]))
+        self.assertEqual(self.index.query({"stats.power": {"min": 0}}), (0, []))
+
+
+class TestCardSetQueries(TestCase):
+    def setUp(self):
+        # Create a card set repo scoped to a fresh editor
+        self.temp_dir = tempfile.mkdtemp()
+        set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(set_path)
+        self.card_set = CardSet(set_path, CardSet.create_repo(set_path))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+
+    def tearDown(self):
+        self.card_set.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_index_follows_editor_writes(self):
+        sun = self.editor.create_card(Json('{"Type": "Dino", "cost": 3}'))
+        self.assertEqual(self.editor.query_cards({"Type": "Dino"}), (1, [sun]))
+
+        moon = self.editor.create_card(Json('{"Type": "Dino", "cost": 1}'))
+        self.editor.update_card(sun, Json('{"Type": "Bird", "cost": 3}'))
+
+        self.assertEqual(self.editor.query_cards({"Type": "Dino"}), (1, [moon]))
+        self.assertEqual(self.editor.query_cards(sort_by="cost"), (2, [moon, sun]))
+
+    def test_index_follows_branch_switches(self):
+        sun = self.editor.create_card(Json('{"Type": "Dino"}'))
+        self.card_set.create_branch("SaveFile", "First Card Was Created")
+        self.editor.update_card(sun, Json('{"Type": "Bird"}'))
+        self.assertEqual(self.editor.query_cards({"Type": "Bird"}), (1, [sun]))
+
+        # Loading the branch discards the unsaved edit
+        self.card_set.load_branch("SaveFile")
+        self.assertEqual(self.editor.query_cards({"Type": "Dino"}), (1, [sun]))
+
+        self.card_set.load_branch("master")
+        self.assertEqual(self.editor.query_cards(), (0, []))
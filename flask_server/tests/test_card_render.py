@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase
+
+from PIL import Image
+
+from flask_server.src import Json, Path, Uuid
+from flask_server.src.card_render import CardRenderer, CardTemplate, TemplateLayer, render_card_files
+from flask_server.src.executors import BoundedPool
+from flask_server.src.images import ImageBank, ImageData
+
+TEMPLATE = {"width": 60, "height": 80, "background": "white", "layers": [
+    {"type": "box", "box": [0, 0, 60, 10], "color": "#ff0000"},
+    {"type": "image", "box": [0, 10, 60, 40], "field": "art"},
+    {"type": "text", "box": [4, 52, 52, 28], "field": "name", "size": 10},
+]}
+
+
+class TestCardRenderer(TestCase):
+    def setUp(self):
+        # Create a bank holding one blue image, and empty templates and renders folders
+        self.temp_dir = tempfile.mkdtemp()
+        for folder in ("images", "templates", "renders"):
+            os.mkdir(os.path.join(self.temp_dir, folder))
+        sample_path = os.path.join(self.temp_dir, "sample.jpg")
+        Image.new('RGB', (300, 200), (10, 20, 200)).save(sample_path)
+
+        self.bank = ImageBank(Path(os.path.join(self.temp_dir, "images")))
+        self.image_uuid, _ = self.bank.import_image(Path(sample_path), "sample")
+        self.renderer = CardRenderer(self.bank, Path(os.path.join(self.temp_dir, "templates")),
+                                     Path(os.path.join(self.temp_dir, "renders")))
+        self.renderer.save_template("poker", Json(json.dumps(TEMPLATE)))
+
+    def tearDown(self):
+        self.bank.catalog.close()
+        shutil.rmtree(self.temp_dir)
+
+    def build_cards(self, count: int):
+        return [(Uuid(f"card-{index}"), Json(json.dumps({"name": f"Dino {index}", "art": str(self.image_uuid)})))
+                for index in range(count)]
+
+    def test_card_is_composed_through_the_template(self):
+        result, = self.renderer.render_cards(self.build_cards(1), "poker")
+
+        self.assertEqual((result.error, result.cached), ("", False))
+        with Image.open(self.renderer.get_render_path(result.key)) as render:
+            self.assertEqual((render.format, render.size), ("PNG", (60, 80)))
+            self.assertEqual(render.getpixel((30, 5))[:3], (255, 0, 0))
+            blue = render.getpixel((30, 30))
+            self.assertTrue(blue[2] > 150 and blue[0] < 60)
+            self.assertEqual(render.getpixel((59, 79))[:3], (255, 255, 255))
+
+    def test_only_changed_cards_are_rendered_again(self):
+        cards = self.build_cards(20)
+        first = self.renderer.render_cards(cards, "poker", "webp")
+        self.assertFalse(any(result.cached for result in first))
+
+        cards[7] = (cards[7][0], Json(json.dumps({"name": "Edited", "art": str(self.image_uuid)})))
+        second = self.renderer.render_cards(cards, "poker", "webp")
+
+        self.assertEqual([result.card_uuid for result in second if not result.cached], ["card-7"])
+        self.assertNotEqual(first[7].key, second[7].key)
+        self.assertEqual([result.key for result in first if result.card_uuid != "card-7"],
+                         [result.key for result in second if result.card_uuid != "card-7"])
+
+    def test_a_tight_budget_keeps_the_renders_of_the_batch(self):
+        renders_path = Path(os.path.join(self.temp_dir, "renders"))
+        self.renderer.render_cards(self.build_cards(2), "poker")
+        renderer = CardRenderer(self.bank, Path(os.path.join(self.temp_dir, "templates")), renders_path, max_bytes=1)
+
+        results = renderer.render_cards(self.build_cards(4), "poker")
+
+        self.assertEqual([result.cached for result in results], [True, True, False, False])
+        for result in results:
+            self.assertTrue(os.path.exists(renderer.get_render_path(result.key)))
+        self.assertEqual(len(os.listdir(renders_path)), 4)
+
+        renderer.render_cards(self.build_cards(6)[4:], "poker")
+        self.assertEqual(len(os.listdir(renders_path)), 2)
+
+    def test_renders_follow_the_template_and_image_content(self):
+        card = self.build_cards(1)
+        key = self.renderer.render_cards(card, "poker")[0].key
+
+        self.bank.write_image_metadata(self.image_uuid, ImageData("renamed"))
+        self.assertEqual(self.renderer.render_cards(card, "poker")[0].key, key)
+
+        self.renderer.save_template("poker", Json(json.dumps({**TEMPLATE, "background": "black"})))
+        self.assertNotEqual(self.renderer.render_cards(card, "poker")[0].key, key)
+
+    def test_failing_cards_are_reported(self):
+        cards = [(Uuid("broken"), Json("{not json")), (Uuid("list"), Json("[]"))] + self.build_cards(1)
+
+        results = self.renderer.render_cards(cards, "poker")
+
+        self.assertEqual([bool(result.error) for result in results], [True, True, False])
+
+    def test_any_drawing_failure_only_fails_its_card(self):
+        # Built around the validation, a text layer whose font size PIL can't use
+        template = CardTemplate(60, 80, layers=[TemplateLayer("text", [0, 0, 60, 80], "name", size="big")])
+        destination = Path(os.path.join(self.temp_dir, "renders", "broken.png"))
+
+        errors = render_card_files(template, [({"name": "Dino"}, {}, destination)], "PNG")
+
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith("CARD_RENDER RENDER - "))
+        self.assertFalse(os.path.exists(destination))
+
+    def test_invalid_templates_are_refused(self):
+        for template in ({"width": 10}, {**TEMPLATE, "background": "not-a-color"},
+                         {**TEMPLATE, "layers": [{"type": "text", "box": [0, 0, 1, 1]}]},
+                         {**TEMPLATE, "layers": [{"type": "spiral", "box": [0, 0, 1, 1]}]},
+                         {**TEMPLATE, "width": 100000}, {**TEMPLATE, "height": 0},
+                         {**TEMPLATE, "layers": [{"type": "text", "box": [0, 0, 1, 1], "field": "a", "size": "big"}]},
+                         {**TEMPLATE, "layers": [{"type": "text", "box": [0, 0, 1, 1], "field": "a", "size": 0}]},
+                         {**TEMPLATE, "layers": [{"type": "box", "box": [0, 0, 1, 1], "color": 5}]},
+                         {**TEMPLATE, "background": ["white"]}):
+            with self.assertRaises(ValueError):
+                CardTemplate.from_json(Json(json.dumps(template)))
+        with self.assertRaises(ValueError):
+            self.renderer.save_template("../escape", Json(json.dumps(TEMPLATE)))
+        self.assertEqual(self.renderer.get_template_names(), ["poker"])
+
+    def test_batches_render_across_a_small_process_pool(self):
+        pool = BoundedPool("images", ProcessPoolExecutor(2), max_pending=2, timeout=60)
+        self.renderer.pool = pool
+        try:
+            results = self.renderer.render_cards(self.build_cards(40), "poker")
+        finally:
+            pool.shutdown()
+
+        self.assertTrue(all(not result.error and os.path.exists(self.renderer.get_render_path(result.key))
+                            for result in results))
@@ -0,0 +1,257 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, skipUnless
+from uuid import UUID
+
+from flask_server.src import Json, Path
+from flask_server.src.card_diff import FieldChange, CARD_ADDED, CARD_MODIFIED, CARD_REMOVED
+from flask_server.src.card_editor import CardEditor
+from flask_server.src.card_set import CardSet
+from flask_server.src.card_storage import FILE_STORAGE, PACK_STORAGE
+from flask_server.src.change_tracker import Observer
+
+
+class TestCardSet(TestCase):
+    def setUp(self):
+        # Create a card set repo scoped to a fresh editor
+        self.temp_dir = tempfile.mkdtemp()
+        self.set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(self.set_path)
+        self.card_set = CardSet(self.set_path, CardSet.create_repo(self.set_path))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+
+    def tearDown(self):
+        self.card_set.close()
+        shutil.rmtree(self.temp_dir)
+
+    def committed_files(self):
+        return sorted(blob.path for blob in self.card_set.repo.head.commit.tree.blobs)
+
+    def test_save_commits_changed_and_removed_cards(self):
+        sun = self.editor.create_card(Json('{"name": "Sun Dino"}'))
+        moon = self.editor.create_card(Json('{"name": "Moon Dino"}'))
+        self.card_set.save_changes("Two cards")
+        self.assertEqual(self.committed_files(), sorted([f"{sun}.json", f"{moon}.json", "settings.json"]))
+
+        self.editor.update_card(sun, Json('{"name": "Sunny Dino"}'))
+        self.editor.delete_card(moon)
+        commit_hash = self.card_set.save_changes("Edited cards")
+
+        self.assertEqual(self.card_set.repo.head.commit.hexsha, commit_hash)
+        self.assertEqual(self.committed_files(), sorted([f"{sun}.json", "settings.json"]))
+        self.assertEqual(self.card_set.repo.head.commit.tree[f"{sun}.json"].data_stream.read(),
+                         b'{"name": "Sunny Dino"}')
+        self.assertFalse(self.card_set.repo.is_dirty(untracked_files=True))
+
+    def test_save_picks_up_external_edits(self):
+        with open(os.path.join(self.set_path, "00000000-0000-0000-0000-000000000001.json"), "w") as file:
+            file.write("{}")
+
+        self.card_set.save_changes("Card added by hand")
+
+        self.assertIn("00000000-0000-0000-0000-000000000001.json", self.committed_files())
+
+    def test_save_without_changes_commits_nothing(self):
+        head = self.card_set.repo.head.commit.hexsha
+
+        self.assertIsNone(self.card_set.save_changes("Nothing"))
+        self.assertEqual(self.card_set.repo.head.commit.hexsha, head)
+
+    def test_reverted_edit_commits_nothing(self):
+        sun = self.editor.create_card(Json('{"name": "Sun Dino"}'))
+        head = self.card_set.save_changes("One card")
+        self.editor.update_card(sun, Json('{"name": "Moon Dino"}'))
+        self.editor.update_card(sun, Json('{"name": "Sun Dino"}'))
+
+        self.assertEqual(self.editor.get_changed_cards(), [])
+        self.assertIsNone(self.card_set.save_changes("Nothing"))
+        self.assertEqual(self.card_set.repo.head.commit.hexsha, head)
+
+
+class TestChangeTracker(TestCase):
+    def setUp(self):
+        # Create a card set repo scoped to a fresh editor
+        self.temp_dir = tempfile.mkdtemp()
+        self.set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(self.set_path)
+        self.card_set = CardSet(self.set_path, CardSet.create_repo(self.set_path))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+
+    def tearDown(self):
+        self.card_set.close()
+        shutil.rmtree(self.temp_dir)
+
+    def committed_files(self):
+        return sorted(blob.path for blob in self.card_set.repo.head.commit.tree.blobs)
+
+    def test_editor_writes_are_tracked_until_saved(self):
+        sun = self.editor.create_card(Json('{"name": "Sun Dino"}'))
+        self.assertEqual(self.editor.get_changed_cards(), [UUID(sun)])
+        self.assertIn(f"{sun}.json", self.card_set.changes.get_dirty_paths())
+
+        self.card_set.save_changes("One card")
+        self.assertEqual(self.editor.get_changed_cards(), [])
+
+        moon = self.editor.create_card(Json('{"name": "Moon Dino"}'))
+        self.editor.update_card(sun, Json('{"name": "Sunny Dino"}'))
+        self.assertCountEqual(self.editor.get_changed_cards(), [UUID(sun), UUID(moon)])
+
+    def test_branch_switch_reconciles_with_git(self):
+        sun = self.editor.create_card(Json('{"name": "Sun Dino"}'))
+        self.card_set.create_branch("SaveFile", "First Card Was Created")
+        self.editor.update_card(sun, Json('{"name": "Moon Dino"}'))
+
+        self.card_set.load_branch("master")
+        self.assertEqual(self.editor.get_changed_cards(), [])
+        self.card_set.load_branch("SaveFile")
+        self.assertEqual(self.editor.get_changed_cards(), [])
+
+    @skipUnless(Observer, "watchdog is not installed")
+    def test_external_edits_are_observed(self):
+        self.assertEqual(self.editor.get_changed_cards(), [])
+        self.assertTrue(self.card_set.changes.is_watching)
+
+        card_name = "00000000-0000-0000-0000-000000000001"
+        with open(os.path.join(self.set_path, f"{card_name}.json"), "w") as file:
+            file.write("{}")
+
+        deadline = time.monotonic() + 5
+        while not self.editor.get_changed_cards() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.editor.get_changed_cards(), [UUID(card_name)])
+        self.card_set.save_changes("Card added by hand")
+        self.assertIn(f"{card_name}.json", self.committed_files())
+
+    @skipUnless(Observer, "watchdog is not installed")
+    def test_observer_skips_the_git_dir_and_follows_new_folders(self):
+        self.editor.get_changed_cards()
+        watches = {(emitter.watch.path, emitter.watch.is_recursive)
+                   for emitter in self.card_set.changes._observer.emitters}
+        self.assertIn((self.set_path, False), watches)
+        self.assertFalse(any(os.path.basename(path) == ".git" for path, _ in watches))
+
+        os.makedirs(os.path.join(self.set_path, "art", "sketches"))
+        with open(os.path.join(self.set_path, "art", "sketches", "sun.txt"), "w") as file:
+            file.write("sketch")
+
+        deadline = time.monotonic() + 5
+        while "art/sketches/sun.txt" not in self.card_set.changes.get_dirty_paths() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIn("art/sketches/sun.txt", self.card_set.changes.get_dirty_paths())
+        self.card_set.save_changes("Sketch added")
+        self.assertIn("art/sketches/sun.txt", [item.path for item in self.card_set.repo.head.commit.tree.traverse()])
+
+
+class TestCommitHistory(TestCase):
+    def setUp(self):
+        # Create a card set repo with a few saves
+        self.temp_dir = tempfile.mkdtemp()
+        self.set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(self.set_path)
+        self.card_set = CardSet(self.set_path, CardSet.create_repo(self.set_path))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+        self.saves = [self.save(f"Save {number}") for number in range(5)]
+
+    def tearDown(self):
+        self.card_set.close()
+        shutil.rmtree(self.temp_dir)
+
+    def save(self, message: str) -> str:
+        self.editor.create_card(Json('{}'))
+        return self.card_set.save_changes(message)
+
+    def test_history_excludes_the_head_and_reaches_the_root(self):
+        commits = self.card_set.get_commit_list("master")
+
+        self.assertEqual([sha for sha, _ in commits], self.saves[3::-1] + [commits[-1][0]])
+        self.assertEqual(commits[0][1], "Save 3")
+        self.assertEqual(commits[-1][1], "Project has started")
+
+    def test_pages_follow_the_before_cursor(self):
+        first = self.card_set.get_commit_list("master", limit=2)
+        second = self.card_set.get_commit_list("master", limit=2, before=first[-1][0])
+
+        self.assertEqual([sha for sha, _ in first + second], self.saves[3::-1])
+        self.assertEqual(len(self.card_set.get_commit_list("master", limit=2, before=second[-1][0])), 1)
+
+    def test_cache_extends_to_new_commits(self):
+        self.card_set.get_commit_list("master")
+        newest = self.save("Save 5")
+        self.card_set.write_commit_graph()
+
+        self.assertEqual(self.card_set.get_commit_list("master", limit=1), [(self.saves[-1], "Save 4")])
+        self.assertEqual(self.card_set.get_commit_list("master", limit=1, before="HEAD"), [(self.saves[-1], "Save 4")])
+        self.assertEqual(self.card_set.get_commit_list("master", before=newest[:10])[-1][1], "Project has started")
+
+    def test_unknown_revisions_raise(self):
+        with self.assertRaises(ValueError):
+            self.card_set.get_commit_list("master", before="0" * 40)
+        with self.assertRaises(ValueError):
+            self.card_set.get_commit_list("missing")
+
+
+class TestCardDiff(TestCase):
+    storage = FILE_STORAGE
+
+    def setUp(self):
+        # Create a card set repo scoped to a fresh editor
+        self.temp_dir = tempfile.mkdtemp()
+        self.set_path = Path(os.path.join(self.temp_dir, "project"))
+        os.mkdir(self.set_path)
+        self.card_set = CardSet(self.set_path, CardSet.create_repo(self.set_path, self.storage))
+        with self.card_set.repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.editor = CardEditor()
+        self.editor.scope_to_set(self.card_set)
+
+    def tearDown(self):
+        self.card_set.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_diff_lists_added_removed_and_modified_cards(self):
+        sun = self.editor.create_card(Json('{"name": "Sun Dino", "stats": {"power": 3, "speed": 1}}'))
+        moon = self.editor.create_card(Json('{"name": "Moon Dino"}'))
+        kept = self.editor.create_card(Json('{"name": "Kept"}'))
+        before = self.card_set.save_changes("Before the patch")
+
+        star = self.editor.create_card(Json('{"name": "Star Bird"}'))
+        self.editor.update_card(sun, Json('{"name": "Sun Dino", "stats": {"power": 5}, "tags": ["fire"]}'))
+        self.editor.delete_card(moon)
+        self.card_set.save_changes("Balance patch")
+
+        diffs = list(self.card_set.diff(before, "master"))
+        self.assertEqual(sorted((diff.card_uuid, diff.change) for diff in diffs),
+                         sorted([(star, CARD_ADDED), (sun, CARD_MODIFIED), (moon, CARD_REMOVED)]))
+        self.assertNotIn(kept, [diff.card_uuid for diff in diffs])
+        self.assertIsNone(diffs[0].fields)
+
+        sun_diff, = [diff for diff in self.card_set.diff(before, "master", fields=True) if diff.card_uuid == sun]
+        self.assertEqual(sun_diff.fields, [FieldChange("stats.power", 3, 5), FieldChange("stats.speed", 1, None),
+                                           FieldChange("tags", None, ["fire"])])
+
+    def test_identical_revisions_have_no_diff(self):
+        self.editor.create_card(Json('{}'))
+        self.card_set.create_branch("SaveFile", "Card")
+
+        self.assertEqual(list(self.card_set.diff("SaveFile", "HEAD")), [])
+        with self.assertRaises(ValueError):
+            self.card_set.diff("missing", "HEAD")
+
+
+class TestPackCardDiff(TestCardDiff):
+    storage = PACK_STORAGE
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from flask_server.src import Path
+from flask_server.src.card_sheets import SheetBuilder, SheetItem, SheetLayout, SHEET_ATLAS
+
+
+class TestSheetBuilder(TestCase):
+    def setUp(self):
+        # Create pictures of a few sizes and colors, and an empty sheets folder
+        self.temp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.temp_dir, "sheets"))
+        self.builder = SheetBuilder(Path(os.path.join(self.temp_dir, "sheets")))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_items(self, sizes, color=(200, 30, 30)):
+        items = []
+        for index, size in enumerate(sizes):
+            path = os.path.join(self.temp_dir, f"item-{index}.png")
+            Image.new("RGB", size, color).save(path)
+            items.append(SheetItem(f"item-{index}", Path(path), f"key-{index}-{color}"))
+        return items
+
+    def test_grid_sheets_hold_columns_by_rows_cells(self):
+        layout = SheetLayout(columns=2, rows=2, cell_width=40, cell_height=60, margin=5, spacing=2, dpi=150)
+
+        manifest = self.builder.build(self.make_items([(40, 60)] * 5), layout)
+
+        self.assertEqual([len(sheet.placements) for sheet in manifest.sheets], [4, 1])
+        sheet = manifest.sheets[0]
+        self.assertEqual((sheet.width, sheet.height), (92, 132))
+        self.assertEqual([(placement.x, placement.y) for placement in sheet.placements],
+                         [(5, 5), (47, 5), (5, 67), (47, 67)])
+        with Image.open(self.builder.get_sheet_path(sheet.key)) as image:
+            self.assertEqual(image.size, (92, 132))
+            self.assertEqual(round(image.info["dpi"][0]), 150)
+            self.assertEqual(image.getpixel((60, 90))[:3], (200, 30, 30))
+            self.assertEqual(image.getpixel((46, 2))[:3], (255, 255, 255))
+
+    def test_atlas_packs_items_without_overlap(self):
+        sizes = [(50, 30), (20, 70), (64, 64), (10, 10), (33, 17), (90, 12), (40, 40), (25, 60)]
+        layout = SheetLayout(mode=SHEET_ATLAS, size=128, padding=1)
+
+        manifest = self.builder.build(self.make_items(sizes), layout)
+
+        placements = [placement for sheet in manifest.sheets for placement in sheet.placements]
+        self.assertEqual(sorted(placement.name for placement in placements), sorted(f"item-{i}" for i in range(8)))
+        for sheet in manifest.sheets:
+            self.assertTrue(sheet.width <= 128 and sheet.width & (sheet.width - 1) == 0)
+            self.assertTrue(sheet.height <= 128 and sheet.height & (sheet.height - 1) == 0)
+            for index, first in enumerate(sheet.placements):
+                self.assertTrue(first.x + first.width <= sheet.width and first.y + first.height <= sheet.height)
+                self.assertAlmostEqual(first.u1, (first.x + first.width) / sheet.width)
+                for second in sheet.placements[index + 1:]:
+                    self.assertTrue(first.x + first.width <= second.x or second.x + second.width <= first.x
+                                    or first.y + first.height <= second.y or second.y + second.height <= first.y)
+
+    def test_atlas_overflow_starts_new_sheets_and_skips_oversized_items(self):
+        layout = SheetLayout(mode=SHEET_ATLAS, size=64, padding=0, scale=0.5)
+
+        manifest = self.builder.build(self.make_items([(128, 128)] * 3 + [(200, 40)]), layout)
+
+        self.assertEqual([len(sheet.placements) for sheet in manifest.sheets], [1, 1, 1])
+        self.assertEqual(manifest.skipped, ["item-3"])
+        self.assertEqual(manifest.sheets[0].placements[0].width, 64)
+
+    def test_unchanged_sheets_are_reused(self):
+        layout = SheetLayout(columns=2, rows=1, cell_width=20, cell_height=20)
+        items = self.make_items([(20, 20)] * 4)
+        first = self.builder.build(items, layout)
+
+        items[3].key = "edited"
+        second = self.builder.build(items, layout)
+
+        self.assertEqual([sheet.cached for sheet in second.sheets], [True, False])
+        self.assertEqual(first.sheets[0].key, second.sheets[0].key)
+
+    def test_invalid_layouts_are_refused(self):
+        for layout in ({"mode": "spiral"}, {"size": 1000}, {"columns": 0}, {"margin": -1}, {"colour": "red"},
+                       {"background": "not-a-color"}, {"cell_width": 100000}):
+            with self.assertRaises(ValueError):
+                SheetLayout.from_dict(layout)
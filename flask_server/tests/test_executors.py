@@ -0,0 +1,32 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from flask_server.src.executors import BoundedPool, PoolBusyError
+
+
+class TestBoundedPool(TestCase):
+    def setUp(self):
+        self.pool = BoundedPool("test", ThreadPoolExecutor(1), max_pending=2, timeout=5)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def test_pool_refuses_work_past_its_limit(self):
+        futures = [self.pool.submit(self.release.wait) for _ in range(2)]
+        with self.assertRaises(PoolBusyError):
+            self.pool.submit(self.release.wait)
+
+        self.release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(self.pool.run(sum, [1, 2]), 3)
+
+    def test_slow_tasks_time_out_and_keep_running(self):
+        with self.assertRaises(TimeoutError):
+            self.pool.run(self.release.wait, timeout=0.1)
+
+        self.release.set()
+        self.assertEqual(self.pool.run(len, "done"), 4)
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import TestCase
+
+from PIL import Image
+
+from flask_server.src import Path
+from flask_server.src.executors import BoundedPool, PoolBusyError
+from flask_server.src.images import ImageBank
+from flask_server.src.image_import import ImageImporter, collect_sources
+
+
+class TestImageImporter(TestCase):
+    def setUp(self):
+        # Create a bank folder and a drop folder with a few images and a broken file
+        self.temp_dir = tempfile.mkdtemp()
+        self.bank_path = os.path.join(self.temp_dir, "images")
+        self.drop_path = os.path.join(self.temp_dir, "drop")
+        os.mkdir(self.bank_path)
+        os.mkdir(self.drop_path)
+        for index in range(3):
+            Image.new('RGB', (32, 32), (index * 50, 0, 0)).save(os.path.join(self.drop_path, f"art_{index}.jpg"))
+        Image.new('RGB', (16, 8)).save(os.path.join(self.drop_path, "art_png.png"))
+        with open(os.path.join(self.drop_path, "broken.jpg"), "wb") as file:
+            file.write(b"not an image")
+        self.bank = ImageBank(Path(self.bank_path))
+
+    def tearDown(self):
+        self.bank.catalog.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_import_directory_reports_per_image(self):
+        progress = []
+        report = ImageImporter(self.bank, workers=1).import_images(
+            Path(self.drop_path), on_progress=lambda done, total, result: progress.append((done, total)))
+
+        self.assertEqual((report.imported, report.failed), (4, 1))
+        self.assertEqual(progress[-1], (5, 5))
+        failure, = [result for result in report.results if result.error]
+        self.assertTrue(failure.source.endswith("broken.jpg"))
+
+        names = sorted(data.file_name for data in self.bank.compile_image_list().values())
+        self.assertEqual(names, ["art_0", "art_1", "art_2", "art_png"])
+        self.assertEqual(len([name for name in os.listdir(self.bank_path) if name.endswith(".jpg")]), 4)
+
+    def test_import_zip_with_process_pool(self):
+        archive_path = os.path.join(self.temp_dir, "drop.zip")
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            for index in range(40):
+                archive.write(os.path.join(self.drop_path, "art_0.jpg"), f"set/card_{index}.jpg")
+
+        pool = BoundedPool("images", ProcessPoolExecutor(2), max_pending=1, timeout=60)
+        try:
+            report = ImageImporter(self.bank, workers=2, pool=pool).import_images(Path(archive_path))
+        finally:
+            pool.shutdown()
+
+        self.assertEqual((report.imported, report.failed), (40, 0))
+        self.assertEqual(len(self.bank.compile_image_list()), 40)
+        self.assertGreater(report.images_per_second, 0)
+
+    def test_import_is_refused_while_the_pool_is_full(self):
+        pool = BoundedPool("images", ThreadPoolExecutor(1), max_pending=1, timeout=5)
+        release = threading.Event()
+        try:
+            pool.submit(release.wait)
+            with self.assertRaises(PoolBusyError):
+                ImageImporter(self.bank, pool=pool).import_images(Path(self.drop_path))
+        finally:
+            release.set()
+            pool.shutdown()
+        self.assertEqual(self.bank.compile_image_list(), {})
+
+    def test_collect_sources_with_pattern(self):
+        sources = collect_sources(Path(os.path.join(self.drop_path, "art_*.jpg")))
+        self.assertEqual([source.name for source in sources], ["art_0", "art_1", "art_2"])
+
+        sources = collect_sources(Path(self.drop_path), "*.png")
+        self.assertEqual([source.name for source in sources], ["art_png"])
+
+    def test_deduplicated_import_skips_known_content(self):
+        shutil.copy(os.path.join(self.drop_path, "art_0.jpg"), os.path.join(self.drop_path, "art_copy.jpg"))
+        existing_uuid, _ = self.bank.import_image(Path(os.path.join(self.drop_path, "art_1.jpg")))
+
+        report = ImageImporter(self.bank, workers=1).import_images(Path(self.drop_path), deduplicate=True)
+
+        self.assertEqual((report.imported, report.duplicates, report.failed), (3, 2, 1))
+        results = {os.path.basename(result.source): result for result in report.results}
+        self.assertEqual(results["art_1.jpg"].uuid, str(existing_uuid))
+        self.assertEqual(results["art_copy.jpg"].uuid, results["art_0.jpg"].uuid)
+        self.assertEqual(len(self.bank.compile_image_list()), 4)
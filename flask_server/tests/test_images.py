@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import piexif
+from PIL import Image
+
+from flask_server.src import Path
+from flask_server.src.images import (ImageBank, ImageData, EXIF_TAG_ORIGINAL_RAW_FILE_NAME, hash_image, ingest_image,
+                                     _dump_exif)
+
+
+class TestImageBank(TestCase):
+    def setUp(self):
+        # Create a temporary bank folder and a sample image to import
+        self.temp_dir = tempfile.mkdtemp()
+        self.bank_path = os.path.join(self.temp_dir, "images")
+        os.mkdir(self.bank_path)
+        self.sample_path = os.path.join(self.temp_dir, "sample.jpg")
+        Image.new('RGB', (120, 80), (200, 30, 30)).save(self.sample_path)
+        self.bank = ImageBank(Path(self.bank_path))
+
+    def tearDown(self):
+        self.bank.catalog.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_import_image_is_cataloged(self):
+        image_uuid, image_data = self.bank.import_image(Path(self.sample_path), "sample_image")
+
+        entry = self.bank.catalog.get(str(image_uuid))
+        self.assertEqual(entry.file_name, "sample_image")
+        self.assertEqual((entry.width, entry.height), (120, 80))
+        self.assertEqual(self.bank.compile_image_list(), {str(image_uuid): ImageData("sample_image")})
+
+    def test_write_image_metadata_updates_catalog(self):
+        image_uuid, _ = self.bank.import_image(Path(self.sample_path), "sample_image")
+        self.bank.write_image_metadata(image_uuid, ImageData("renamed", '{"tag": 1}'))
+
+        self.assertEqual(self.bank.read_image_metadata(image_uuid), ImageData("renamed", '{"tag": 1}'))
+
+    def test_delete_image_removes_catalog_entry(self):
+        image_uuid, _ = self.bank.import_image(Path(self.sample_path), "sample_image")
+        self.bank.delete_image(image_uuid)
+
+        self.assertEqual(self.bank.compile_image_list(), {})
+
+    def test_reconcile_repairs_catalog_from_folder(self):
+        image_uuid, _ = self.bank.import_image(Path(self.sample_path), "sample_image")
+        self.bank.write_image_metadata(image_uuid, ImageData("sample_image", '{"kept": true}'))
+        self.bank.catalog.close()
+
+        # Drop a file behind the bank's back and delete the cataloged one
+        stray_path = os.path.join(self.bank_path, "00000000-0000-0000-0000-000000000001.jpg")
+        shutil.copy(self.sample_path, stray_path)
+        os.utime(self.bank.get_image_path(image_uuid))
+
+        self.bank = ImageBank(Path(self.bank_path))
+        images = self.bank.compile_image_list()
+
+        self.assertIn("00000000-0000-0000-0000-000000000001", images)
+        self.assertEqual(images[str(image_uuid)], ImageData("sample_image", '{"kept": true}'))
+
+        os.remove(stray_path)
+        self.bank.reconcile()
+        self.assertNotIn("00000000-0000-0000-0000-000000000001", self.bank.compile_image_list())
+
+    def test_write_image_metadata_keeps_pixels_intact(self):
+        image_uuid, _ = self.bank.import_image(Path(self.sample_path), "sample_image")
+        path = self.bank.get_image_path(image_uuid)
+        with Image.open(path) as image:
+            original_pixels = image.tobytes()
+
+        for index in range(5):
+            self.bank.write_image_metadata(image_uuid, ImageData(f"rename {index}"))
+
+        with Image.open(path) as image:
+            self.assertEqual(image.tobytes(), original_pixels)
+        self.assertEqual(self.bank._read_file_metadata(image_uuid).file_name, "rename 4")
+        self.assertEqual([name for name in os.listdir(self.bank_path) if name.endswith(".tmp")], [])
+
+    def test_tags_that_cant_be_encoded_are_dropped_alone(self):
+        exif_dict = {"0th": {piexif.ImageIFD.Make: b"Canon", piexif.ImageIFD.ImageWidth: "wide"},
+                     "Exif": {piexif.ExifIFD.DateTimeOriginal: b"2020:01:01 00:00:00"}, "GPS": {}}
+
+        stamped = piexif.load(_dump_exif(exif_dict, ImageData("sample_image")))
+
+        self.assertEqual(stamped["0th"][piexif.ImageIFD.Make], b"Canon")
+        self.assertNotIn(piexif.ImageIFD.ImageWidth, stamped["0th"])
+        self.assertEqual(bytes(stamped["0th"][EXIF_TAG_ORIGINAL_RAW_FILE_NAME]), b"sample_image")
+        self.assertEqual(stamped["Exif"][piexif.ExifIFD.DateTimeOriginal], b"2020:01:01 00:00:00")
+
+    def test_interop_tags_survive_a_fallback_encoding(self):
+        exif_dict = {"0th": {piexif.ImageIFD.ImageWidth: "wide"}, "Exif": {}, "GPS": {},
+                     "Interop": {piexif.InteropIFD.InteroperabilityIndex: b"R98"}}
+
+        stamped = piexif.load(_dump_exif(exif_dict, ImageData("sample_image")))
+
+        self.assertNotIn(piexif.ImageIFD.ImageWidth, stamped["0th"])
+        self.assertEqual(stamped["Interop"][piexif.InteropIFD.InteroperabilityIndex], b"R98")
+
+    def test_import_converts_non_jpeg_images(self):
+        png_path = os.path.join(self.temp_dir, "sample.png")
+        Image.new('RGBA', (16, 16)).save(png_path)
+
+        image_uuid, image_data = self.bank.import_image(Path(png_path))
+
+        self.assertEqual(image_data.file_name, "sample")
+        with Image.open(self.bank.get_image_path(image_uuid)) as image:
+            self.assertEqual(image.format, "JPEG")
+
+    def test_deduplicated_import_returns_existing_image(self):
+        image_uuid, _ = self.bank.import_image(Path(self.sample_path), "sample_image")
+        self.bank.write_image_metadata(image_uuid, ImageData("renamed"))
+
+        duplicate_uuid, duplicate_data = self.bank.import_image(Path(self.sample_path), "copy", deduplicate=True)
+
+        self.assertEqual(duplicate_uuid, image_uuid)
+        self.assertEqual(duplicate_data.file_name, "renamed")
+        self.assertEqual(len(self.bank.compile_image_list()), 1)
+
+    def test_outside_edits_drop_the_imported_digest(self):
+        image_uuid, _ = self.bank.import_image(Path(self.sample_path), "sample_image")
+        self.bank.write_image_metadata(image_uuid, ImageData("renamed"))
+        content_key = self.bank.get_content_key(image_uuid)
+        self.assertEqual(self.bank.catalog.get(str(image_uuid)).digest, content_key)
+
+        Image.new('RGB', (16, 16), (200, 20, 10)).save(self.bank.get_image_path(image_uuid))
+        self.bank.reconcile()
+
+        self.assertEqual(self.bank.catalog.get(str(image_uuid)).digest, "")
+        self.assertNotEqual(self.bank.get_content_key(image_uuid), content_key)
+        self.assertIsNone(self.bank.find_duplicate(content_key))
+
+    def test_known_digest_is_not_computed_again(self):
+        with open(self.sample_path, "rb") as source:
+            digest = hash_image(source)
+        destination = Path(os.path.join(self.bank_path, "00000000-0000-0000-0000-000000000002.jpg"))
+
+        with open(self.sample_path, "rb") as source:
+            self.assertEqual(ingest_image(source, destination, ImageData("sample")).digest, digest)
+        with open(self.sample_path, "rb") as source:
+            self.assertEqual(ingest_image(source, destination, ImageData("sample"), "given").digest, "given")
+
+        image_uuid, _ = self.bank.import_image(Path(self.sample_path), "sample_image", deduplicate=True)
+        self.assertEqual(self.bank.catalog.get(str(image_uuid)).digest, digest)
+
+    def test_digest_index_survives_restart(self):
+        image_uuid, _ = self.bank.import_image(Path(self.sample_path), "sample_image")
+        self.bank.catalog.close()
+
+        self.bank = ImageBank(Path(self.bank_path))
+        duplicate_uuid, _ = self.bank.import_image(Path(self.sample_path), deduplicate=True)
+
+        self.assertEqual(duplicate_uuid, image_uuid)
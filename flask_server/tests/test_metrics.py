@@ -0,0 +1,79 @@
+import contextlib
+import io
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask_server.src import Path
+from flask_server.src.card_set import CardSet
+from flask_server.src.metrics import Metrics, metrics, KIND_GIT, KIND_IMAGE
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.metrics = Metrics(enabled=True, slow_seconds=None)
+
+    def test_disabled_metrics_record_nothing(self):
+        self.metrics.configure(enabled=False)
+        calls = []
+
+        @self.metrics.instrument(KIND_IMAGE)
+        def load(name):
+            calls.append(name)
+            return name
+
+        self.assertEqual(load("sun"), "sun")
+        with self.metrics.timed(KIND_IMAGE, "block"):
+            pass
+        self.assertEqual(calls, ["sun"])
+        self.assertNotIn("_count{", self.metrics.render_prometheus())
+
+    def test_histograms_are_rendered_cumulated(self):
+        for seconds in (0.0005, 0.003, 0.003, 20.0):
+            self.metrics.observe(KIND_GIT, 'say "hi"', seconds)
+
+        text = self.metrics.render_prometheus()
+
+        labels = 'kind="git",name="say \\"hi\\""'
+        self.assertIn(f'card_designer_operation_seconds_bucket{{{labels},le="0.001"}} 1', text)
+        self.assertIn(f'card_designer_operation_seconds_bucket{{{labels},le="0.005"}} 3', text)
+        self.assertIn(f'card_designer_operation_seconds_bucket{{{labels},le="10.0"}} 3', text)
+        self.assertIn(f'card_designer_operation_seconds_bucket{{{labels},le="+Inf"}} 4', text)
+        self.assertIn(f'card_designer_operation_seconds_count{{{labels}}} 4', text)
+        self.assertIn(f'card_designer_operation_errors_total{{{labels}}} 0', text)
+
+    def test_slow_calls_are_logged_with_their_arguments(self):
+        self.metrics.configure(slow_seconds=0)
+
+        class Bank:
+            @self.metrics.instrument(KIND_IMAGE)
+            def rename(self, image_uuid, name=""):
+                raise ValueError("missing")
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(ValueError):
+            Bank().rename("1234", name="x" * 500)
+
+        line = output.getvalue()
+        self.assertIn("METRICS SLOW - image", line)
+        self.assertIn("Bank.rename", line)
+        self.assertIn("and failed ('1234', name='xxx", line)
+        self.assertIn("...", line)
+        self.assertNotIn("Bank object", line)
+        self.assertIn('errors_total{kind="image",name="TestMetrics.test_slow_calls_are_logged_with_their_arguments.'
+                      '<locals>.Bank.rename"} 1', self.metrics.render_prometheus())
+
+    def test_git_commands_are_timed_by_subcommand(self):
+        temp_dir = tempfile.mkdtemp()
+        metrics.configure(enabled=True, slow_seconds=None)
+        try:
+            metrics.reset()
+            CardSet(Path(temp_dir), CardSet.create_repo(temp_dir)).close()
+            text = metrics.render_prometheus()
+        finally:
+            metrics.configure(enabled=False, slow_seconds=1.0)
+            metrics.reset()
+            shutil.rmtree(temp_dir)
+
+        self.assertIn('seconds_count{kind="git",name="git init"} 1', text)
+        self.assertIn('seconds_count{kind="git",name="CardSet.create_repo"} 1', text)
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from flask_server.src import Path, Project
+from flask_server.src.registry import Registry
+
+
+class TestRegistryPool(TestCase):
+    def setUp(self):
+        # Create a registry holding a few projects
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry = Registry(Path(self.temp_dir), max_open=2)
+        for name in ("sun", "moon", "star"):
+            self.registry.create_project(Project(name)).close()
+
+    def tearDown(self):
+        self.registry.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_listing_skips_folders_without_repo(self):
+        os.mkdir(os.path.join(self.temp_dir, "not_a_project"))
+        open(os.path.join(self.temp_dir, "notes.txt"), "w").close()
+
+        self.assertCountEqual(self.registry.get_project_names(), ["sun", "moon", "star"])
+        with self.assertRaises(ValueError):
+            self.registry.get_project(Project("not_a_project"))
+        with self.assertRaises(FileNotFoundError):
+            self.registry.get_project(Project("missing"))
+
+    def test_open_projects_are_reused(self):
+        sun = self.registry.get_project(Project("sun"))
+
+        self.assertIs(self.registry.get_project(Project("sun")), sun)
+        self.assertEqual(sun.get_branches(), ["master"])
+
+    def test_least_recently_used_project_is_closed_over_the_limit(self):
+        sun = self.registry.get_project(Project("sun"))
+        moon = self.registry.get_project(Project("moon"))
+        self.registry.get_project(Project("sun"))
+        self.registry.get_project(Project("star"))
+
+        self.assertIs(self.registry.get_project(Project("sun")), sun)
+        self.assertIsNot(self.registry.get_project(Project("moon")), moon)
+
+    def test_idle_projects_are_closed(self):
+        sun = self.registry.get_project(Project("sun"))
+        self.registry.idle_seconds = 0
+
+        self.registry.close_idle_projects()
+
+        self.registry.idle_seconds = 60
+        self.assertIsNot(self.registry.get_project(Project("sun")), sun)
+
+    def test_idle_projects_are_closed_without_requests(self):
+        registry = Registry(Path(self.temp_dir), idle_seconds=0.1, sweep_seconds=0.05)
+        try:
+            sun = registry.get_project(Project("sun"))
+
+            deadline = time.monotonic() + 5
+            while len(registry._open) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(len(registry._open), 0)
+            self.assertIsNot(registry.get_project(Project("sun")), sun)
+        finally:
+            registry.close()
+
+    def test_deleted_project_leaves_the_pool(self):
+        self.registry.get_project(Project("star"))
+        self.registry.delete_project(Project("star"))
+
+        self.assertCountEqual(self.registry.get_project_names(), ["sun", "moon"])
+        with self.assertRaises(FileNotFoundError):
+            self.registry.get_project(Project("star"))
@@ -0,0 +1,268 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from PIL import Image
+
+from flask_server.routes import app, manager
+from flask_server.src import Json, Path
+from flask_server.src.card_editor import CardEditor
+from flask_server.src.executors import BoundedPool
+from flask_server.src.metrics import metrics
+
+
+class RouteTestCase(TestCase):
+    """ Runs the app against a temporary app folder, with a project opened as the default one """
+    project = "routes"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        manager.executors.shutdown()
+        manager.registry.close()
+        manager.app_folder = Path(cls.temp_dir)
+        for name in ("images", "sets", "thumbnails", "templates", "renders", "sheets"):
+            setattr(manager, f"{name}_folder", Path(os.path.join(cls.temp_dir, name)))
+        manager.initialize()
+
+    @classmethod
+    def tearDownClass(cls):
+        manager.executors.shutdown()
+        manager.registry.close()
+        manager.image_bank.catalog.close()
+        shutil.rmtree(cls.temp_dir)
+
+    def setUp(self):
+        self.client = app.test_client()
+        response = self.client.post("/registry", json={"project_name": self.project})
+        self.assertEqual(response.status_code, 201)
+        with manager.registry.get_project(self.project).repo.config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+
+    def tearDown(self):
+        manager.registry.delete_project(self.project)
+
+
+class TestProjectRoute(RouteTestCase):
+    def setUp(self):
+        super().setUp()
+        # A second project on its own branch, so answers tell which project served them
+        self.client.post("/registry", json={"project_name": "other"})
+        other = manager.registry.get_project("other")
+        other.repo.create_head("other-branch").checkout()
+        self.client.post(f"/registry/{self.project}")
+
+    def tearDown(self):
+        manager.registry.delete_project("other")
+        super().tearDown()
+
+    def get_branch(self, url: str = "/project", **kwargs) -> str:
+        response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()["active_branch"]
+
+    def test_requests_name_their_project(self):
+        default_branch = manager.registry.get_project(self.project).get_active_branch()
+
+        self.assertEqual(self.get_branch(headers={"X-Project": "other"}), "other-branch")
+        self.assertEqual(self.get_branch("/project?project=other"), "other-branch")
+        self.assertEqual(self.get_branch(), default_branch)
+        self.assertEqual(self.get_branch("/project?project=other", headers={"X-Project": self.project}),
+                         default_branch)
+
+    def test_unknown_project_is_not_found(self):
+        self.assertEqual(self.client.get("/project", headers={"X-Project": "missing"}).status_code, 404)
+        self.assertEqual(self.client.get("/project?project=missing").status_code, 404)
+
+    def test_full_and_slow_git_pool_are_mapped(self):
+        git_pool = manager.executors.git
+        release = threading.Event()
+        manager.executors.git = BoundedPool("git", ThreadPoolExecutor(1), max_pending=2, timeout=0.2)
+        try:
+            manager.executors.git.submit(release.wait)
+
+            timed_out = self.client.open("/project/other-branch", method="LOAD_BRANCH",
+                                         headers={"X-Project": "other"})
+            self.assertEqual(timed_out.status_code, 504)
+
+            busy = self.client.open("/project/other-branch", method="LOAD_BRANCH", headers={"X-Project": "other"})
+            self.assertEqual(busy.status_code, 503)
+            self.assertEqual(busy.headers["Retry-After"], "1")
+        finally:
+            release.set()
+            manager.executors.git.shutdown()
+            manager.executors.git = git_pool
+
+
+class TestMetricsRoutes(RouteTestCase):
+    def test_switches_must_be_booleans(self):
+        settings = (metrics.enabled, metrics.slow_seconds, metrics.profiling)
+        try:
+            for body in ([], {"enabled": "no"}, {"enabled": 0}, {"profiling": "yes"}, {"slow_seconds": "1"}):
+                response = self.client.put("/metrics/config", json=body)
+                self.assertEqual(response.status_code, 400, body)
+            self.assertEqual((metrics.enabled, metrics.slow_seconds, metrics.profiling), settings)
+
+            response = self.client.put("/metrics/config", json={"enabled": None, "profiling": False})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()["profiling"], False)
+        finally:
+            metrics.configure(*settings)
+
+
+class TestImageRoutes(RouteTestCase):
+    def test_bulk_import_checks_its_workers(self):
+        source = os.path.join(self.temp_dir, "empty")
+        os.makedirs(source, exist_ok=True)
+
+        for workers in (0, -1, "4", 1.5, True):
+            response = self.client.post("/images/bulk", json={"source": source, "workers": workers})
+            self.assertEqual(response.status_code, 400, workers)
+        self.assertEqual(self.client.post("/images/bulk", json={"workers": 2}).status_code, 400)
+
+        for workers in (None, 1, 100000):
+            body = {"source": source} if workers is None else {"source": source, "workers": workers}
+            response = self.client.post("/images/bulk", json=body)
+            self.assertEqual(response.status_code, 201, workers)
+
+
+class TestRawImageRoute(RouteTestCase):
+    def setUp(self):
+        super().setUp()
+        sample_path = os.path.join(self.temp_dir, "sample.jpg")
+        Image.new("RGB", (64, 32), (10, 120, 200)).save(sample_path)
+        self.image_uuid, _ = manager.image_bank.import_image(Path(sample_path), "sample")
+        self.url = f"/images/{self.image_uuid}/raw"
+
+    def tearDown(self):
+        manager.image_bank.delete_image(self.image_uuid)
+        super().tearDown()
+
+    def test_image_is_served_with_validators(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "image/jpeg")
+        with open(manager.image_bank.get_image_path(self.image_uuid), "rb") as file:
+            self.assertEqual(response.data, file.read())
+        self.assertTrue(response.headers["ETag"])
+        self.assertTrue(response.headers["Last-Modified"])
+
+    def test_unchanged_image_is_not_sent_again(self):
+        first = self.client.get(self.url)
+
+        by_etag = self.client.get(self.url, headers={"If-None-Match": first.headers["ETag"]})
+        by_date = self.client.get(self.url, headers={"If-Modified-Since": first.headers["Last-Modified"]})
+
+        self.assertEqual((by_etag.status_code, by_etag.data), (304, b""))
+        self.assertEqual((by_date.status_code, by_date.data), (304, b""))
+
+    def test_byte_ranges_are_served(self):
+        whole = self.client.get(self.url).data
+
+        response = self.client.get(self.url, headers={"Range": "bytes=0-9"})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, whole[:10])
+        self.assertEqual(response.headers["Content-Range"], f"bytes 0-9/{len(whole)}")
+
+    def test_unknown_and_malformed_uuids_are_not_found(self):
+        self.assertEqual(self.client.get("/images/00000000-0000-0000-0000-000000000000/raw").status_code, 404)
+        self.assertEqual(self.client.get("/images/not-a-uuid/raw").status_code, 404)
+
+
+class TestSaveRoutes(RouteTestCase):
+    def test_queued_save_is_committed_before_a_branch_is_loaded(self):
+        card_set = manager.registry.get_project(self.project)
+        branch = card_set.get_active_branch()
+        card_set.repo.create_head("other")
+        card_uuid = manager.sessions.get_session(self.project).editor.create_card(Json('{"name": "Dino"}'))
+
+        job_id = self.client.open("/project", method="SAVE", json={"message": "Autosave"}).get_json()["job"]
+        self.assertEqual(self.client.open("/project/other", method="LOAD_BRANCH").status_code, 200)
+
+        job = manager.saves.wait(job_id, 5)
+        self.assertEqual(job.status, "done")
+        self.assertEqual(card_set.repo.heads[branch].commit.hexsha, job.commit)
+        self.client.open(f"/project/{branch}", method="LOAD_BRANCH")
+        self.assertEqual(self.client.get(f"/project/cards/{card_uuid}").status_code, 200)
+
+
+class TestCardRoutes(RouteTestCase):
+    def test_malformed_queries_are_bad_requests(self):
+        for body in ([], {"filters": {"cost": {"min": "low"}}}, {"filters": {"Type": {"in": "Dino"}}},
+                     {"offset": -1}, {"limit": "10"}):
+            response = self.client.post("/project/cards/query", json=body)
+            self.assertEqual(response.status_code, 400, body)
+
+        response = self.client.post("/project/cards/query", json={"filters": {"cost": {"min": 0}}, "limit": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"total": 0, "cards": []})
+
+    def test_malformed_batches_are_bad_requests(self):
+        for body in ([], {"operations": [1]}, {"operations": {"action": "create"}}, {"operations": "create"},
+                     {"operations": [{"action": "spin"}]}):
+            response = self.client.post("/project/cards/batch", json=body)
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(self.client.post("/project/cards/batch", data="not json").status_code, 400)
+
+        response = self.client.post("/project/cards/batch", json={"operations": [{"action": "create", "data": "{}"}]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.get_json()["uuids"]), 1)
+
+
+class TestStreamRoutes(RouteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = manager.sessions.get_session(self.project)
+        for index in range(2):
+            self.session.editor.create_card(Json(json.dumps({"name": f"Dino {index}"})))
+            self.session.card_set.save_changes(f"Card {index}")
+
+    def read_first_line(self, url: str):
+        response = self.client.get(url, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        first = next(iter(response.response))
+        return response, first
+
+    def test_pinned_streams_leave_the_card_set_free(self):
+        for url in ("/project/diff?from=HEAD~1&to=HEAD", "/project/export?rev=HEAD&images=false"):
+            response, first = self.read_first_line(url)
+            try:
+                self.assertTrue(first, url)
+                self.assertFalse(self.session.card_set.lock.is_held, url)
+            finally:
+                response.close()
+
+    def test_working_tree_export_shares_the_card_set_until_done(self):
+        response, _ = self.read_first_line("/project/export?images=false")
+        try:
+            self.assertTrue(self.session.card_set.lock.is_held)
+        finally:
+            response.close()
+        self.assertFalse(self.session.card_set.lock.is_held)
+
+
+class TestHistoryRoutes(RouteTestCase):
+    def test_commit_pages_check_their_limit_and_cursor(self):
+        card_set = manager.registry.get_project(self.project)
+        editor = CardEditor()
+        editor.scope_to_set(card_set)
+        for index in range(3):
+            editor.create_card(Json(json.dumps({"name": f"Dino {index}"})))
+            card_set.save_changes(f"Card {index}")
+        branch = card_set.get_active_branch()
+
+        for query in ("limit=0", "limit=-1", "limit=two", "limit=1.5", "before=nothere", "before=1234abcd"):
+            response = self.client.open(f"/project/{branch}?{query}", method="LIST")
+            self.assertEqual(response.status_code, 400, query)
+
+        page = self.client.open(f"/project/{branch}?limit=2", method="LIST").get_json()
+        self.assertEqual(len(page["branches"]), 2)
+        rest = self.client.open(f"/project/{branch}?limit=2&before={page['next']}", method="LIST").get_json()
+        self.assertNotIn(rest["branches"][0], page["branches"])
@@ -0,0 +1,148 @@
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from flask_server.src import Json, Path, Project
+from flask_server.src.executors import BoundedPool
+from flask_server.src.locks import ReadWriteLock
+from flask_server.src.registry import Registry
+from flask_server.src.save_queue import SaveQueue, JOB_DONE, JOB_FAILED
+from flask_server.src.sessions import SessionPool
+
+
+class TestReadWriteLock(TestCase):
+    def test_readers_share_and_writers_wait(self):
+        lock = ReadWriteLock()
+        reading = threading.Event()
+        written = threading.Event()
+
+        def write():
+            with lock.write():
+                written.set()
+
+        with lock.read():
+            with lock.read():
+                reading.set()
+            writer = threading.Thread(target=write)
+            writer.start()
+            self.assertFalse(written.wait(0.2))
+            self.assertTrue(lock.is_held)
+
+        writer.join(5)
+        self.assertTrue(written.is_set())
+        self.assertFalse(lock.is_held)
+
+
+class TestSessionPool(TestCase):
+    def setUp(self):
+        # Create a registry holding two projects
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry = Registry(Path(self.temp_dir))
+        for name in ("sun", "moon"):
+            with self.registry.create_project(Project(name)).config_writer() as config:
+                config.set_value("user", "name", "Card Designer")
+                config.set_value("user", "email", "designer@example.com")
+        self.sessions = SessionPool(self.registry)
+
+    def tearDown(self):
+        self.registry.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_sessions_follow_their_project(self):
+        sun = self.sessions.get_session(Project("sun"))
+
+        self.assertIs(self.sessions.get_session(Project("sun")), sun)
+        self.assertIsNot(self.sessions.get_session(Project("moon")).card_set, sun.card_set)
+
+        self.registry.close()
+        self.assertIsNot(self.sessions.get_session(Project("sun")), sun)
+
+    def test_concurrent_edits_and_saves(self):
+        def edit(project: str, index: int):
+            session = self.sessions.get_session(Project(project))
+            with session.reading():
+                session.editor.create_card(Json(f'{{"cost": {index}}}'))
+            if index % 10 == 0:
+                with session.mutating():
+                    session.card_set.save_changes(f"Save {index}")
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(edit, ["sun", "moon"] * 20, range(40)))
+
+        for project in ("sun", "moon"):
+            session = self.sessions.get_session(Project(project))
+            with session.mutating():
+                session.card_set.save_changes("Last save")
+            self.assertEqual(len(session.editor.get_card_list()), 20)
+            self.assertEqual(len(session.editor.get_card_list(rev="HEAD")), 20)
+            self.assertEqual(session.editor.get_changed_cards(), [])
+
+
+class TestSaveQueue(TestCase):
+    def setUp(self):
+        # Create a registry holding one project and a queue with a short window
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry = Registry(Path(self.temp_dir))
+        with self.registry.create_project(Project("sun")).config_writer() as config:
+            config.set_value("user", "name", "Card Designer")
+            config.set_value("user", "email", "designer@example.com")
+        self.sessions = SessionPool(self.registry)
+        self.pool = BoundedPool("git", ThreadPoolExecutor(2))
+        self.saves = SaveQueue(self.sessions, self.pool, window=0.2)
+        self.session = self.sessions.get_session(Project("sun"))
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.registry.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_saves_within_the_window_coalesce(self):
+        head = self.session.card_set.repo.head.commit
+        self.session.editor.create_card(Json('{}'))
+        first = self.saves.enqueue(Project("sun"), "Autosave 1")
+        self.session.editor.create_card(Json('{}'))
+        second = self.saves.enqueue(Project("sun"), "Autosave 2")
+
+        self.assertIs(second, first)
+        job = self.saves.wait(first.job_id, 5)
+
+        self.assertEqual((job.status, job.saves), (JOB_DONE, 2))
+        commit = self.session.card_set.repo.head.commit
+        self.assertEqual((commit.hexsha, commit.message, commit.parents), (job.commit, "Autosave 2", (head,)))
+        self.assertEqual(self.session.editor.get_changed_cards(), [])
+
+    def test_saves_after_a_job_started_get_a_new_job(self):
+        first = self.saves.wait(self.saves.enqueue(Project("sun"), "Nothing changed").job_id, 5)
+        second = self.saves.enqueue(Project("sun"), "Still nothing")
+
+        self.assertIsNone(first.commit)
+        self.assertNotEqual(first.job_id, second.job_id)
+        self.assertIs(self.saves.get_job(second.job_id), second)
+        self.assertEqual(self.saves.wait(second.job_id, 5).status, JOB_DONE)
+
+    def test_flushed_saves_commit_before_the_swap(self):
+        card_set = self.session.card_set
+        card_set.repo.create_head("other")
+        self.session.editor.create_card(Json('{}'))
+        job = self.saves.enqueue(Project("sun"), "Autosave")
+
+        with self.session.mutating():
+            self.assertIs(self.saves.flush(Project("sun")), job)
+            card_set.load_branch("other")
+        self.assertIsNone(self.saves.flush(Project("sun")))
+
+        self.assertEqual(self.saves.wait(job.job_id, 5).status, JOB_DONE)
+        self.assertEqual(card_set.repo.heads.master.commit.hexsha, job.commit)
+        time.sleep(0.4)
+        self.assertEqual((job.status, job.saves), (JOB_DONE, 1))
+
+    def test_failed_saves_report_their_error(self):
+        job = self.saves.wait(self.saves.enqueue(Project("missing"), "Save").job_id, 5)
+
+        self.assertEqual(job.status, JOB_FAILED)
+        self.assertIn("does not exist", job.error)
+        with self.assertRaises(KeyError):
+            self.saves.get_job("unknown")
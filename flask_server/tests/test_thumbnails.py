@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from flask_server.src import Path
+from flask_server.src.images import ImageBank, ImageData
+from flask_server.src.thumbnails import ThumbnailCache
+
+
+class TestThumbnailCache(TestCase):
+    def setUp(self):
+        # Create a bank holding one large image and an empty thumbnails folder
+        self.temp_dir = tempfile.mkdtemp()
+        bank_path = os.path.join(self.temp_dir, "images")
+        self.cache_path = os.path.join(self.temp_dir, "thumbnails")
+        os.mkdir(bank_path)
+        os.mkdir(self.cache_path)
+        sample_path = os.path.join(self.temp_dir, "sample.jpg")
+        Image.new('RGB', (2000, 1000), (10, 120, 200)).save(sample_path)
+
+        self.bank = ImageBank(Path(bank_path))
+        self.image_uuid, _ = self.bank.import_image(Path(sample_path), "sample")
+        self.thumbnails = ThumbnailCache(self.bank, Path(self.cache_path))
+
+    def tearDown(self):
+        self.bank.catalog.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_thumbnail_fits_size_bucket(self):
+        path, mimetype = self.thumbnails.get_thumbnail(self.image_uuid, 200)
+
+        self.assertEqual(mimetype, "image/webp")
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (256, 128))
+
+        path, mimetype = self.thumbnails.get_thumbnail(self.image_uuid, 4000, "jpeg")
+        with Image.open(path) as image:
+            self.assertEqual((image.format, image.size), ("JPEG", (1024, 512)))
+
+    def test_thumbnail_is_rebuilt_when_source_changes(self):
+        old_path, _ = self.thumbnails.get_thumbnail(self.image_uuid, 64)
+        self.assertEqual(self.thumbnails.get_thumbnail(self.image_uuid, 64)[0], old_path)
+
+        self.bank.write_image_metadata(self.image_uuid, ImageData("renamed"))
+        self.assertEqual(self.thumbnails.get_thumbnail(self.image_uuid, 64)[0], old_path)
+
+        # Pixels edited behind the bank's back are picked up by its next reconciliation
+        source = self.bank.get_image_path(self.image_uuid)
+        Image.new('RGB', (2000, 1000), (200, 20, 10)).save(source)
+        self.bank.reconcile()
+
+        new_path, _ = self.thumbnails.get_thumbnail(self.image_uuid, 64)
+        self.assertNotEqual(new_path, old_path)
+        self.assertFalse(os.path.exists(old_path))
+        with Image.open(new_path) as image:
+            self.assertGreater(image.convert("RGB").getpixel((10, 10))[0], 150)
+
+    def test_least_recently_used_thumbnails_are_evicted(self):
+        small_path, _ = self.thumbnails.get_thumbnail(self.image_uuid, 64)
+        self.thumbnails.cache.max_bytes = os.path.getsize(small_path) + 1
+
+        large_path, _ = self.thumbnails.get_thumbnail(self.image_uuid, 1024)
+
+        self.assertFalse(os.path.exists(small_path))
+        self.assertTrue(os.path.exists(large_path))
+
+    def test_cache_survives_restart(self):
+        path, _ = self.thumbnails.get_thumbnail(self.image_uuid, 256)
+        self.thumbnails.invalidate(self.image_uuid)
+        self.assertFalse(os.path.exists(path))
+
+        path, _ = self.thumbnails.get_thumbnail(self.image_uuid, 256)
+        restarted = ThumbnailCache(self.bank, Path(self.cache_path))
+        self.assertEqual(restarted.get_etag(self.image_uuid, 256), os.path.basename(path))
+        self.assertEqual(restarted.cache._total_bytes, os.path.getsize(path))